@@ -37,7 +37,7 @@ class BookingCreationFormAdmin(forms.ModelForm):
 
 
 @admin.register(Booking)
-class BookingAdmin(admin.ModelAdmin):
+class BookingAdmin(ModelAdminTotals):
     form = BookingCreationFormAdmin
     list_display = (
         'pk',
@@ -62,9 +62,13 @@ class BookingAdmin(admin.ModelAdmin):
         'sum_to_pay_from_balance',
         'booker_fee',
         'dj_fee',
+        'total_price_cents',
+        'dj_earnings_cents',
         'created_at'
     )
 
+    list_totals = [('total_price_cents', Sum), ('dj_earnings_cents', Sum)]
+
     def price(self, obj):
         return obj.get_price()
 
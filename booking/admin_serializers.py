@@ -186,3 +186,45 @@ class PromocodeAdminSerializer(serializers.ModelSerializer):
                     raise ValidationError({'amount': 'Percent should not be more than 100'})
 
         return super().validate(attrs)
+
+
+class BookingStatsTimeSeriesAdminSerializer(serializers.Serializer):
+    """Query parameters of bookings stats time series"""
+
+    stats = serializers.ChoiceField(choices=['gigs', 'cancelations'], default='gigs')
+    period = serializers.ChoiceField(choices=['day', 'week', 'month'], default='month')
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    from_rollup = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if 'start_date' in attrs and 'end_date' in attrs and attrs['start_date'] > attrs['end_date']:
+            raise ValidationError({'end_date': 'End date should not be before start date'})
+        return super().validate(attrs)
+
+
+class BookingStatsDurationAdminSerializer(serializers.Serializer):
+    """Query parameters of gigs duration distribution"""
+
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    gig_type = serializers.ChoiceField(choices=Booking.TYPES, required=False)
+    by_gig_type = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if 'start_date' in attrs and 'end_date' in attrs and attrs['start_date'] > attrs['end_date']:
+            raise ValidationError({'end_date': 'End date should not be before start date'})
+        return super().validate(attrs)
+
+
+class BookingStatsDashboardAdminSerializer(serializers.Serializer):
+    """Query parameters of dashboard stats"""
+
+    start_date = serializers.DateField(required=False)
+    end_date = serializers.DateField(required=False)
+    profile = serializers.BooleanField(default=False)
+
+    def validate(self, attrs):
+        if 'start_date' in attrs and 'end_date' in attrs and attrs['start_date'] > attrs['end_date']:
+            raise ValidationError({'end_date': 'End date should not be before start date'})
+        return super().validate(attrs)
@@ -13,6 +13,9 @@ from rest_framework.response import Response
 
 from booking.admin_serializers import (BookingChangeRecordAdminSerializer,
                                        BookingDeclineAdminSerializer,
+                                       BookingStatsDashboardAdminSerializer,
+                                       BookingStatsDurationAdminSerializer,
+                                       BookingStatsTimeSeriesAdminSerializer,
                                        PromocodeAdminSerializer,
                                        TransactionAdminSerializer,
                                        WithdrawalAdminSerializer)
@@ -23,6 +26,11 @@ from booking.models import (Booking,
                             Withdrawal)
 from booking.serializers import BookingSerializer
 from main.pagination import StandardResultsSetPagination
+from services.stats import (StatsKPIProvider,
+                            StatsRunner,
+                            StatsServiceCancelationsAggregatedProvider,
+                            StatsServiceGigsAggregatedProvider,
+                            StatsServiceTimeProvider)
 from users.enums import GigTypes, Music
 
 
@@ -184,6 +192,106 @@ class BookingDeclineAdminView(generics.GenericAPIView):
         return Response(serializer.data)
 
 
+class BookingStatsTimeSeriesAdminView(generics.GenericAPIView):
+    """Counts and values (cents) of bookings per day, week or month"""
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    serializer_class = BookingStatsTimeSeriesAdminSerializer
+
+    PROVIDERS = {
+        'gigs': StatsServiceGigsAggregatedProvider,
+        'cancelations': StatsServiceCancelationsAggregatedProvider,
+    }
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            Parameter('stats', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['gigs', 'cancelations']),
+            Parameter('period', openapi.IN_QUERY, type=openapi.TYPE_STRING, enum=['day', 'week', 'month']),
+            Parameter('start_date', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            Parameter('end_date', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            Parameter('from_rollup', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN)
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        provider = self.PROVIDERS[params['stats']](
+            start_date=params.get('start_date'),
+            end_date=params.get('end_date'),
+            from_rollup=params['from_rollup']
+        )
+        return Response(provider.calculate_time_series(params['period']))
+
+
+class BookingMusicPreferencesAdminView(generics.GenericAPIView):
+    """Most common music genres of bookings"""
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(StatsKPIProvider().get_booking_music_preferences())
+
+
+class BookingStatsDashboardAdminView(generics.GenericAPIView):
+    """
+    Dashboard stats of all providers (results, errors and timings),
+    profile=1 adds profile of every metric: wall time, queries, rows and cache hits
+    """
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    serializer_class = BookingStatsDashboardAdminSerializer
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            Parameter('start_date', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            Parameter('end_date', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            Parameter('profile', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN)
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        runner = StatsRunner.for_dashboard(
+            start_date=params.get('start_date'),
+            end_date=params.get('end_date'),
+            profile=params['profile']
+        )
+        return Response(runner.run())
+
+
+class BookingStatsDurationAdminView(generics.GenericAPIView):
+    """Distribution of gigs duration (hours), total or per gig type"""
+
+    permission_classes = [IsAuthenticated, IsAdminUser]
+    serializer_class = BookingStatsDurationAdminSerializer
+
+    @swagger_auto_schema(
+        manual_parameters=[
+            Parameter('start_date', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            Parameter('end_date', openapi.IN_QUERY, type=openapi.TYPE_STRING),
+            Parameter('gig_type', openapi.IN_QUERY, type=openapi.TYPE_INTEGER),
+            Parameter('by_gig_type', openapi.IN_QUERY, type=openapi.TYPE_BOOLEAN)
+        ]
+    )
+    def get(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        params = serializer.validated_data
+
+        provider = StatsServiceTimeProvider(
+            start_date=params.get('start_date'),
+            end_date=params.get('end_date'),
+            gig_type=params.get('gig_type')
+        )
+        if params['by_gig_type']:
+            return Response(provider.calculate_distribution_by_gig_type())
+        return Response(provider.distribution)
+
+
 class WithdrawalAdminFilterSet(FilterSet):
 
     status = CharFilter(method="filter_by_status")
@@ -0,0 +1,52 @@
+from django.db import models
+
+
+class DiscountsSum(models.Func):
+    """
+    Sum of 'calculated_amount' of all promocodes stored in applied_discounts JSON,
+    SQL equivalent of Booking.get_discounts_sum()
+    """
+
+    template = (
+        "(SELECT COALESCE(SUM((discount.value ->> 'calculated_amount')::double precision), 0) "
+        "FROM jsonb_each(COALESCE(%(expressions)s, '{}'::jsonb)) AS discount)"
+    )
+    output_field = models.FloatField()
+
+
+class RoundToCents(models.Func):
+    """
+    Rounds float expression to 2 decimal places like round(value, 2) does in Python
+    """
+
+    template = 'ROUND((%(expressions)s)::numeric, 2)::double precision'
+    output_field = models.FloatField()
+
+
+class Percentile(models.Aggregate):
+    """
+    Continuous percentile of expression values, percentile is a fraction from 0 to 1
+    """
+
+    function = 'PERCENTILE_CONT'
+    name = 'percentile'
+    template = '%(function)s(%(percentile)s) WITHIN GROUP (ORDER BY %(expressions)s)'
+    output_field = models.FloatField()
+
+    def __init__(self, expression, percentile: float, **extra):
+        if not 0 <= percentile <= 1:
+            raise ValueError('Percentile should be from 0 to 1')
+        super().__init__(expression, percentile=float(percentile), **extra)
+
+
+class WidthBucket(models.Func):
+    """
+    Number of equal-width bucket expression value falls in: from 1 to buckets
+    for values in [low, high), 0 below low and buckets + 1 from high
+    """
+
+    function = 'WIDTH_BUCKET'
+    output_field = models.IntegerField()
+
+    def __init__(self, expression, low: int, high: int, buckets: int, **extra):
+        super().__init__(expression, models.Value(low), models.Value(high), models.Value(buckets), **extra)
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from booking.models import Booking
+
+
+class Command(BaseCommand):
+    help = 'Fills total_price_cents, discount_cents and dj_earnings_cents of existing bookings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        max_pk = Booking.objects.aggregate(Max('pk'))['pk__max'] or 0
+
+        updated = 0
+        for start_pk in range(0, max_pk + 1, batch_size):
+            with transaction.atomic():
+                updated += Booking.objects.filter(
+                    pk__gte=start_pk,
+                    pk__lt=start_pk + batch_size
+                ).update_pricing_cents()
+            self.stdout.write(f'{updated} bookings updated (up to pk {start_pk + batch_size - 1})')
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {updated} bookings updated'))
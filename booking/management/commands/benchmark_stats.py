@@ -0,0 +1,68 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from services.stats_benchmark import (PROFILE_SCALES, SCALES, BenchmarkDataGenerator, RatingMemoryBenchmark,
+                                     StatsBenchmark)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measures wall time, queries and peak memory of stats providers and rating calculators, '
+        'optionally generating synthetic data first (use a local database)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--generate',
+            choices=list(SCALES),
+            help='Generate synthetic data of given number of bookings before benchmarking'
+        )
+        parser.add_argument('--seed', type=int, default=0, help='Seed of generated data')
+        parser.add_argument(
+            '--anchor-date',
+            type=datetime.date.fromisoformat,
+            help='Generated data is dated back from this date (today by default)'
+        )
+        parser.add_argument('--repeat', type=int, default=3, help='Runs of every benchmark')
+        parser.add_argument(
+            '--only',
+            nargs='*',
+            help='Benchmark name prefixes to run, e.g. stats.gigs rating.'
+        )
+        parser.add_argument(
+            '--rating-memory-curve',
+            nargs='+',
+            choices=list(PROFILE_SCALES),
+            help='Instead of all benchmarks, measure rating updates growing data to given numbers of profiles'
+        )
+        parser.add_argument('--chunk-size', type=int, help='Records per chunk of rating updates')
+        parser.add_argument('--output', help='JSON file to write results to')
+
+    def handle(self, *args, **options):
+        if options['repeat'] < 1:
+            raise CommandError('Repeat should be at least 1')
+
+        if options['generate']:
+            try:
+                BenchmarkDataGenerator(
+                    SCALES[options['generate']],
+                    seed=options['seed'],
+                    anchor_date=options['anchor_date'],
+                    stdout=self.stdout
+                ).generate()
+            except ValueError as e:
+                raise CommandError(e)
+
+        if options['rating_memory_curve']:
+            benchmark = RatingMemoryBenchmark(options['rating_memory_curve'], seed=options['seed'],
+                                              chunk_size=options['chunk_size'])
+        else:
+            benchmark = StatsBenchmark(repeat=options['repeat'])
+        try:
+            results = benchmark.run(options['only'], stdout=self.stdout)
+        except ValueError as e:
+            raise CommandError(e)
+        if options['output']:
+            StatsBenchmark.write(results, options['output'])
+            self.stdout.write(self.style.SUCCESS(f'Results written to {options["output"]}'))
@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+
+from booking.models import RatingRun
+from booking.tasks import update_ratings
+from services.rating_stats import RatingPipeline
+
+
+class Command(BaseCommand):
+    help = 'Recalculates ratings of performers and bookers changed since the last run'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true',
+                            help='recalculate all profiles, changed records show inaccuracy of incremental runs')
+        parser.add_argument('--shards', type=int,
+                            help='calculate by this number of parallel tasks of Celery workers')
+        parser.add_argument('--vectorized', action='store_true',
+                            help='calculate by NumPy arrays instead of Python loops, requires NumPy')
+
+    def handle(self, *args, **options):
+        if options['shards']:
+            update_ratings(full=options['full'], shards=options['shards'], vectorized=options['vectorized'])
+            self.stdout.write(self.style.SUCCESS(f'{options["shards"]} shards are sent to Celery workers'))
+            return
+        changed = RatingPipeline(incremental=not options['full'], vectorized=options['vectorized']).run()
+        run = RatingRun.objects.get_last()
+        self.stdout.write(self.style.SUCCESS(
+            f'Done: {changed} rating records changed, {run.records_created} created'))
@@ -0,0 +1,37 @@
+import datetime
+
+from dateutil.relativedelta import relativedelta
+from django.core.management.base import BaseCommand
+from django.db.models import Max, Min
+
+from booking.models import Booking, BookingDailyRollup
+
+
+class Command(BaseCommand):
+    help = 'Recalculates daily bookings rollup used by stats (month by month)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', type=datetime.date.fromisoformat)
+        parser.add_argument('--end-date', type=datetime.date.fromisoformat)
+
+    def handle(self, *args, **options):
+        dates = Booking.objects.aggregate(Min('date'), Max('date'))
+        start_date = options['start_date'] or dates['date__min']
+        end_date = options['end_date'] or dates['date__max']
+
+        if start_date is None or end_date is None:
+            self.stdout.write(self.style.SUCCESS('No bookings to roll up'))
+            return
+
+        created = 0
+        month_start = start_date
+        while month_start <= end_date:
+            month_end = min(
+                datetime.date(month_start.year, month_start.month, 1) + relativedelta(months=1, days=-1),
+                end_date
+            )
+            created += BookingDailyRollup.objects.rebuild(month_start, month_end)
+            self.stdout.write(f'{month_start} - {month_end}: {created} rollup rows')
+            month_start = month_end + datetime.timedelta(days=1)
+
+        self.stdout.write(self.style.SUCCESS(f'Done: {created} rollup rows'))
@@ -0,0 +1,25 @@
+import datetime
+
+from django.core.management.base import BaseCommand
+
+from services.stats import take_stats_snapshots
+
+
+class Command(BaseCommand):
+    help = 'Snapshots stats of closed months again (after late corrections of bookings)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-month', type=datetime.date.fromisoformat,
+                            help='any date of the first month, default - month of the first booking')
+        parser.add_argument('--end-month', type=datetime.date.fromisoformat,
+                            help='any date of the last month, default - the last settled month')
+        parser.add_argument('--missing-only', action='store_true',
+                            help='keep existing snapshots, snapshot only missing months')
+
+    def handle(self, *args, **options):
+        saved = take_stats_snapshots(
+            start_month=options['start_month'],
+            end_month=options['end_month'],
+            overwrite=not options['missing_only']
+        )
+        self.stdout.write(self.style.SUCCESS(f'Done: {saved} snapshots saved'))
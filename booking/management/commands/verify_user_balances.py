@@ -0,0 +1,50 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Sum
+
+from booking.models import Transaction, UserBalance
+
+
+class Command(BaseCommand):
+    help = 'Compares stored user balances with balances calculated from transactions history'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--fix',
+            action='store_true',
+            help='Overwrite drifted balances with values calculated from transactions'
+        )
+
+    def handle(self, *args, **options):
+        ledger_balances = dict(
+            Transaction.objects.all().filter_not_hold().order_by().values_list(
+                'user'
+            ).annotate(Sum('amount'))
+        )
+        stored_balances = dict(UserBalance.objects.values_list('user', 'amount'))
+
+        drifted = []
+        for user_pk in sorted(set(ledger_balances) | set(stored_balances)):
+            ledger_amount = ledger_balances.get(user_pk) or 0
+            stored_amount = stored_balances.get(user_pk, 0)
+            if ledger_amount != stored_amount:
+                drifted.append(user_pk)
+                self.stdout.write(
+                    f'user {user_pk}: stored {stored_amount}, ledger {ledger_amount}, '
+                    f'drift {stored_amount - ledger_amount}'
+                )
+
+        if drifted and options['fix']:
+            for user_pk in drifted:
+                with transaction.atomic():
+                    # recalculated under lock as transactions could be added meanwhile
+                    balance = UserBalance.objects.lock(user_pk)
+                    balance.amount = Transaction.objects.all().filter_by_user(
+                        user_pk
+                    ).filter_not_hold().calc_amount_sum() or 0
+                    balance.save()
+            self.stdout.write(self.style.SUCCESS(f'{len(drifted)} balances fixed'))
+        elif drifted:
+            self.stdout.write(self.style.ERROR(f'{len(drifted)} balances drifted'))
+        else:
+            self.stdout.write(self.style.SUCCESS('All balances are correct'))
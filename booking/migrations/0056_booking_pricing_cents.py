@@ -0,0 +1,28 @@
+# Generated by Django 3.2.4 on 2026-10-18 11:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0055_alter_booking_applied_discounts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='booking',
+            name='discount_cents',
+            field=models.IntegerField(db_index=True, default=0, editable=False, verbose_name='Discounts sum in cents'),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='dj_earnings_cents',
+            field=models.IntegerField(db_index=True, default=0, editable=False, verbose_name='DJ earnings in cents'),
+        ),
+        migrations.AddField(
+            model_name='booking',
+            name='total_price_cents',
+            field=models.IntegerField(db_index=True, default=0, editable=False, verbose_name='Total price in cents'),
+        ),
+    ]
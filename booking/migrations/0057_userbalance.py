@@ -0,0 +1,38 @@
+# Generated by Django 3.2.4 on 2026-10-18 11:13
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_user_balances(apps, schema_editor):
+    Transaction = apps.get_model('booking', 'Transaction')
+    UserBalance = apps.get_model('booking', 'UserBalance')
+    balances = Transaction.objects.filter(
+        is_hold=False
+    ).order_by().values('user').annotate(balance=Sum('amount'))
+    UserBalance.objects.bulk_create(
+        [UserBalance(user_id=b['user'], amount=b['balance']) for b in balances.iterator()],
+        batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('booking', '0056_booking_pricing_cents'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='UserBalance',
+            fields=[
+                ('user', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='user_balance', serialize=False, to=settings.AUTH_USER_MODEL)),
+                ('amount', models.BigIntegerField(default=0, verbose_name='Amount')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.RunPython(fill_user_balances, migrations.RunPython.noop),
+    ]
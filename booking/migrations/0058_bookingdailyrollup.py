@@ -0,0 +1,31 @@
+# Generated by Django 3.2.4 on 2026-10-18 11:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0057_userbalance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BookingDailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField(db_index=True, verbose_name='event date')),
+                ('status', models.IntegerField(choices=[(1, 'Not paid'), (2, 'Paid'), (3, 'Declined by booker'), (4, 'Declined by DJ'), (5, 'Success'), (6, 'Completed'), (7, 'Accepted by DJ'), (8, 'Canceled by booker'), (9, 'Canceled by DJ'), (10, 'Rejected'), (11, 'Declined by staff'), (12, 'In dispute'), (13, 'Disputed')], verbose_name='status')),
+                ('dispute_status', models.IntegerField(null=True, verbose_name='dispute status')),
+                ('gig_type', models.IntegerField(choices=[(1, 'Party'), (2, 'Wedding'), (3, 'Radio Play'), (4, 'Birthday Party'), (5, 'Mitzvah'), (6, 'Bar Night'), (7, 'Club'), (8, 'Religious Event'), (9, 'Picnic'), (10, 'Family Reunion'), (11, 'Other')], verbose_name='gig type')),
+                ('clean_mix', models.BooleanField(null=True, verbose_name='clean mix?')),
+                ('virtual_mix', models.BooleanField(null=True, verbose_name='virtual mix?')),
+                ('bookings_count', models.PositiveIntegerField(default=0, verbose_name='bookings count')),
+                ('value_cents', models.BigIntegerField(default=0, verbose_name='value (cents)')),
+            ],
+            options={
+                'verbose_name': 'Booking daily rollup',
+                'verbose_name_plural': 'Booking daily rollups',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 3.2.4 on 2026-10-18 11:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0059_stats_watermark_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatsMonthSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=50, verbose_name='name')),
+                ('month', models.DateField(verbose_name='month (first day)')),
+                ('data', models.JSONField(verbose_name='figures')),
+                ('taken_at', models.DateTimeField(auto_now=True, verbose_name='taken at')),
+            ],
+            options={
+                'verbose_name': 'Stats month snapshot',
+                'verbose_name_plural': 'Stats month snapshots',
+                'unique_together': {('name', 'month')},
+            },
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 3.2.4 on 2026-10-18 11:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0060_statsmonthsnapshot'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RatingRun',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('till', models.DateTimeField(verbose_name='data created till')),
+                ('is_full', models.BooleanField(default=True, verbose_name='full run?')),
+                ('records_changed', models.PositiveIntegerField(default=0, verbose_name='rating records changed')),
+                ('bookings_count', models.PositiveIntegerField(default=0, verbose_name='bookings count')),
+                ('performers_with_bookings', models.PositiveIntegerField(default=0, verbose_name='performers having bookings')),
+                ('bookers_with_bookings', models.PositiveIntegerField(default=0, verbose_name='bookers having bookings')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Rating run',
+                'verbose_name_plural': 'Rating runs',
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.4 on 2026-10-18 12:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0061_ratingrun'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ratingrun',
+            name='records_created',
+            field=models.PositiveIntegerField(default=0, verbose_name='rating records created'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.4 on 2026-10-18 12:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0062_ratingrun_records_created'),
+    ]
+
+    operations = [
+        # table partitioned by month of run_date, partitions are created by RatingHistoryManager
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                migrations.RunSQL(
+                    sql='''
+                        CREATE TABLE "booking_ratinghistory" (
+                            "id" bigserial NOT NULL,
+                            "run_date" date NOT NULL,
+                            "profile_type" smallint NOT NULL,
+                            "profile_id" integer NOT NULL,
+                            "total_rating" smallint NOT NULL,
+                            "avg_booking_star_rating_percentage" smallint NOT NULL,
+                            "signed_time_rating_percentage" smallint NOT NULL,
+                            "number_of_booking_rating_percentage" smallint NOT NULL,
+                            "number_of_disputes_rating_percentage" smallint NOT NULL
+                        ) PARTITION BY RANGE ("run_date");
+                    ''',
+                    reverse_sql='DROP TABLE "booking_ratinghistory";'
+                ),
+            ],
+            state_operations=[
+                migrations.CreateModel(
+                    name='RatingHistory',
+                    fields=[
+                        ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                        ('run_date', models.DateField(verbose_name='run date')),
+                        ('profile_type', models.SmallIntegerField(choices=[(1, 'Performer'), (2, 'Booker')], verbose_name='profile type')),
+                        ('profile_id', models.IntegerField(verbose_name='profile id')),
+                        ('total_rating', models.SmallIntegerField(verbose_name='total rating')),
+                        ('avg_booking_star_rating_percentage', models.SmallIntegerField(verbose_name='stars rating percentage')),
+                        ('signed_time_rating_percentage', models.SmallIntegerField(verbose_name='signed time rating percentage')),
+                        ('number_of_booking_rating_percentage', models.SmallIntegerField(verbose_name='number of bookings rating percentage')),
+                        ('number_of_disputes_rating_percentage', models.SmallIntegerField(verbose_name='number of disputes rating percentage')),
+                    ],
+                    options={
+                        'verbose_name': 'Rating history',
+                        'verbose_name_plural': 'Rating history',
+                    },
+                ),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='ratinghistory',
+            constraint=models.UniqueConstraint(fields=('profile_type', 'profile_id', 'run_date'), include=('total_rating', 'avg_booking_star_rating_percentage', 'signed_time_rating_percentage', 'number_of_booking_rating_percentage', 'number_of_disputes_rating_percentage'), name='booking_ratinghistory_profile_run_date'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 3.2.4 on 2026-10-18 12:32
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('booking', '0063_ratinghistory'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bookingreview',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, db_index=True),
+        ),
+        # reviews weren't edited since they were created as far as is known
+        migrations.RunSQL(
+            sql='UPDATE "booking_bookingreview" SET "updated_at" = "created_at";',
+            reverse_sql=migrations.RunSQL.noop
+        ),
+        migrations.CreateModel(
+            name='RatingProfileChange',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dj_profile_id', models.IntegerField(null=True, verbose_name='performer profile id')),
+                ('booker_profile_id', models.IntegerField(null=True, verbose_name='booker profile id')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True)),
+            ],
+            options={
+                'verbose_name': 'Rating profile change',
+                'verbose_name_plural': 'Rating profile changes',
+            },
+        ),
+    ]
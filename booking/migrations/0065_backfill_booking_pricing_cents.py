@@ -0,0 +1,37 @@
+# Generated by Django 3.2.4 on 2026-10-18 16:05
+
+from django.db import migrations, models, transaction
+from django.db.models import Max
+
+BATCH_SIZE = 5000
+
+
+def backfill_pricing_cents(apps, schema_editor):
+    # the same expressions as BookingQuerySet.update_pricing_cents(),
+    # historical models have no custom querysets
+    from booking.models import BookingQuerySet
+
+    Booking = apps.get_model('booking', 'Booking')
+    expressions = BookingQuerySet.get_pricing_cents_expressions()
+    max_pk = Booking.objects.aggregate(Max('pk'))['pk__max'] or 0
+    for start_pk in range(0, max_pk + 1, BATCH_SIZE):
+        with transaction.atomic():
+            Booking.objects.filter(pk__gte=start_pk, pk__lt=start_pk + BATCH_SIZE).update(**expressions)
+
+
+class Migration(migrations.Migration):
+    # every batch is committed separately to not lock all bookings till the end
+    atomic = False
+
+    dependencies = [
+        ('booking', '0064_rating_profile_changes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='booking',
+            name='dj_earnings_cents',
+            field=models.IntegerField(db_index=True, default=0, editable=False, help_text='Price minus DJ and booker fees, not rounded unlike get_dj_earnings() rounding to 0.1', verbose_name='DJ earnings in cents'),
+        ),
+        migrations.RunPython(backfill_pricing_cents, migrations.RunPython.noop),
+    ]
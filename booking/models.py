@@ -3,16 +3,19 @@ import random
 import string
 from datetime import date, time, timedelta
 
+from django.conf import settings
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
-from django.db.models import Q, Sum
+from django.db import connection, models, transaction
+from django.db.models import Count, F, FloatField, IntegerField, Q, Sum, Value
+from django.db.models.functions import Cast, Coalesce, Greatest, Round
 from django.utils import timezone
 from django.utils.timezone import make_aware
 from django.utils.translation import gettext_lazy as _
 
 from booking.enums import PromocodeType, TransactionPurposes
+from booking.expressions import DiscountsSum, RoundToCents
 from model_utils.tracker import FieldTracker
 from notifications.service import NotifyService
 from users.enums import AccountTypes, GigTypes, Music
@@ -37,6 +40,50 @@ class BookingQuerySet(models.QuerySet):
     def filter_before_and_including_date(self, date):
         return self.filter(date__lte=date)
 
+    @staticmethod
+    def get_price_expression():
+        """SQL equivalent of Booking.get_price()"""
+        price_not_adjusted = (Cast('duration', FloatField()) / 60 + 1) * F('price_per_hour')
+        return RoundToCents(
+            Greatest(price_not_adjusted, Value(float(Booking.MIN_PRICE)))
+            - DiscountsSum('applied_discounts')
+        )
+
+    def with_price(self):
+        """
+        Annotates 'calculated_price' - the same value as Booking.get_price()
+        but calculated by database, so bookings can be aggregated without loading them
+        """
+        return self.annotate(calculated_price=self.get_price_expression())
+
+    @classmethod
+    def get_pricing_cents_expressions(cls) -> dict:
+        """SQL equivalents of persisted price columns, also used by the migration backfilling them"""
+        price = cls.get_price_expression()
+        return {
+            'total_price_cents': Cast(Round(price * 100), IntegerField()),
+            'discount_cents': Cast(Round(DiscountsSum('applied_discounts') * 100), IntegerField()),
+            'dj_earnings_cents': Cast(
+                Round((price - Coalesce('dj_fee', 0.0) - Coalesce('booker_fee', 0.0)) * 100),
+                IntegerField()
+            )
+        }
+
+    def update_pricing_cents(self) -> int:
+        """
+        Recalculates persisted price columns by database,
+        same values as Booking.set_pricing_cents() sets
+        """
+        return self.update(**self.get_pricing_cents_expressions())
+
+    def get_daily_rollup_rows(self):
+        """Bookings grouped by BookingDailyRollup key with their count and value in cents"""
+        return self.filter(date__isnull=False) \
+            .annotate(dispute_status=F('dispute__status')) \
+            .order_by() \
+            .values('date', 'status', 'dispute_status', 'gig_type', 'clean_mix', 'virtual_mix') \
+            .annotate(bookings_count=Count('pk'), value_cents=Sum('total_price_cents'))
+
 
 class BookingManager(models.Manager):
 
@@ -257,6 +304,27 @@ class Booking(models.Model):
         null=True,
         blank=True
     )
+    # persisted results of get_price(), get_discounts_sum() and DJ earnings,
+    # kept in sync by save() to aggregate bookings with plain SUM
+    total_price_cents = models.IntegerField(
+        'Total price in cents',
+        default=0,
+        db_index=True,
+        editable=False
+    )
+    discount_cents = models.IntegerField(
+        'Discounts sum in cents',
+        default=0,
+        db_index=True,
+        editable=False
+    )
+    dj_earnings_cents = models.IntegerField(
+        'DJ earnings in cents',
+        default=0,
+        help_text='Price minus DJ and booker fees, not rounded unlike get_dj_earnings() rounding to 0.1',
+        db_index=True,
+        editable=False
+    )
 
     gig_type = models.IntegerField('gig type', choices=TYPES)
     music_list = ArrayField(
@@ -286,19 +354,25 @@ class Booking(models.Model):
     can_be_rated = models.BooleanField(default=True)
 
     created_at = models.DateTimeField(auto_now_add=True, editable=False)
-    updated_at = models.DateTimeField(auto_now=True, editable=False)
+    updated_at = models.DateTimeField(auto_now=True, editable=False, db_index=True)
 
     objects = BookingManager()
 
     TRACKABLE_FIELDS = ['status', 'decline_comment']
 
-    tracker = FieldTracker(fields=TRACKABLE_FIELDS)
+    # previous date is needed to refresh daily rollup of the day booking moved from
+    tracker = FieldTracker(fields=TRACKABLE_FIELDS + ['date'])
 
     class Meta:
         verbose_name = 'Booking'
         verbose_name_plural = 'Bookings'
 
     def save(self, *args, **kwargs):
+        self.set_calculated_fields()
+        super().save(*args, **kwargs)
+
+    def set_calculated_fields(self):
+        """Fees, pricing and busy dates, set on every save (bulk_create does not call it)"""
         self.adjustment_minutes = self._get_adjustment_minutes()
 
         self.booker_fee = self._get_booker_fee()
@@ -307,11 +381,11 @@ class Booking(models.Model):
         self.dj_fee = self._get_dj_fee()
         self.dj_fee_percent = Booking.SERVICE_FEE_PERCENT_FOR_DJ
 
+        self.set_pricing_cents()
+
         self.dj_busy_dates = Booking.objects.calculate_busy_dates(
             self.date, self.time, self.duration)
 
-        super().save(*args, **kwargs)
-
     def _get_adjustment_minutes(self) -> int:
         """Additional gig time included in minimum price, in minutes."""
         adjustment_sum = Booking.MIN_PRICE - self._get_price_not_adjusted()
@@ -359,6 +433,13 @@ class Booking(models.Model):
     def get_dj_earnings(self) -> float:
         return round(self.get_price() - self.dj_fee - self.booker_fee, 1)
 
+    def set_pricing_cents(self):
+        """Updates persisted price, discounts and DJ earnings (in cents). Fees should be already set."""
+        price = self.get_price()
+        self.total_price_cents = round(price * 100)
+        self.discount_cents = round(self.get_discounts_sum() * 100)
+        self.dj_earnings_cents = round((price - (self.dj_fee or 0) - (self.booker_fee or 0)) * 100)
+
     def get_datetime(self):
         dt = timezone.datetime.strptime(
             f'{str(self.date)} {str(self.time.replace(microsecond=0))}',
@@ -558,7 +639,13 @@ class BookingReview(models.Model):
     is_by_booker = models.BooleanField(default=True)
     created_at = models.DateTimeField(
         auto_now_add=True,
-        editable=False
+        editable=False,
+        db_index=True
+    )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        editable=False,
+        db_index=True
     )
 
 
@@ -587,6 +674,10 @@ class TransactionManager(models.Manager):
         return value if value > 0 else value * (-1)
 
     def get_user_balance(self, user: 'User') -> float:
+        return UserBalance.objects.get_balance(user.pk)
+
+    def calculate_user_balance(self, user: 'User') -> float:
+        """Balance calculated from the whole transactions history of user"""
         return self.all().filter_by_user(user.pk).filter_not_hold().calc_amount_sum() or 0
 
     def is_exist_transaction(self, booking: Booking):
@@ -620,32 +711,37 @@ class TransactionManager(models.Manager):
         if purpose not in self.__get_all_purposes():
             raise ValidationError("Incorrect transaction purpose")
 
-        if purpose in self.__get_user_balance_decrease_purposes():
-            amount = self.convert_to_negative_value(amount)
-            if not self.__check_user_balance_before_decrease(user, amount):
-                raise NotEnoughBalanceForDecrease()
-
-        if isinstance(entity, Booking):
-            return self.update_or_create(
-                amount=amount,
-                user=user,
-                entity=entity.__class__.__name__,
-                entity_pk=entity.pk,
-                purpose=purpose,
-                defaults=dict(is_hold=is_hold)
-            )
-        elif isinstance(entity, Withdrawal):
-            return self.update_or_create(
-                amount=amount,
-                user=user,
-                entity=entity.__class__.__name__,
-                entity_pk=entity.pk,
-                purpose=purpose,
-                defaults=dict(is_hold=is_hold)
-            )
-        else:
-            raise Exception(
-                f"Нет связанных целей (purpose) для изменения баланса на {entity.__class__}")
+        with transaction.atomic():
+
+            if purpose in self.__get_user_balance_decrease_purposes():
+                amount = self.convert_to_negative_value(amount)
+                # balance row stays locked till the end of transaction,
+                # so concurrent decreases can't overdraw it
+                UserBalance.objects.lock(user.pk)
+                if not self.__check_user_balance_before_decrease(user, amount):
+                    raise NotEnoughBalanceForDecrease()
+
+            if isinstance(entity, Booking):
+                return self.update_or_create(
+                    amount=amount,
+                    user=user,
+                    entity=entity.__class__.__name__,
+                    entity_pk=entity.pk,
+                    purpose=purpose,
+                    defaults=dict(is_hold=is_hold)
+                )
+            elif isinstance(entity, Withdrawal):
+                return self.update_or_create(
+                    amount=amount,
+                    user=user,
+                    entity=entity.__class__.__name__,
+                    entity_pk=entity.pk,
+                    purpose=purpose,
+                    defaults=dict(is_hold=is_hold)
+                )
+            else:
+                raise Exception(
+                    f"Нет связанных целей (purpose) для изменения баланса на {entity.__class__}")
 
 
 class Transaction(models.Model):
@@ -691,12 +787,45 @@ class Transaction(models.Model):
     )
     created_at = models.DateTimeField(
         auto_now_add=True,
-        editable=False
+        editable=False,
+        db_index=True
     )
 
+    tracker = FieldTracker(fields=['amount', 'is_hold'])
+
     class Meta:
         ordering = ['-created_at']
 
+    def save(self, *args, **kwargs):
+        balance_change = self._get_balance_change()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if balance_change:
+                UserBalance.objects.increase(self.user_id, balance_change)
+
+    def delete(self, *args, **kwargs):
+        balance_change = -self._get_balance_amount(self.amount, self.is_hold)
+        with transaction.atomic():
+            res = super().delete(*args, **kwargs)
+            if balance_change:
+                UserBalance.objects.increase(self.user_id, balance_change)
+        return res
+
+    @staticmethod
+    def _get_balance_amount(amount: int, is_hold: bool) -> int:
+        """Amount counted in user balance (hold transactions are not)"""
+        return 0 if is_hold else amount
+
+    def _get_balance_change(self) -> int:
+        current = self._get_balance_amount(self.amount, self.is_hold)
+        if self._state.adding:
+            return current
+        previous = self._get_balance_amount(
+            self.tracker.previous('amount'),
+            self.tracker.previous('is_hold')
+        )
+        return current - previous
+
     def __str__(self):
         return '{0}: {1} {2} {3} {4} {5}'.format(
             self.pk,
@@ -708,6 +837,50 @@ class Transaction(models.Model):
         )
 
 
+class UserBalanceManager(models.Manager):
+
+    def get_balance(self, user_pk: int) -> int:
+        return self.filter(user_id=user_pk).values_list('amount', flat=True).first() or 0
+
+    def lock(self, user_pk: int):
+        """Locks balance row of user till the end of current DB transaction"""
+        balance, _ = self.get_or_create(user_id=user_pk)
+        return self.select_for_update().get(pk=balance.pk)
+
+    def increase(self, user_pk: int, amount: int):
+        """Changes balance of user by amount (negative amount decreases it)"""
+        changes = dict(amount=F('amount') + amount, updated_at=timezone.now())
+        if not self.filter(user_id=user_pk).update(**changes):
+            self.get_or_create(user_id=user_pk)
+            self.filter(user_id=user_pk).update(**changes)
+
+
+class UserBalance(models.Model):
+    """
+    Current balance of user (sum of not hold transactions)
+
+    Maintained by Transaction.save() in the same DB transaction,
+    use verify_user_balances command to compare it with transactions history
+    """
+
+    objects = UserBalanceManager()
+
+    user = models.OneToOneField(
+        'users.User',
+        on_delete=models.CASCADE,
+        related_name='user_balance',
+        primary_key=True
+    )
+    amount = models.BigIntegerField(
+        verbose_name='Amount',
+        default=0
+    )
+    updated_at = models.DateTimeField(auto_now=True, editable=False, db_index=True)
+
+    def __str__(self):
+        return '{0}: {1}'.format(self.user, self.amount)
+
+
 class WithdrawalManager(models.Manager):
 
     def convert_to_cents(self, amount: float):
@@ -831,3 +1004,287 @@ class Promocode(models.Model):
             self.promocode_type,
             self.created_at.strftime("%d-%b-%Y (%H:%M:%S.%f)")
         )
+
+
+class BookingDailyRollupManager(models.Manager):
+
+    # first key of advisory locks taken while rollup of some date is refreshed
+    LOCK_NAMESPACE = 7001
+
+    def refresh_dates(self, dates) -> int:
+        """
+        Recalculates rollup rows of given dates from bookings
+
+        Concurrent refreshes of the same date are serialized by advisory locks
+        """
+        dates = sorted(set(d for d in dates if d is not None))
+        if not dates:
+            return 0
+
+        with transaction.atomic():
+            with connection.cursor() as cursor:
+                for date_to_lock in dates:
+                    cursor.execute(
+                        'SELECT pg_advisory_xact_lock(%s, %s)',
+                        [self.LOCK_NAMESPACE, date_to_lock.toordinal()]
+                    )
+            self.filter(date__in=dates).delete()
+            rows = self.bulk_create(
+                [self.model(**row)
+                 for row in Booking.objects.filter(date__in=dates).get_daily_rollup_rows()]
+            )
+        return len(rows)
+
+    def rebuild(self, start_date: date, end_date: date) -> int:
+        """Recalculates rollup rows of all dates between start_date and end_date (including)"""
+        with transaction.atomic():
+            self.filter(date__gte=start_date, date__lte=end_date).delete()
+            rows = Booking.objects.filter(date__gte=start_date, date__lte=end_date) \
+                .get_daily_rollup_rows()
+            created = self.bulk_create([self.model(**row) for row in rows], batch_size=1000)
+        return len(created)
+
+
+class BookingDailyRollup(models.Model):
+    """
+    Number and value of bookings per day and per combination
+    of status, dispute status, gig type, clean mix and virtual mix
+
+    Kept current by booking and dispute signals, stats providers
+    aggregate it instead of bookings, use rebuild_booking_rollup
+    command to recalculate it completely
+    """
+
+    objects = BookingDailyRollupManager()
+
+    date = models.DateField('event date', db_index=True)
+    status = models.IntegerField('status', choices=Booking.Status.choices)
+    dispute_status = models.IntegerField('dispute status', null=True)
+    gig_type = models.IntegerField('gig type', choices=Booking.TYPES)
+    clean_mix = models.BooleanField('clean mix?', null=True)
+    virtual_mix = models.BooleanField('virtual mix?', null=True)
+
+    bookings_count = models.PositiveIntegerField('bookings count', default=0)
+    value_cents = models.BigIntegerField('value (cents)', default=0)
+
+    class Meta:
+        verbose_name = 'Booking daily rollup'
+        verbose_name_plural = 'Booking daily rollups'
+
+    def __str__(self):
+        return '{0}: {1} {2} {3}'.format(
+            self.date,
+            self.status,
+            self.bookings_count,
+            self.value_cents
+        )
+
+
+class StatsMonthSnapshotManager(models.Manager):
+
+    @staticmethod
+    def get_settled_date(month: date) -> date:
+        """
+        Date since which stats of the month (first day) are final: STATS_SNAPSHOT_GRACE_DAYS
+        after its close, before that its bookings can still be completed or disputed
+        and their disputes resolved, so the month is calculated live
+        """
+        grace_days = getattr(settings, 'STATS_SNAPSHOT_GRACE_DAYS', 30)
+        return (month + timedelta(days=31)).replace(day=1) + timedelta(days=grace_days)
+
+    def get_last_settled_month(self) -> date:
+        """The last month (first day) settled by today"""
+        today = timezone.now().date()
+        month = today.replace(day=1)
+        while self.get_settled_date(month) > today:
+            month = (month - timedelta(days=1)).replace(day=1)
+        return month
+
+    def _get_settled_snapshots(self, name: str, end_date: date, fields: list) -> list:
+        """Values of snapshots of settled months taken after the months settled (earlier ones are stale)"""
+        return [
+            values for taken_at, *values in self.filter(
+                name=name, month__lte=min(end_date, self.get_last_settled_month())
+            ).values_list('taken_at', 'month', *fields)
+            if timezone.localdate(taken_at) >= self.get_settled_date(values[0])
+        ]
+
+    def get_closed_months_data(self, name: str, end_date: date) -> dict:
+        """Data of snapshots of settled months starting till end_date, {month: data}"""
+        return dict(self._get_settled_snapshots(name, end_date, ['data']))
+
+    def get_months(self, name: str) -> set:
+        """Months having snapshots which can be read, the rest are taken (again) nightly"""
+        return {month for month, in self._get_settled_snapshots(name, date.max, [])}
+
+    def save_data(self, name: str, month: date, data: dict):
+        self.update_or_create(name=name, month=month, defaults={'data': data})
+
+
+class StatsMonthSnapshot(models.Model):
+    """
+    Additive stats figures (counts and values) of a closed calendar month,
+    frozen for a group of stats providers (name), so reports don't recalculate
+    closed months again
+
+    Taken nightly for new settled months (closed longer than STATS_SNAPSHOT_GRACE_DAYS ago),
+    use snapshot_stats command to take snapshots again after later corrections
+    """
+
+    objects = StatsMonthSnapshotManager()
+
+    name = models.CharField('name', max_length=50)
+    month = models.DateField('month (first day)')
+    data = models.JSONField('figures')
+    taken_at = models.DateTimeField('taken at', auto_now=True)
+
+    class Meta:
+        unique_together = [('name', 'month')]
+        verbose_name = 'Stats month snapshot'
+        verbose_name_plural = 'Stats month snapshots'
+
+    def __str__(self):
+        return f'{self.name}: {self.month:%Y-%m}'
+
+
+class RatingRunManager(models.Manager):
+
+    def get_last(self):
+        return self.order_by('-pk').first()
+
+
+class RatingRun(models.Model):
+    """
+    Run of rating calculation, 'till' is the watermark - data created till it is rated
+
+    Incremental run recalculates only profiles which data was created or changed since the last run,
+    totals of bookings are kept to rescale ratings normalized by average number of bookings
+    """
+
+    objects = RatingRunManager()
+
+    till = models.DateTimeField('data created till')
+    is_full = models.BooleanField('full run?', default=True)
+    records_changed = models.PositiveIntegerField('rating records changed', default=0)
+    records_created = models.PositiveIntegerField('rating records created', default=0)
+    bookings_count = models.PositiveIntegerField('bookings count', default=0)
+    performers_with_bookings = models.PositiveIntegerField('performers having bookings', default=0)
+    bookers_with_bookings = models.PositiveIntegerField('bookers having bookings', default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        verbose_name = 'Rating run'
+        verbose_name_plural = 'Rating runs'
+
+    def __str__(self):
+        return f'{"Full" if self.is_full else "Incremental"} rating run till {self.till}'
+
+    def get_profiles_with_bookings(self, profile: str) -> int:
+        """Number of profiles having bookings, profile - 'dj_profile' or 'booker_profile'"""
+        if profile == 'dj_profile':
+            return self.performers_with_bookings
+        return self.bookers_with_bookings
+
+
+class RatingProfileChange(models.Model):
+    """
+    Change of rating data of a profile not visible by its timestamps
+    (past gig confirmed, edited or deleted, booking, dispute or review deleted),
+    the next incremental RatingPipeline run recalculates the profile; saved by signals,
+    deleted by the run
+
+    Profile ids are not foreign keys, changes are saved while profiles can be deleted too
+    """
+
+    dj_profile_id = models.IntegerField('performer profile id', null=True)
+    booker_profile_id = models.IntegerField('booker profile id', null=True)
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True)
+
+    class Meta:
+        verbose_name = 'Rating profile change'
+        verbose_name_plural = 'Rating profile changes'
+
+    def __str__(self):
+        return f'Rating data of {self.dj_profile_id or self.booker_profile_id} changed at {self.created_at}'
+
+
+class RatingHistoryManager(models.Manager):
+
+    def create_partition(self, month: date):
+        """Creates partition of rows of the month (first day) if it doesn't exist"""
+        next_month = (month + timedelta(days=31)).replace(day=1)
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'CREATE TABLE IF NOT EXISTS {quote_name(f"{self.model._meta.db_table}_{month:%Y_%m}")} '
+                f'PARTITION OF {quote_name(self.model._meta.db_table)} FOR VALUES FROM (%s) TO (%s)',
+                [month, next_month]
+            )
+
+    def get_series(self, profile: str, profile_id: int, start_date: date = None, end_date: date = None) -> list:
+        """
+        Ratings of profile by run dates: [{'run_date', 'total_rating', percentages of sub-ratings}],
+        profile - 'dj_profile' or 'booker_profile'; read by index-only scan of the unique index
+        """
+        rows = self.filter(profile_type=RatingHistory.PROFILE_TYPES[profile], profile_id=profile_id)
+        if start_date is not None:
+            rows = rows.filter(run_date__gte=start_date)
+        if end_date is not None:
+            rows = rows.filter(run_date__lte=end_date)
+        return list(rows.order_by('run_date').values('run_date', 'total_rating', *RatingHistory.PERCENTAGE_FIELDS))
+
+
+class RatingHistory(models.Model):
+    """
+    Ratings of every profile after rating runs, a row per profile and run date
+    (the latest run of a date), appended by RatingPipeline after every run
+
+    Table is partitioned by month of run date (partitions are created by
+    RatingHistoryManager.create_partition), old months are dropped with their
+    partitions. The unique index includes all read columns, so series of a profile
+    are read without visiting the table. id is kept for Django only, it's not indexed
+    """
+
+    class ProfileType(models.IntegerChoices):
+        PERFORMER = 1, 'Performer'
+        BOOKER = 2, 'Booker'
+
+    # RatingRecord profile field -> profile type
+    PROFILE_TYPES = {
+        'dj_profile': ProfileType.PERFORMER,
+        'booker_profile': ProfileType.BOOKER,
+    }
+    # percentages of sub-ratings, the same as of RatingRecord
+    PERCENTAGE_FIELDS = [
+        'avg_booking_star_rating_percentage',
+        'signed_time_rating_percentage',
+        'number_of_booking_rating_percentage',
+        'number_of_disputes_rating_percentage',
+    ]
+
+    objects = RatingHistoryManager()
+
+    id = models.BigAutoField(primary_key=True)
+    run_date = models.DateField('run date')
+    profile_type = models.SmallIntegerField('profile type', choices=ProfileType.choices)
+    profile_id = models.IntegerField('profile id')
+    total_rating = models.SmallIntegerField('total rating')
+    avg_booking_star_rating_percentage = models.SmallIntegerField('stars rating percentage')
+    signed_time_rating_percentage = models.SmallIntegerField('signed time rating percentage')
+    number_of_booking_rating_percentage = models.SmallIntegerField('number of bookings rating percentage')
+    number_of_disputes_rating_percentage = models.SmallIntegerField('number of disputes rating percentage')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['profile_type', 'profile_id', 'run_date'],
+                include=['total_rating', 'avg_booking_star_rating_percentage', 'signed_time_rating_percentage',
+                         'number_of_booking_rating_percentage', 'number_of_disputes_rating_percentage'],
+                name='booking_ratinghistory_profile_run_date'
+            ),
+        ]
+        verbose_name = 'Rating history'
+        verbose_name_plural = 'Rating history'
+
+    def __str__(self):
+        return f'{self.get_profile_type_display()} {self.profile_id}: {self.total_rating} on {self.run_date}'
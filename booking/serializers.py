@@ -126,10 +126,11 @@ class BookingSerializer(serializers.ModelSerializer):
         ret['ext_status'] = instance.ext_status_text()
 
         # checkout page-related
+        price = instance.get_price()
         ret['performer_cost'] = round(instance.duration / 60 * instance.price_per_hour, 2)
         ret['setup_time_cost'] = instance.price_per_hour
-        ret['performance_cost'] = round(instance.get_price() - instance.booker_fee, 2)
-        ret['total_cost'] = instance.get_price()
+        ret['performance_cost'] = round(price - instance.booker_fee, 2)
+        ret['total_cost'] = price
         ret['duration_in_hours'] = instance.duration_in_hours
         ret['discounts'] = instance.get_discounts_sum()
 
@@ -141,14 +142,14 @@ class BookingSerializer(serializers.ModelSerializer):
                 booker.user
             )
 
-            if booker_balance >= PaymentService()._convert_amount_to_cents(instance.get_price()):
-                sum_to_pay_from_balance = instance.get_price()
+            if booker_balance >= PaymentService()._convert_amount_to_cents(price):
+                sum_to_pay_from_balance = price
                 sum_to_pay_from_card = 0
             else:
                 sum_to_pay_from_balance = PaymentService()._convert_amount_to_dollars(
                     booker_balance
                 )
-                sum_to_pay_from_card = instance.get_price() - sum_to_pay_from_balance
+                sum_to_pay_from_card = price - sum_to_pay_from_balance
 
             ret['sum_to_pay_from_balance'] = sum_to_pay_from_balance
             ret['sum_to_pay_from_card'] = sum_to_pay_from_card
@@ -1,9 +1,11 @@
 import datetime
 
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
+from django.utils import timezone
 
-from booking.models import Booking, BookingChangeRecord
+from booking.models import Booking, BookingChangeRecord, BookingDailyRollup, RatingProfileChange
+from users.models import Account
 
 
 @receiver(post_save, sender=Booking)
@@ -39,3 +41,54 @@ def booking_changed(sender, instance, created, **kwargs):
                 is_by_staff=is_by_staff,
                 author=author
             )
+
+    # update stats rollup of the day (and of the previous day if date was changed)
+
+    BookingDailyRollup.objects.refresh_dates([booking.date, booking.tracker.previous('date')])
+
+
+def save_booking_rating_change(booking):
+    # deleted booking data isn't visible by timestamps, both profiles are rated again
+    RatingProfileChange.objects.create(
+        dj_profile_id=Account.objects.filter(pk=booking.account_dj_id).values_list('dj_profile', flat=True).first(),
+        booker_profile_id=Account.objects.filter(pk=booking.account_booker_id).values_list(
+            'booker_profile', flat=True).first()
+    )
+
+
+@receiver(post_delete, sender=Booking)
+def booking_deleted(sender, instance, **kwargs):
+    BookingDailyRollup.objects.refresh_dates([instance.date])
+    save_booking_rating_change(instance)
+
+
+@receiver(post_save, sender='dispute.Dispute')
+def dispute_changed(sender, instance, **kwargs):
+    # rollup is grouped by dispute status
+    BookingDailyRollup.objects.refresh_dates([instance.booking.date])
+    # stats are grouped by dispute status too, booking change moves stats watermark
+    Booking.objects.filter(pk=instance.booking_id).update(updated_at=timezone.now())
+
+
+@receiver(post_delete, sender='dispute.Dispute')
+def dispute_deleted(sender, instance, **kwargs):
+    BookingDailyRollup.objects.refresh_dates([instance.booking.date])
+    Booking.objects.filter(pk=instance.booking_id).update(updated_at=timezone.now())
+    save_booking_rating_change(instance.booking)
+
+
+@receiver(post_delete, sender='booking.BookingReview')
+def review_deleted(sender, instance, **kwargs):
+    save_booking_rating_change(instance.booking)
+
+
+@receiver(post_save, sender='users.PastGig')
+def past_gig_changed(sender, instance, created, **kwargs):
+    # new gigs are found by created_at, confirmation and edits keep it
+    if not created:
+        RatingProfileChange.objects.create(dj_profile_id=instance.dj_profile_id)
+
+
+@receiver(post_delete, sender='users.PastGig')
+def past_gig_deleted(sender, instance, **kwargs):
+    RatingProfileChange.objects.create(dj_profile_id=instance.dj_profile_id)
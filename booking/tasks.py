@@ -1,14 +1,18 @@
 import logging
 from datetime import timedelta
 
+from celery import chord
 from django.db.models.aggregates import Sum
 from django.db.models.expressions import Case, When
 from django.db.models.fields import IntegerField
 from django.utils import timezone
+from django.utils.dateparse import parse_datetime
 
 from booking.models import Booking
 from main.celery_config import app
 from notifications.service import NotifyService
+from services.rating_stats import RatingCalculator, RatingPipeline
+from services.stats import take_stats_snapshots
 from users.services.payment import PaymentService
 from utils.email import (send_awaiting_acceptance_12_hours_before_to_dj,
                          send_awaiting_acceptance_24_hours_before_to_booker,
@@ -263,3 +267,46 @@ def disable_ratings_for_old_bookings():
             to_update.append(booking)
 
     Booking.objects.bulk_update(to_update, ['can_be_rated'], batch_size=100)
+
+
+@app.task(acks_late=True)
+def snapshot_stats_of_closed_months():
+    """Freezes stats of settled months not snapshotted yet (nightly)"""
+    take_stats_snapshots()
+
+
+@app.task(acks_late=True)
+def update_ratings(full: bool = False, shards: int = None, vectorized: bool = False):
+    """
+    Recalculates ratings of profiles changed since the last run, or of all profiles (full),
+    if number of shards is given - by shards of rating records calculated by parallel tasks,
+    vectorized - by RatingEngine (requires NumPy)
+    """
+    pipeline = RatingPipeline(incremental=not full, vectorized=vectorized)
+    if not shards:
+        pipeline.run()
+        return
+
+    created_profiles = pipeline.create_missing_records()
+    created = sum([len(profile_ids) for profile_ids in created_profiles.values()])
+    till = pipeline.till.isoformat()
+    inputs = RatingPipeline.dump_inputs(pipeline.get_shared_inputs(created_profiles))
+    chord(
+        update_ratings_shard.s(till, inputs, first_pk, last_pk, vectorized)
+        for first_pk, last_pk in pipeline.get_shards(shards)
+    )(finish_ratings_update.s(till, inputs, created))
+
+
+@app.task(acks_late=True)
+def update_ratings_shard(till: str, inputs: dict, first_pk: int, last_pk: int, vectorized: bool = False) -> int:
+    """Calculates ratings of records of a shard, returns number of changed records"""
+    return RatingPipeline(till=parse_datetime(till), vectorized=vectorized).process(
+        RatingPipeline.load_inputs(inputs), first_pk, last_pk, update_profiles=False)
+
+
+@app.task(acks_late=True)
+def finish_ratings_update(shards_changed: list, till: str, inputs: dict, created: int = 0):
+    """Updates total ratings and saves the run after all shards are calculated"""
+    RatingCalculator().calculate_and_update_total_rating()
+    RatingPipeline(till=parse_datetime(till)).finish(RatingPipeline.load_inputs(inputs), sum(shards_changed),
+                                                     created)
@@ -1878,3 +1878,114 @@ class BookingTransactionTestCase(AuthClientTestCase):
         )
         self.assertEqual(transactions[4].purpose, TransactionPurposes.BOOKING_FEE_FOR_DJ)
         self.assertEqual(transactions[4].amount, -1 * PaymentService._convert_amount_to_cents(booking.dj_fee))
+
+
+class BookingPriceExpressionTestCase(AuthClientTestCase):
+    """with_price() annotation should give the same price as Booking.get_price()"""
+
+    def __create_booking(self, duration, price_per_hour, applied_discounts=None):
+        booking = self.test_data_service.create_custom_booking(
+            account_booker=self.booker_user.get_account(),
+            account_dj=self.dj_user.get_account()
+        )
+        booking.duration = duration
+        booking.price_per_hour = price_per_hour
+        booking.applied_discounts = applied_discounts
+        booking.save()
+        return booking
+
+    def __assert_same_price(self, booking):
+        calculated_price = Booking.objects.filter(pk=booking.pk).with_price().get().calculated_price
+        self.assertAlmostEqual(calculated_price, booking.get_price(), places=2)
+
+    def test_price_adjusted_to_min_price(self):
+        booking = self.__create_booking(duration=60, price_per_hour=50)
+        self.assertEqual(booking.get_price(), Booking.MIN_PRICE)
+        self.__assert_same_price(booking)
+
+    def test_price_not_adjusted(self):
+        for duration, price_per_hour in [(180, 120), (95, 133.3), (600, 99.99), (1200, 41)]:
+            booking = self.__create_booking(duration=duration, price_per_hour=price_per_hour)
+            self.__assert_same_price(booking)
+
+    def test_price_with_discounts(self):
+        for applied_discounts in [
+            {},
+            {'1': {'calculated_amount': 10}},
+            {'1': {'calculated_amount': 15.5}, '2': {'calculated_amount': 33.33}},
+        ]:
+            booking = self.__create_booking(
+                duration=240, price_per_hour=110.5, applied_discounts=applied_discounts)
+            self.__assert_same_price(booking)
+
+    def test_price_with_full_discount(self):
+        booking = self.__create_booking(
+            duration=60, price_per_hour=100, applied_discounts={'1': {'calculated_amount': 350}})
+        self.assertEqual(booking.get_price(), 0)
+        self.__assert_same_price(booking)
+
+    def test_pricing_cents_on_save(self):
+        booking = self.__create_booking(
+            duration=240, price_per_hour=110.5, applied_discounts={'1': {'calculated_amount': 15.5}})
+        self.assertEqual(booking.total_price_cents, round(booking.get_price() * 100))
+        self.assertEqual(booking.discount_cents, 1550)
+        self.assertEqual(
+            booking.dj_earnings_cents,
+            round((booking.get_price() - booking.dj_fee - booking.booker_fee) * 100)
+        )
+
+    def test_update_pricing_cents(self):
+        for duration, price_per_hour in [(60, 50), (95, 133.3), (600, 99.99)]:
+            self.__create_booking(
+                duration=duration,
+                price_per_hour=price_per_hour,
+                applied_discounts={'1': {'calculated_amount': 10.25}}
+            )
+        expected = {b.pk: (b.total_price_cents, b.discount_cents, b.dj_earnings_cents)
+                    for b in Booking.objects.all()}
+
+        Booking.objects.all().update(total_price_cents=0, discount_cents=0, dj_earnings_cents=0)
+        Booking.objects.all().update_pricing_cents()
+
+        for booking in Booking.objects.all():
+            self.assertEqual(
+                (booking.total_price_cents, booking.discount_cents, booking.dj_earnings_cents),
+                expected[booking.pk]
+            )
+
+
+class UserBalanceTestCase(AuthClientTestCase):
+    """UserBalance should always match the balance calculated from transactions history"""
+
+    def __assert_balance_matches_ledger(self, user):
+        self.assertEqual(
+            Transaction.objects.get_user_balance(user),
+            Transaction.objects.calculate_user_balance(user)
+        )
+
+    def test_balance_on_transactions_change(self):
+        user = self.booker_user
+        for amount in [1000, 2500, -700]:
+            self.test_data_service.create_random_transaction(
+                purpose=TransactionPurposes.PAYMENT, amount=amount, user=user)
+        self.assertEqual(Transaction.objects.get_user_balance(user), 2800)
+        self.__assert_balance_matches_ledger(user)
+
+        transaction = Transaction.objects.filter(user=user).order_by('pk').first()
+        transaction.is_hold = True
+        transaction.save()
+        self.assertEqual(Transaction.objects.get_user_balance(user), 1800)
+        self.__assert_balance_matches_ledger(user)
+
+        transaction.is_hold = False
+        transaction.amount = 1500
+        transaction.save()
+        self.assertEqual(Transaction.objects.get_user_balance(user), 3300)
+        self.__assert_balance_matches_ledger(user)
+
+        transaction.delete()
+        self.assertEqual(Transaction.objects.get_user_balance(user), 1800)
+        self.__assert_balance_matches_ledger(user)
+
+    def test_balance_of_user_without_transactions(self):
+        self.assertEqual(Transaction.objects.get_user_balance(self.dj_user), 0)
@@ -1,4 +1,5 @@
 import random
+from collections import Counter
 from datetime import timedelta
 
 from django.utils import timezone
@@ -428,3 +429,95 @@ class PromocodeAdminTestCase(AuthClientTestCase):
             reverse('booking:promocode_admin_retrieve_update_destroy', args=[pr.pk]))
 
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+
+class BookingMusicPreferencesAdminTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=5)
+
+    def test_access_by_user_without_permissions(self):
+        response = self.client.get(reverse('booking:booking_admin_stats_music_preferences'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_get_music_preferences(self):
+        response = self.staff_client.get(reverse('booking:booking_admin_stats_music_preferences'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        counter = Counter([value for b in Booking.objects.all() for value in b.music_list or []])
+        self.assertEqual(len(response.data), min(len(counter), 5))
+        self.assertEqual(response.data[0]['count'], counter.most_common(1)[0][1])
+
+
+class BookingStatsDashboardAdminTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=5)
+
+    def test_access_by_user_without_permissions(self):
+        response = self.client.get(reverse('booking:booking_admin_stats_dashboard'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_get_dashboard(self):
+        response = self.staff_client.get(reverse('booking:booking_admin_stats_dashboard'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('gigs', response.data['results'])
+        self.assertNotIn('profiles', response.data)
+
+    def test_get_dashboard_profile(self):
+        response = self.staff_client.get(reverse('booking:booking_admin_stats_dashboard'), {'profile': 1})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            set(response.data['profiles']['gigs']['period_reservations_value']),
+            {'wall_time', 'queries', 'rows', 'cache_hits'}
+        )
+
+
+class BookingStatsDurationAdminTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=5)
+
+    def test_access_by_user_without_permissions(self):
+        response = self.client.get(reverse('booking:booking_admin_stats_duration'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_get_duration_distribution(self):
+        response = self.staff_client.get(reverse('booking:booking_admin_stats_duration'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(sum([bucket['count'] for bucket in response.data['histogram']]), 5)
+        self.assertIn('p95', response.data['percentiles'])
+
+    def test_get_duration_distribution_by_gig_type(self):
+        response = self.staff_client.get(
+            reverse('booking:booking_admin_stats_duration'), {'by_gig_type': True})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            sum([sum([b['count'] for b in d['histogram']]) for d in response.data.values()]), 5)
+
+
+class BookingStatsTimeSeriesAdminTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=5)
+
+    def test_access_by_user_without_permissions(self):
+        response = self.client.get(reverse('booking:booking_admin_stats_time_series'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_get_time_series(self):
+        response = self.staff_client.get(
+            reverse('booking:booking_admin_stats_time_series'),
+            {'stats': 'cancelations', 'period': 'month', 'start_date': '2021-01-15', 'end_date': '2021-12-31'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data), 12)
+        self.assertIn('canceled_by_booker_count', response.data[0])
+
+    def test_get_time_series_with_wrong_period(self):
+        response = self.staff_client.get(
+            reverse('booking:booking_admin_stats_time_series'), {'period': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
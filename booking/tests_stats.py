@@ -0,0 +1,919 @@
+import time
+from collections import Counter
+from datetime import date, timedelta
+from functools import partial
+from io import StringIO
+from unittest import skipUnless
+
+from dateutil.relativedelta import relativedelta
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import F
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from booking.enums import TransactionPurposes
+from booking.models import (Booking, BookingDailyRollup, BookingReview, RatingHistory, RatingProfileChange, RatingRun,
+                            StatsMonthSnapshot, Transaction)
+from booking.tasks import update_ratings
+from dispute.models import Dispute
+from main.celery_config import app
+from services.stats import (MUSIC_LABELS,
+                            StatsGeneralProvider,
+                            StatsKPIProvider,
+                            StatsPerformerCreditsProvider,
+                            StatsProvider,
+                            StatsServiceAllDisputesProvider,
+                            StatsServiceCancelationsAggregatedProvider,
+                            StatsServiceCancelationsProvider,
+                            StatsServiceDisputesByMDDProvider,
+                            StatsServiceDisputesWithoutMDDProvider,
+                            StatsServiceGigsAggregatedProvider,
+                            StatsServiceGigsProvider,
+                            StatsServiceTimeProvider,
+                            StatsRunner,
+                            take_stats_snapshots)
+from services import rating_engine
+from services.rating_stats import (PerformersSignedMonthsRatingCalculator, RatingAggregates, RatingCalculator,
+                                   RatingPipeline)
+from services.stats_benchmark import BenchmarkDataGenerator, StatsBenchmark
+from users.models import Account, BookerProfile, DJProfile, PastGig, RatingRecord
+from utils.test import AuthClientTestCase
+
+
+class StatsProviderBookingsValueTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=20)
+        for i, booking in enumerate(Booking.objects.all().order_by('pk')):
+            if i % 2 == 0:
+                booking.applied_discounts = {'1': {'calculated_amount': 12.25 * i}}
+                booking.save()
+
+    def test_bookings_value(self):
+        bookings = Booking.objects.all()
+        self.assertAlmostEqual(
+            StatsProvider()._calculate_bookings_value(bookings),
+            sum([b.get_price() * 100 for b in bookings]),
+            places=2
+        )
+        self.assertEqual(StatsProvider()._calculate_bookings_value(Booking.objects.none()), 0)
+
+    def test_performers_earnings_from_bookings(self):
+        bookings = Booking.objects.all()
+        self.assertAlmostEqual(
+            StatsProvider()._calculate_performers_earnings_from_bookings(bookings),
+            sum([round((b.get_price() - b.dj_fee - b.booker_fee) * 100) for b in bookings])
+        )
+
+
+class StatsServiceGigsAggregatedProviderTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=30)
+        for i, booking in enumerate(Booking.objects.all().order_by('pk')):
+            if i % 3 == 0:
+                booking.status = Booking.Status.COMPLETED
+            if i % 4 == 0:
+                booking.applied_discounts = {'1': {'calculated_amount': 25.5}}
+            booking.save()
+
+    def test_same_results_as_stats_service_gigs_provider(self):
+        for kwargs in [{}, {'start_date': date(2021, 1, 1), 'end_date': date(2021, 12, 31)}]:
+            expected = StatsServiceGigsProvider(**kwargs).calculate_all()
+            result = StatsServiceGigsAggregatedProvider(**kwargs).calculate_all()
+            self.assertEqual(result.keys(), expected.keys())
+            for key, value in expected.items():
+                self.assertAlmostEqual(result[key], value, places=2, msg=key)
+
+    def test_single_query(self):
+        with CaptureQueriesContext(connection) as context:
+            StatsServiceGigsAggregatedProvider(from_snapshots=False).calculate_all(use_cache=False)
+        self.assertEqual(len(context.captured_queries), 1)
+
+
+class StatsGeneralProviderCreditsTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_dj_profiles(count=3)
+        self.test_data_service.create_booker_users(count=3)
+        for i, account in enumerate(Account.objects.all()):
+            self.test_data_service.create_random_transaction(
+                purpose=TransactionPurposes.PAYMENT,
+                amount=1000 * (i + 1),
+                user=account.user
+            )
+
+    def __get_expected_credits(self, profile_lookup):
+        accounts = Account.objects.all().get_valid_for_statistics() \
+            .filter(**{f'{profile_lookup}__isnull': False})
+        total = sum([Transaction.objects.get_user_balance(a.user) for a in accounts])
+        return total, round(total / len(accounts), 2)
+
+    def test_credits_in_accounts(self):
+        provider = StatsGeneralProvider()
+        self.assertEqual(
+            (provider.get_total_credits_in_bookers_accounts(),
+             provider.get_average_credits_in_bookers_accounts()),
+            self.__get_expected_credits('booker_profile')
+        )
+        self.assertEqual(
+            (provider.get_total_credits_in_performers_accounts(),
+             provider.get_average_credits_in_performers_accounts()),
+            self.__get_expected_credits('dj_profile')
+        )
+
+    def test_credits_in_accounts_single_query(self):
+        provider = StatsGeneralProvider()
+        with CaptureQueriesContext(connection) as context:
+            provider.get_total_credits_in_bookers_accounts()
+            provider.get_average_credits_in_bookers_accounts()
+        self.assertEqual(len(context.captured_queries), 1)
+
+
+class StatsCreditsProviderTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=20)
+        self.account = Booking.objects.first().account_dj
+
+    def test_performer_credits(self):
+        bookings = list(Booking.objects.filter_by_dj(self.account))
+        earned = [
+            b for b in bookings
+            if b.status == Booking.Status.COMPLETED or (
+                b.status == Booking.Status.DISPUTED and hasattr(b, 'dispute')
+                and b.dispute.status == Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
+            )
+        ]
+        result = StatsPerformerCreditsProvider(self.account).calculate_all(use_cache=False)
+        self.assertEqual(result['credits_in_the_account'],
+                         Transaction.objects.get_user_balance(self.account.user))
+        self.assertEqual(result['amount_in_escrow'], sum(
+            [b.total_price_cents for b in bookings if b.status == Booking.Status.ACCEPTED_BY_DJ]))
+        self.assertEqual(result['amount_in_pending_bookings'], sum(
+            [b.total_price_cents for b in bookings if b.status == Booking.Status.PAID]))
+        self.assertEqual(result['lifetime_earned_from_performances'],
+                         sum([b.dj_earnings_cents for b in earned]))
+
+    def test_single_query(self):
+        with CaptureQueriesContext(connection) as context:
+            StatsPerformerCreditsProvider(self.account).calculate_all(use_cache=False)
+        self.assertEqual(len(context.captured_queries), 1)
+
+    @override_settings(STATS_CACHE_TTL=60)
+    def test_cached_till_next_transaction(self):
+        expected = StatsPerformerCreditsProvider(self.account).calculate_all()
+        with CaptureQueriesContext(connection) as context:
+            StatsPerformerCreditsProvider(self.account).calculate_all()
+        # watermark only
+        self.assertEqual(len(context.captured_queries), 1)
+
+        self.test_data_service.create_random_transaction(
+            purpose=TransactionPurposes.PAYMENT,
+            amount=1000,
+            user=self.account.user
+        )
+        result = StatsPerformerCreditsProvider(self.account).calculate_all()
+        self.assertEqual(result['credits_in_the_account'], expected['credits_in_the_account'] + 1000)
+
+    @override_settings(STATS_CACHE_TTL=60)
+    def test_cached_till_hold_released(self):
+        booking = Booking.objects.filter_by_dj(self.account).first()
+        Transaction.objects.create_transaction(
+            amount=1000, user=self.account.user, purpose=TransactionPurposes.PAYMENT, entity=booking, is_hold=True
+        )
+        expected = StatsPerformerCreditsProvider(self.account).calculate_all()
+
+        # the same transaction is updated, no new one is created
+        Transaction.objects.create_transaction(
+            amount=1000, user=self.account.user, purpose=TransactionPurposes.PAYMENT, entity=booking, is_hold=False
+        )
+        result = StatsPerformerCreditsProvider(self.account).calculate_all()
+        self.assertEqual(result['credits_in_the_account'], expected['credits_in_the_account'] + 1000)
+
+
+class StatsKPIProviderMusicPreferencesTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_dj_profiles(count=5)
+        self.test_data_service.create_booker_users(count=5)
+        self.test_data_service.create_random_bookings(count=10)
+
+    def __get_expected(self, arrays):
+        counter = Counter([value for array in arrays for value in array or []])
+        return [
+            {'music': MUSIC_LABELS[value], 'count': count}
+            for value, count in sorted(counter.items(), key=lambda item: (-item[1], item[0]))[0:5]
+        ]
+
+    def test_music_preferences(self):
+        provider = StatsKPIProvider()
+        self.assertEqual(
+            provider.get_booker_music_preferences(),
+            self.__get_expected(BookerProfile.objects.values_list('favorite_music', flat=True))
+        )
+        self.assertEqual(
+            provider.get_performer_music_preferences(),
+            self.__get_expected(DJProfile.objects.values_list('music_can_play', flat=True))
+        )
+        self.assertEqual(
+            provider.get_booking_music_preferences(),
+            self.__get_expected(Booking.objects.values_list('music_list', flat=True))
+        )
+
+    def test_single_query(self):
+        with CaptureQueriesContext(connection) as context:
+            StatsKPIProvider().get_booking_music_preferences()
+        self.assertEqual(len(context.captured_queries), 1)
+
+
+class StatsServiceTimeProviderTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=20)
+
+    def test_duration_distribution(self):
+        durations = sorted(Booking.objects.values_list('duration', flat=True))
+        result = StatsServiceTimeProvider().calculate_all(use_cache=False)
+        self.assertEqual(result['minimum_number_of_hours_for_reservation'], round(durations[0] / 60, 1))
+        self.assertEqual(result['maximum_number_of_hours_for_reservation'], round(durations[-1] / 60, 1))
+        self.assertEqual(
+            [bucket['count'] for bucket in result['histogram_of_number_of_hours_for_reservation']],
+            [len([d for d in durations if (hours - 1) * 60 <= d < hours * 60]) for hours in range(1, 13)]
+            + [len([d for d in durations if d >= 12 * 60])]
+        )
+        percentiles = result['percentiles_of_number_of_hours_for_reservation']
+        self.assertLessEqual(percentiles['p90'], percentiles['p95'])
+        self.assertLessEqual(percentiles['p99'], result['maximum_number_of_hours_for_reservation'])
+
+    def test_single_query(self):
+        with CaptureQueriesContext(connection) as context:
+            StatsServiceTimeProvider().calculate_all(use_cache=False)
+        self.assertEqual(len(context.captured_queries), 1)
+
+    def test_distribution_by_gig_type(self):
+        with CaptureQueriesContext(connection) as context:
+            distributions = StatsServiceTimeProvider().calculate_distribution_by_gig_type()
+        self.assertEqual(len(context.captured_queries), 1)
+        for gig_type, label in Booking.TYPES:
+            if label in distributions:
+                self.assertEqual(
+                    distributions[label],
+                    StatsServiceTimeProvider(gig_type=gig_type).distribution
+                )
+
+
+class StatsProviderMemoizationTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=20)
+        for i, booking in enumerate(Booking.objects.all().order_by('pk')):
+            booking.status = [
+                Booking.Status.COMPLETED,
+                Booking.Status.CANCELED_BY_DJ,
+                Booking.Status.DISPUTED
+            ][i % 3]
+            booking.save()
+
+    def test_same_results_as_separate_calls(self):
+        for provider_class in [StatsGeneralProvider,
+                               StatsServiceGigsProvider,
+                               StatsServiceCancelationsProvider,
+                               StatsServiceAllDisputesProvider]:
+            provider = provider_class()
+            expected = {
+                method_name[4:]: getattr(provider, method_name)()
+                for method_name in dir(provider) if method_name.startswith('get_')
+            }
+            self.assertEqual(provider_class().calculate_all(), expected)
+
+    def test_repeated_calculations_avoided(self):
+        provider = StatsServiceGigsProvider()
+        provider.calculate_all(use_cache=False)
+        self.assertGreater(provider.repeated_calculations_avoided, 0)
+        # memoization is limited to calculate_all
+        self.assertFalse(hasattr(provider, '_memo'))
+        with CaptureQueriesContext(connection) as context:
+            provider.get_period_reservations_completed()
+        self.assertEqual(len(context.captured_queries), 1)
+
+
+class StatsProviderProfileTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=10)
+
+    def test_metrics_profile(self):
+        provider = StatsServiceGigsProvider()
+        with CaptureQueriesContext(connection) as context:
+            result = provider.calculate_all(profile=True)
+        self.assertEqual(result, StatsServiceGigsProvider().calculate_all(use_cache=False))
+        self.assertEqual(provider.metrics_profile.keys(), result.keys())
+        self.assertEqual(
+            sum([metric['queries'] for metric in provider.metrics_profile.values()]),
+            len(context.captured_queries)
+        )
+        self.assertEqual(
+            sum([metric['cache_hits'] for metric in provider.metrics_profile.values()]),
+            provider.repeated_calculations_avoided
+        )
+
+    def test_profile_logged(self):
+        with self.assertLogs('django', level='INFO') as logs:
+            StatsServiceGigsProvider().calculate_all(profile=True)
+        self.assertEqual(logs.records[-1].stats_profile['provider'], 'StatsServiceGigsProvider')
+
+    def test_runner_profiles(self):
+        report = StatsRunner.for_dashboard(max_workers=1, profile=True).run()
+        self.assertEqual(report['profiles'].keys(), report['results'].keys())
+        self.assertEqual(report['profiles']['kpi'].keys(), report['results']['kpi'].keys())
+
+
+class BookingDailyRollupTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=30)
+        for i, booking in enumerate(Booking.objects.all().order_by('pk')):
+            booking.status = [
+                Booking.Status.COMPLETED,
+                Booking.Status.CANCELED_BY_BOOKER,
+                Booking.Status.CANCELED_BY_DJ,
+                Booking.Status.PAID
+            ][i % 4]
+            booking.clean_mix = i % 3 == 0
+            booking.save()
+
+    @staticmethod
+    def __get_rollup():
+        return sorted(BookingDailyRollup.objects.values_list(
+            'date', 'status', 'dispute_status', 'gig_type', 'clean_mix', 'virtual_mix',
+            'bookings_count', 'value_cents'
+        ), key=str)
+
+    def test_rollup_kept_current(self):
+        booking = Booking.objects.first()
+        booking.date = booking.date + timedelta(days=45)
+        booking.save()
+        Booking.objects.last().delete()
+
+        rollup = self.__get_rollup()
+        call_command('rebuild_booking_rollup', stdout=StringIO())
+        self.assertEqual(rollup, self.__get_rollup())
+        self.assertEqual(
+            sum([row[6] for row in rollup]),
+            Booking.objects.filter(date__isnull=False).count()
+        )
+
+    def test_providers_from_rollup(self):
+        for provider_class, aggregated_provider_class in [
+            (StatsServiceGigsProvider, StatsServiceGigsAggregatedProvider),
+            (StatsServiceCancelationsProvider, StatsServiceCancelationsAggregatedProvider),
+            (StatsServiceAllDisputesProvider, StatsServiceAllDisputesProvider),
+            (StatsServiceDisputesWithoutMDDProvider, StatsServiceDisputesWithoutMDDProvider),
+            (StatsServiceDisputesByMDDProvider, StatsServiceDisputesByMDDProvider),
+        ]:
+            expected = provider_class().calculate_all()
+            for from_rollup in [False, True]:
+                with CaptureQueriesContext(connection) as context:
+                    result = aggregated_provider_class(
+                        from_rollup=from_rollup, from_snapshots=False
+                    ).calculate_all(use_cache=False)
+                self.assertEqual(len(context.captured_queries), 1)
+                self.assertEqual(result.keys(), expected.keys())
+                for key, value in expected.items():
+                    self.assertAlmostEqual(result[key], value, places=2, msg=key)
+
+
+class StatsMonthSnapshotTestCase(AuthClientTestCase):
+
+    PROVIDERS = [
+        (StatsServiceGigsProvider, StatsServiceGigsAggregatedProvider),
+        (StatsServiceCancelationsProvider, StatsServiceCancelationsAggregatedProvider),
+        (partial(StatsServiceAllDisputesProvider, from_snapshots=False), StatsServiceAllDisputesProvider),
+        (partial(StatsServiceDisputesWithoutMDDProvider, from_snapshots=False),
+         StatsServiceDisputesWithoutMDDProvider),
+        (partial(StatsServiceDisputesByMDDProvider, from_snapshots=False), StatsServiceDisputesByMDDProvider),
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=30)
+        today = date.today()
+        for i, booking in enumerate(Booking.objects.all().order_by('pk')):
+            # bookings of closed months and of the open current month
+            booking.date = today - timedelta(days=23 * i)
+            booking.status = [
+                Booking.Status.COMPLETED,
+                Booking.Status.CANCELED_BY_BOOKER,
+                Booking.Status.DISPUTED,
+                Booking.Status.PAID
+            ][i % 4]
+            booking.save()
+        self.dates = [
+            {},
+            {'start_date': date(today.year - 1, 1, 1), 'end_date': date(today.year - 1, 12, 31)},
+            {'start_date': today - timedelta(days=100), 'end_date': today - timedelta(days=40)},
+        ]
+
+    def __assert_same_results(self):
+        for provider_class, snapshot_provider_class in self.PROVIDERS:
+            for dates in self.dates:
+                expected = provider_class(**dates).calculate_all(use_cache=False)
+                result = snapshot_provider_class(**dates).calculate_all(use_cache=False)
+                self.assertEqual(result.keys(), expected.keys())
+                for key, value in expected.items():
+                    self.assertAlmostEqual(result[key], value, places=2, msg=key)
+
+    def test_same_results_from_snapshots(self):
+        self.assertGreater(take_stats_snapshots(), 0)
+        self.assertEqual(
+            set(StatsMonthSnapshot.objects.values_list('name', flat=True)),
+            {'gigs', 'cancelations', 'disputes'}
+        )
+        # open current month is not snapshotted
+        today = date.today()
+        self.assertFalse(StatsMonthSnapshot.objects.filter(month=date(today.year, today.month, 1)).exists())
+        self.__assert_same_results()
+
+    def test_closed_months_not_calculated_again(self):
+        take_stats_snapshots()
+        self.assertEqual(take_stats_snapshots(), 0)
+
+        end_date = date(date.today().year - 1, 12, 31)
+        with CaptureQueriesContext(connection) as context:
+            StatsServiceGigsAggregatedProvider(start_date=date(end_date.year, 1, 1), end_date=end_date) \
+                .calculate_all(use_cache=False)
+        # snapshots and the rest of report windows
+        self.assertEqual(len(context.captured_queries), 2)
+        self.assertNotIn(f"'{end_date.year}-06-01'::date", context.captured_queries[1]['sql'])
+
+    def test_unsettled_months_calculated_live(self):
+        today = date.today()
+        last_closed_month = today.replace(day=1) - relativedelta(months=1)
+        with override_settings(STATS_SNAPSHOT_GRACE_DAYS=0):
+            take_stats_snapshots()
+        self.assertTrue(StatsMonthSnapshot.objects.filter(month=last_closed_month).exists())
+
+        # booking of the last closed month is disputed after its snapshot was taken
+        booking = Booking.objects.filter(date__gte=last_closed_month, date__lt=today.replace(day=1)).first()
+        booking.status = Booking.Status.DISPUTED if booking.status != Booking.Status.DISPUTED \
+            else Booking.Status.COMPLETED
+        booking.save()
+        with override_settings(STATS_SNAPSHOT_GRACE_DAYS=31):
+            self.__assert_same_results()
+
+    def test_early_snapshots_taken_again(self):
+        take_stats_snapshots()
+        # snapshots taken before their months settled
+        StatsMonthSnapshot.objects.update(taken_at=F('month'))
+        self.assertEqual(StatsMonthSnapshot.objects.get_closed_months_data('gigs', date.today()), {})
+        self.assertEqual(take_stats_snapshots(), StatsMonthSnapshot.objects.count())
+        self.assertEqual(take_stats_snapshots(), 0)
+
+    def test_snapshot_taken_again_after_correction(self):
+        take_stats_snapshots()
+        settled_months_end = StatsMonthSnapshot.objects.get_last_settled_month() + relativedelta(months=1)
+        booking = Booking.objects.filter(date__lt=settled_months_end, status=Booking.Status.PAID).first()
+        booking.status = Booking.Status.COMPLETED
+        booking.save()
+
+        # snapshots are immutable until taken again
+        self.assertEqual(
+            StatsServiceGigsAggregatedProvider().calculate_all(use_cache=False)['lifetime_reservations_completed'],
+            StatsServiceGigsProvider().calculate_all(use_cache=False)['lifetime_reservations_completed'] - 1
+        )
+        call_command('snapshot_stats', stdout=StringIO())
+        self.__assert_same_results()
+
+
+@override_settings(STATS_CACHE_TTL=60)
+class StatsCacheTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=10)
+
+    def test_cached_till_data_changed(self):
+        expected = StatsServiceGigsProvider().calculate_all()
+
+        with CaptureQueriesContext(connection) as context:
+            result = StatsServiceGigsProvider().calculate_all()
+        self.assertEqual(result, expected)
+        # watermark only
+        self.assertEqual(len(context.captured_queries), 1)
+
+        booking = Booking.objects.first()
+        booking.status = Booking.Status.COMPLETED
+        booking.save()
+
+        with CaptureQueriesContext(connection) as context:
+            result = StatsServiceGigsProvider().calculate_all()
+        self.assertEqual(result, StatsServiceGigsProvider().calculate_all(use_cache=False))
+        self.assertGreater(len(context.captured_queries), 1)
+
+    def test_cached_till_dispute_resolved(self):
+        booking = Booking.objects.first()
+        booking.status = Booking.Status.DISPUTED
+        booking.save()
+        dispute, _ = Dispute.objects.update_or_create(booking=booking, defaults={'status': Dispute.Status.OPEN})
+        StatsServiceAllDisputesProvider().calculate_all()
+
+        # resolution doesn't change the booking
+        dispute.status = Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
+        dispute.save()
+        with CaptureQueriesContext(connection) as context:
+            result = StatsServiceAllDisputesProvider().calculate_all()
+        self.assertGreater(len(context.captured_queries), 1)
+        self.assertEqual(result, StatsServiceAllDisputesProvider().calculate_all(use_cache=False))
+
+    def test_cached_till_snapshot_taken(self):
+        StatsServiceGigsAggregatedProvider().calculate_all()
+        take_stats_snapshots(start_month=date(2020, 1, 1), overwrite=True)
+        with CaptureQueriesContext(connection) as context:
+            StatsServiceGigsAggregatedProvider().calculate_all()
+        self.assertGreater(len(context.captured_queries), 1)
+
+    def test_cache_keyed_by_dates(self):
+        StatsServiceGigsProvider().calculate_all()
+        with CaptureQueriesContext(connection) as context:
+            StatsServiceGigsProvider(start_date=date(2021, 1, 1)).calculate_all()
+        self.assertGreater(len(context.captured_queries), 1)
+
+    @override_settings(STATS_CACHE_TTL=0)
+    def test_cache_disabled(self):
+        StatsServiceGigsProvider().calculate_all()
+        with CaptureQueriesContext(connection) as context:
+            StatsServiceGigsProvider().calculate_all()
+        self.assertGreater(len(context.captured_queries), 1)
+
+
+class StatsRunnerTestCase(AuthClientTestCase):
+
+    class BrokenProvider(StatsProvider):
+
+        def get_broken_value(self):
+            raise ValueError('broken')
+
+    class SlowProvider(StatsProvider):
+        """Runs many short queries, each of them is shorter than the timeout"""
+
+        def __init__(self):
+            self.queries = 0
+            self.stopped_by = None
+
+        def get_slow_value(self):
+            try:
+                with connection.cursor() as cursor:
+                    for _ in range(100):
+                        cursor.execute('SELECT pg_sleep(0.05)')
+                        self.queries += 1
+            except Exception as e:
+                self.stopped_by = e
+                raise
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=10)
+
+    def test_dashboard(self):
+        # one worker - providers are calculated in the test transaction
+        report = StatsRunner.for_dashboard(max_workers=1).run()
+        self.assertEqual(report['errors'], {})
+        self.assertEqual(report['results']['gigs'], StatsServiceGigsAggregatedProvider().calculate_all())
+        self.assertEqual(report['timings'].keys(), report['results'].keys())
+
+    def test_partial_results(self):
+        report = StatsRunner({
+            'gigs': StatsServiceGigsProvider(),
+            'broken': self.BrokenProvider(),
+        }, max_workers=1).run()
+        self.assertEqual(list(report['results']), ['gigs'])
+        self.assertEqual(report['errors'], {'broken': 'ValueError: broken'})
+        self.assertEqual(set(report['timings']), {'gigs', 'broken'})
+
+    def test_timed_out_providers_stopped(self):
+        slow_providers = [self.SlowProvider(), self.SlowProvider()]
+        late_provider = self.SlowProvider()
+        # providers are calculated in threads with their own connections, outside of the test transaction,
+        # the late one starts when a slow one releases its worker
+        report = StatsRunner({
+            'broken': self.BrokenProvider(),
+            'slow': slow_providers[0],
+            'other_slow': slow_providers[1],
+            'late': late_provider,
+        }, max_workers=2, timeout=0.5).run()
+        self.assertEqual(report['results'], {})
+        self.assertEqual(report['errors'], {
+            'broken': 'ValueError: broken',
+            'slow': 'Timeout: not calculated in 0.5 s',
+            'other_slow': 'Timeout: not calculated in 0.5 s',
+            'late': 'Timeout: not calculated in 0.5 s',
+        })
+        self.assertEqual(set(report['timings']), set(report['errors']))
+
+        # slow providers stop at their deadline instead of running their queries till the end,
+        # the late one doesn't start its queries after the deadline
+        for _ in range(20):
+            if all([provider.stopped_by is not None for provider in slow_providers]):
+                break
+            time.sleep(0.1)
+        time.sleep(0.2)
+        for provider in slow_providers:
+            self.assertIsNotNone(provider.stopped_by)
+            self.assertLess(provider.queries, 20)
+        self.assertEqual(late_provider.queries, 0)
+
+
+class StatsTimeSeriesTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_random_bookings(count=30)
+        for i, booking in enumerate(Booking.objects.all().order_by('pk')):
+            booking.date = date(2021, 1, 1) + timedelta(days=17 * i)
+            booking.status = [Booking.Status.COMPLETED, Booking.Status.CANCELED_BY_DJ][i % 2]
+            booking.save()
+
+    def test_same_values_as_period_stats(self):
+        series = StatsServiceGigsProvider(
+            start_date=date(2021, 1, 1), end_date=date(2022, 6, 30)
+        ).calculate_time_series('month')
+        self.assertEqual(len(series), 18)
+
+        for row in series:
+            month_end = row['period'] + relativedelta(months=1, days=-1)
+            provider = StatsServiceGigsProvider(start_date=row['period'], end_date=month_end)
+            self.assertEqual(row['completed_count'], provider.get_period_reservations_completed())
+            self.assertEqual(row['completed_value'], provider.get_period_reservations_value())
+
+    def test_single_query(self):
+        for provider in [StatsServiceGigsProvider(), StatsServiceCancelationsProvider(),
+                         StatsServiceCancelationsAggregatedProvider(from_rollup=True)]:
+            for period in StatsProvider.TIME_SERIES_PERIODS:
+                with CaptureQueriesContext(connection) as context:
+                    provider.calculate_time_series(period)
+                self.assertEqual(len(context.captured_queries), 1)
+
+    def test_from_rollup(self):
+        for period in StatsProvider.TIME_SERIES_PERIODS:
+            self.assertEqual(
+                StatsServiceCancelationsAggregatedProvider(from_rollup=True).calculate_time_series(period),
+                StatsServiceCancelationsProvider().calculate_time_series(period)
+            )
+
+
+class StatsBenchmarkTestCase(AuthClientTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_dj_profiles(count=1)
+        self.test_data_service.create_booker_users(count=1)
+
+    def test_generated_data(self):
+        bookings_before = Booking.objects.count()
+        BenchmarkDataGenerator(300, seed=1).generate()
+        self.assertEqual(Booking.objects.count() - bookings_before, 300)
+        self.assertTrue(Booking.objects.filter(status=Booking.Status.DISPUTED, dispute__isnull=False).exists())
+        self.assertEqual(
+            sum(BookingDailyRollup.objects.values_list('bookings_count', flat=True)),
+            Booking.objects.filter(date__isnull=False).count()
+        )
+
+    def test_results(self):
+        BenchmarkDataGenerator(100, seed=1).generate()
+        results = StatsBenchmark(repeat=1).run(['stats.gigs', 'rating.total_rating'])
+        self.assertEqual(results['meta']['bookings'], Booking.objects.count())
+        self.assertIn('stats.gigs', results['results'])
+        self.assertIn('rating.total_rating', results['results'])
+        self.assertEqual(results['results']['stats.gigs_live']['queries'], 1)
+        self.assertEqual(set(results['results']['stats.gigs']), {'wall_time', 'queries', 'peak_memory'})
+
+
+class RatingPipelineTestCase(AuthClientTestCase):
+
+    RATING_FIELDS = [
+        'avg_booking_star_rating', 'avg_booking_star_rating_percentage',
+        'signed_time_rating', 'signed_time_rating_percentage',
+        'number_of_booking_rating', 'number_of_booking_rating_percentage',
+        'number_of_disputes_rating', 'number_of_disputes_rating_percentage',
+    ]
+
+    def setUp(self):
+        super().setUp()
+        self.test_data_service.create_dj_profiles(count=1)
+        self.test_data_service.create_booker_users(count=1)
+        BenchmarkDataGenerator(200, seed=1).generate()
+
+    def __get_ratings(self) -> tuple:
+        return (
+            sorted(RatingRecord.objects.values_list('dj_profile', 'booker_profile', *self.RATING_FIELDS), key=str),
+            sorted(DJProfile.objects.values_list('pk', 'rating')),
+            sorted(BookerProfile.objects.values_list('pk', 'rating')),
+        )
+
+    def __assert_same_ratings(self, ratings, expected):
+        self.assertEqual(ratings[1:], expected[1:])
+        for record, expected_record in zip(ratings[0], expected[0]):
+            for value, expected_value in zip(record, expected_record):
+                self.assertAlmostEqual(value, expected_value, places=9)
+
+    def test_same_ratings_as_calculators(self):
+        with CaptureQueriesContext(connection) as context:
+            for calculator_class in RatingPipeline.CALCULATORS:
+                calculator = calculator_class()
+                calculator.calculate()
+                calculator.update_records()
+            RatingCalculator().calculate_and_update_total_rating()
+        expected = self.__get_ratings()
+        calculators_queries = len(context.captured_queries)
+
+        RatingRecord.objects.update(**{field: 0 for field in self.RATING_FIELDS})
+        with CaptureQueriesContext(connection) as context:
+            RatingPipeline().run()
+        self.__assert_same_ratings(self.__get_ratings(), expected)
+        self.assertLess(len(context.captured_queries), calculators_queries)
+
+    def test_incremental_run(self):
+        today_start = RatingCalculator().get_today_start()
+        RatingPipeline(till=today_start - timedelta(days=30)).run()
+        RatingPipeline(incremental=True).run()
+        self.assertFalse(RatingRun.objects.get_last().is_full)
+        ratings = self.__get_ratings()
+
+        # full run finds nothing to correct
+        self.assertEqual(RatingPipeline().run(), 0)
+        self.__assert_same_ratings(self.__get_ratings(), ratings)
+        # nothing changed since the last run
+        self.assertEqual(RatingPipeline(incremental=True).run(), 0)
+
+    def test_incremental_run_after_data_changed(self):
+        past_gig = PastGig.objects.order_by('pk').first()
+        PastGig.objects.filter(pk=past_gig.pk).update(is_confirm=False)
+        RatingPipeline(till=timezone.now()).run()
+
+        # old past gig is confirmed and old review is edited, their created_at stay the same
+        past_gig.is_confirm = True
+        past_gig.save()
+        review = BookingReview.objects.order_by('pk').first()
+        review.rating = 1 if review.rating != 1 else 5
+        review.save()
+
+        till = timezone.now()
+        RatingPipeline(till=till, incremental=True).run()
+        self.assertFalse(RatingProfileChange.objects.exists())
+        ratings = self.__get_ratings()
+        # full run finds nothing to correct
+        self.assertEqual(RatingPipeline(till=till).run(), 0)
+        self.__assert_same_ratings(self.__get_ratings(), ratings)
+
+    def test_incremental_run_after_data_deleted(self):
+        RatingPipeline(till=timezone.now()).run()
+        BookingReview.objects.order_by('pk').first().delete()
+        Dispute.objects.order_by('pk').first().delete()
+
+        till = timezone.now()
+        RatingPipeline(till=till, incremental=True).run()
+        # full run finds nothing to correct
+        self.assertEqual(RatingPipeline(till=till).run(), 0)
+
+    def test_chunked_run(self):
+        RatingPipeline(chunk_size=1000).run()
+        ratings = self.__get_ratings()
+
+        RatingRecord.objects.update(avg_booking_star_rating=0, number_of_booking_rating=0)
+        RatingPipeline(chunk_size=3).run()
+        self.__assert_same_ratings(self.__get_ratings(), ratings)
+
+        RatingPipeline(till=RatingCalculator().get_today_start() - timedelta(days=30), chunk_size=3).run()
+        RatingPipeline(incremental=True, chunk_size=3).run()
+        self.assertEqual(RatingPipeline(chunk_size=1000).run(), 0)
+
+    @skipUnless(rating_engine.is_available(), 'NumPy is not installed')
+    def test_vectorized_same_ratings(self):
+        aggregates = RatingAggregates(RatingCalculator().get_today_start())
+        engine = rating_engine.RatingEngine(aggregates)
+        for calculator_class in RatingPipeline.CALCULATORS:
+            calculator = calculator_class()
+            calculator.calculate(aggregates)
+            ids, ratings = engine.get_ratings(calculator_class)
+            self.assertEqual(dict(zip(ids.tolist(), ratings.tolist())), calculator.ratings)
+            self.assertEqual(engine.get_percentages(calculator_class, ratings).tolist(),
+                             [calculator.get_rating_percentage(rating) for rating in ratings.tolist()])
+
+        today_start = RatingCalculator().get_today_start()
+        results = []
+        for vectorized in [False, True]:
+            RatingRun.objects.all().delete()
+            RatingRecord.objects.update(**{field: 0 for field in self.RATING_FIELDS})
+            RatingPipeline(vectorized=vectorized, chunk_size=3).run()
+            full_ratings = self.__get_ratings()
+            RatingPipeline(till=today_start - timedelta(days=30), vectorized=vectorized).run()
+            changed = RatingPipeline(incremental=True, vectorized=vectorized, chunk_size=3).run()
+            results.append((full_ratings, changed, self.__get_ratings()))
+        self.assertEqual(results[1], results[0])
+
+    def test_sharded_update(self):
+        RatingPipeline().run()
+        ratings = self.__get_ratings()
+        RatingRecord.objects.update(**{field: 0 for field in self.RATING_FIELDS})
+        DJProfile.objects.update(rating=0)
+        BookerProfile.objects.update(rating=0)
+
+        # shards and the chord callback are executed locally
+        task_always_eager = app.conf.task_always_eager
+        app.conf.task_always_eager = True
+        self.addCleanup(setattr, app.conf, 'task_always_eager', task_always_eager)
+
+        self.assertEqual(len(RatingPipeline().get_shards(3)), 3)
+        update_ratings(full=True, shards=3)
+        self.__assert_same_ratings(self.__get_ratings(), ratings)
+        self.assertTrue(RatingRun.objects.get_last().is_full)
+
+        update_ratings(shards=3)
+        self.assertFalse(RatingRun.objects.get_last().is_full)
+        self.assertEqual(RatingRun.objects.get_last().records_changed, 0)
+
+    def test_missing_records_created(self):
+        RatingPipeline().run()
+        ratings = self.__get_ratings()
+
+        without_records = list(RatingRecord.objects.order_by('pk').values_list('pk', flat=True))[::3]
+        RatingRecord.objects.filter(pk__in=without_records).delete()
+        RatingPipeline(chunk_size=3).run()
+        self.__assert_same_ratings(self.__get_ratings(), ratings)
+        self.assertEqual(RatingRun.objects.get_last().records_created, len(without_records))
+
+        # incremental run calculates created records of profiles which data didn't change
+        without_records = list(RatingRecord.objects.order_by('pk').values_list('pk', flat=True))[1::3]
+        RatingRecord.objects.filter(pk__in=without_records).delete()
+        RatingPipeline(incremental=True, chunk_size=3).run()
+        self.assertFalse(RatingRun.objects.get_last().is_full)
+        self.assertEqual(RatingRun.objects.get_last().records_created, len(without_records))
+        self.assertEqual(RatingPipeline().run(), 0)
+
+        calculator = PerformersSignedMonthsRatingCalculator()
+        calculator.calculate()
+        RatingRecord.objects.filter(dj_profile=min(calculator.ratings)).delete()
+        self.assertEqual(calculator.update_records(chunk_size=3),
+                         {'updated': len(calculator.ratings) - 1, 'created': 1})
+        self.assertEqual(RatingRecord.objects.filter(dj_profile__in=calculator.ratings.keys()).count(),
+                         len(calculator.ratings))
+        # records created meanwhile by another process are kept and not counted
+        self.assertEqual(calculator.create_records([min(calculator.ratings), max(calculator.ratings)]), 0)
+
+    def test_rating_history(self):
+        today_start = RatingCalculator().get_today_start()
+        # runs of two months are saved to their partitions
+        RatingPipeline(till=today_start - relativedelta(months=1)).run()
+        RatingPipeline().run()
+        # repeated run of a date replaces its rows
+        RatingPipeline().run()
+        self.assertEqual(RatingHistory.objects.count(), 2 * RatingRecord.objects.count())
+
+        dj_profile = DJProfile.objects.order_by('pk').first()
+        series = RatingHistory.objects.get_series('dj_profile', dj_profile.pk)
+        self.assertEqual([point['run_date'] for point in series],
+                         [(today_start - relativedelta(months=1)).date(), today_start.date()])
+        self.assertEqual(series[-1]['total_rating'], dj_profile.rating)
+        self.assertEqual(
+            [series[-1][field] for field in RatingHistory.PERCENTAGE_FIELDS],
+            list(RatingRecord.objects.values_list(*RatingHistory.PERCENTAGE_FIELDS).get(dj_profile=dj_profile))
+        )
+        self.assertEqual(RatingHistory.objects.get_series('dj_profile', dj_profile.pk, start_date=today_start.date()),
+                         series[-1:])
+        self.assertEqual(RatingHistory.objects.get_series('booker_profile', dj_profile.pk + 10 ** 6), [])
+
+    def test_total_rating_update(self):
+        RatingPipeline().run()
+        ratings = self.__get_ratings()
+
+        for chunk_size in [None, 3]:
+            DJProfile.objects.update(rating=0)
+            BookerProfile.objects.update(rating=0)
+            result = RatingCalculator().calculate_and_update_total_rating(chunk_size=chunk_size)
+            self.assertEqual(self.__get_ratings(), ratings)
+            self.assertEqual(result['dj_profile']['updated'], RatingRecord.objects.filter(dj_profile__isnull=False).count())
+            self.assertEqual(result['booker_profile']['updated'],
+                             RatingRecord.objects.filter(booker_profile__isnull=False).count())
+
+        # profiles having actual total rating are not updated
+        result = RatingCalculator().calculate_and_update_total_rating()
+        self.assertEqual(result['dj_profile']['updated'], 0)
+        self.assertEqual(result['booker_profile']['updated'], 0)
+
+    def test_aggregates_fetched_once(self):
+        with CaptureQueriesContext(connection) as context:
+            RatingPipeline().calculate()
+        # bookings, disputes, reviews, past gigs and activation dates of performers and bookers
+        self.assertEqual(len(context.captured_queries), 6)
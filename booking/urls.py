@@ -5,7 +5,11 @@ from rest_framework import routers
 from booking.admin_views import (BookingChangeRecordAdminListView,
                                  BookingDeclineAdminView,
                                  BookingListAdminView,
+                                 BookingMusicPreferencesAdminView,
                                  BookingRetrieveAdminView,
+                                 BookingStatsDashboardAdminView,
+                                 BookingStatsDurationAdminView,
+                                 BookingStatsTimeSeriesAdminView,
                                  PromocodeListCreateAdminView,
                                  PromocodeRetrieveUpdateDestroyAdminView,
                                  TransactionListAdminView,
@@ -48,6 +52,10 @@ urlpatterns = [
     path('admin/list/<int:pk>/', BookingRetrieveAdminView.as_view(), name='booking_admin_retrieve'),
     path('admin/list/changes', BookingChangeRecordAdminListView.as_view(), name='booking_admin_changes'),
     path('admin/<int:pk>/decline', BookingDeclineAdminView.as_view(), name='booking_admin_decline'),
+    path('admin/stats/dashboard', BookingStatsDashboardAdminView.as_view(), name='booking_admin_stats_dashboard'),
+    path('admin/stats/duration', BookingStatsDurationAdminView.as_view(), name='booking_admin_stats_duration'),
+    path('admin/stats/music_preferences', BookingMusicPreferencesAdminView.as_view(), name='booking_admin_stats_music_preferences'),
+    path('admin/stats/time_series', BookingStatsTimeSeriesAdminView.as_view(), name='booking_admin_stats_time_series'),
     path('admin/withdrawal/list/', WithdrawalListAdminView.as_view(), name='withdrawal_admin_list'),
     path('admin/withdrawal/list/<int:pk>', WithdrawalRetrieveAdminView.as_view(), name='withdrawal_admin_retrieve'),
     path('admin/transaction/list/', TransactionListAdminView.as_view(), name='transaction_admin_list'),
@@ -0,0 +1,242 @@
+"""
+Vectorized rating math: aggregates are loaded into NumPy arrays aligned by
+profile id, sub-ratings of RatingPipeline.CALCULATORS, their percentages
+and total ratings are calculated by array operations
+
+NumPy is optional, RatingPipeline uses the calculators when it's not installed.
+Results are the same as of the calculators, float operations are done
+in the same order and rounding follows Python round()
+"""
+import calendar
+import datetime
+
+from django.utils import timezone
+
+from services.rating_stats import (BookersStarsRatingCalculator, BookingNumberRatingCalculatorMixin,
+                                   DisputesRatingCalculatorMixin, PerformersStarsRatingCalculator,
+                                   RatingAggregates, RatingCalculator, SignedMonthsRatingCalculatorMixin)
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def is_available() -> bool:
+    return np is not None
+
+
+def round_1(values):
+    """
+    round(value, 1) of every value - half to even by exact value of float like Python round(),
+    np.round() rounds value * 10 already rounded to float (0.35 -> 0.4 instead of 0.3)
+    """
+    # value * 10 as exact sum of scaled and error (value * 8 and value * 2 are exact)
+    low, high = values * 2, values * 8
+    scaled = high + low
+    high_part = scaled - high
+    error = (high - (scaled - high_part)) + (low - high_part)
+
+    floor = np.floor(scaled)
+    # scaled looks like a tie, but exact value is not
+    inexact_ties = (scaled - floor == 0.5) & (error != 0)
+    return np.where(inexact_ties, np.where(error > 0, floor + 1, floor), np.rint(scaled)) / 10
+
+
+def calculate_percentages(ratings, percentage: int):
+    """RatingCalculator.calculate_percentage() of every rating"""
+    return np.where(ratings >= 1, percentage, np.rint(ratings * percentage)).astype(np.int64)
+
+
+def _to_naive_utc(value: datetime.datetime) -> datetime.datetime:
+    if timezone.is_aware(value):
+        return timezone.make_naive(value, datetime.timezone.utc)
+    return value
+
+
+class RatingArrays:
+    """
+    Per profile values as sorted profile ids and aligned values arrays
+
+    ids - sorted unique profile ids, values - name -> array aligned with ids
+    """
+
+    def __init__(self, ids, **values):
+        self.ids = ids
+        self.values = values
+
+    @classmethod
+    def from_dicts(cls, **dicts):
+        """
+        Float arrays of union of profile ids of dicts (profile id -> value), missing values are 0
+        (sums and numbers are exact in float64, divisions give the same floats as of ints)
+        """
+        ids = np.unique(np.fromiter(
+            (profile_id for values in dicts.values() for profile_id in values), dtype=np.int64))
+        values = {}
+        for name, values_dict in dicts.items():
+            values[name] = np.zeros(len(ids), dtype=np.float64)
+            if values_dict:
+                positions = np.searchsorted(ids, np.fromiter(values_dict.keys(), dtype=np.int64,
+                                                             count=len(values_dict)))
+                values[name][positions] = np.fromiter(values_dict.values(), dtype=np.float64,
+                                                       count=len(values_dict))
+        return cls(ids, **values)
+
+    def find(self, profile_ids) -> tuple:
+        """(positions in ids, found mask) of profile ids"""
+        positions = np.minimum(np.searchsorted(self.ids, profile_ids), max(len(self.ids) - 1, 0))
+        found = self.ids[positions] == profile_ids if len(self.ids) else np.zeros(len(profile_ids), dtype=bool)
+        return positions, found
+
+
+class RatingEngine:
+    """
+    Vectorized counterpart of rating calculators, calculates from RatingAggregates
+    shared with them: get_ratings() - (profile ids, ratings) of a calculator class,
+    apply() - new values of RatingRecord fields of records given as arrays
+    """
+
+    def __init__(self, aggregates: RatingAggregates):
+        self.aggregates = aggregates
+
+    def _get_stars_ratings(self, calculator_class) -> tuple:
+        if calculator_class is PerformersStarsRatingCalculator:
+            booking_sums, booking_counts = self.aggregates.get_reviews_ratings('dj_profile', is_by_booker=True)
+            past_gig_sums, past_gig_counts = self.aggregates.get_past_gigs_ratings()
+            arrays = RatingArrays.from_dicts(booking_sums=booking_sums, booking_counts=booking_counts,
+                                             past_gig_sums=past_gig_sums, past_gig_counts=past_gig_counts)
+            sums = arrays.values['booking_sums'] + arrays.values['past_gig_sums']
+            counts = arrays.values['booking_counts'] + arrays.values['past_gig_counts']
+        else:
+            rating_sums, rating_counts = self.aggregates.get_reviews_ratings('booker_profile', is_by_booker=False)
+            arrays = RatingArrays.from_dicts(sums=rating_sums, counts=rating_counts)
+            sums, counts = arrays.values['sums'], arrays.values['counts']
+
+        rated = counts != 0
+        ratings = sums[rated] / counts[rated]
+        if calculator_class is PerformersStarsRatingCalculator:
+            ratings = round_1(ratings)
+        return arrays.ids[rated], ratings
+
+    def _get_booking_number_ratings(self, profile: str) -> tuple:
+        avg_number_of_bookings = self.aggregates.get_average_number_of_bookings(profile)
+        if not avg_number_of_bookings:
+            return np.array([], dtype=np.int64), np.array([], dtype=np.float64)
+        arrays = RatingArrays.from_dicts(bookings=self.aggregates.get_bookings_numbers(profile))
+        return arrays.ids, arrays.values['bookings'] / avg_number_of_bookings
+
+    def _get_months_since_dates(self, dates):
+        """RatingCalculator.get_months_since_date() of every date (datetime64) - months of relativedelta"""
+        now = _to_naive_utc(timezone.now())
+        days_in_month = calendar.monthrange(now.year, now.month)[1]
+
+        months_start = dates.astype('datetime64[M]')
+        months = (now.year * 12 + now.month - 1) - (months_start.astype(np.int64) + 1970 * 12)
+        days = (dates - months_start).astype('timedelta64[D]').astype(np.int64) + 1
+        times = dates - dates.astype('datetime64[D]')
+        now_time = np.timedelta64(now - now.replace(hour=0, minute=0, second=0, microsecond=0), 'us')
+
+        # date moved by months (to month of now, day limited by days in month) compared with now
+        shifted_days = np.minimum(days, days_in_month)
+        after_now = (shifted_days > now.day) | ((shifted_days == now.day) & (times > now_time))
+        before_now = (shifted_days < now.day) | ((shifted_days == now.day) & (times < now_time))
+        in_past = dates <= np.datetime64(now, 'us')
+        months = np.where(in_past & after_now, months - 1, months)
+        months = np.where(~in_past & before_now, months + 1, months)
+        return np.abs(months)
+
+    def _get_signed_months_ratings(self, profile: str) -> tuple:
+        activation_dates = self.aggregates.activation_dates[profile]
+        ids = np.fromiter(activation_dates.keys(), dtype=np.int64, count=len(activation_dates))
+        dates = np.array([_to_naive_utc(date) for date in activation_dates.values()], dtype='datetime64[us]')
+        order = np.argsort(ids)
+        months = self._get_months_since_dates(dates[order])
+        return ids[order], months / self.aggregates.months_since_service_start
+
+    def _get_disputes_ratings(self, profile: str) -> tuple:
+        bookings_numbers = self.aggregates.get_bookings_numbers(profile)
+        disputes_numbers = self.aggregates.get_disputes_numbers(profile)
+        arrays = RatingArrays.from_dicts(
+            bookings=bookings_numbers,
+            disputes={profile_id: number for profile_id, number in disputes_numbers.items()
+                      if profile_id in bookings_numbers}
+        )
+        return arrays.ids, arrays.values['disputes'] / arrays.values['bookings']
+
+    def get_ratings(self, calculator_class) -> tuple:
+        """(sorted profile ids, ratings) as calculated by calculate_ratings() of calculator_class"""
+        if calculator_class in [PerformersStarsRatingCalculator, BookersStarsRatingCalculator]:
+            return self._get_stars_ratings(calculator_class)
+        if issubclass(calculator_class, BookingNumberRatingCalculatorMixin):
+            return self._get_booking_number_ratings(calculator_class.PROFILE)
+        if issubclass(calculator_class, SignedMonthsRatingCalculatorMixin):
+            return self._get_signed_months_ratings(calculator_class.PROFILE)
+        if issubclass(calculator_class, DisputesRatingCalculatorMixin):
+            return self._get_disputes_ratings(calculator_class.PROFILE)
+        raise ValueError(f'{calculator_class.__name__} has no vectorized ratings')
+
+    @staticmethod
+    def get_percentages(calculator_class, ratings):
+        """get_rating_percentage() of calculator_class of every rating"""
+        if calculator_class in [PerformersStarsRatingCalculator, BookersStarsRatingCalculator]:
+            return calculate_percentages(ratings / calculator_class.MAX_STARS_RATING, calculator_class.PERCENTAGE)
+        if issubclass(calculator_class, DisputesRatingCalculatorMixin):
+            return calculator_class.PERCENTAGE - calculate_percentages(ratings, calculator_class.PERCENTAGE)
+        return calculate_percentages(ratings, calculator_class.PERCENTAGE)
+
+    def get_unchanged_profiles_ratings(self, calculator_class, stored_ratings):
+        """
+        get_unchanged_profile_rating() of calculator_class of every stored rating,
+        NaN - stored rating is still actual
+        """
+        unchanged = np.full(len(stored_ratings), np.nan)
+        if not issubclass(calculator_class, BookingNumberRatingCalculatorMixin):
+            return unchanged
+        avg_number_of_bookings = self.aggregates.get_average_number_of_bookings(calculator_class.PROFILE)
+        previous_avg_number_of_bookings = self.aggregates.get_previous_average_number_of_bookings(
+            calculator_class.PROFILE)
+        if not avg_number_of_bookings or not previous_avg_number_of_bookings:
+            return unchanged
+
+        bookings_numbers = np.rint(stored_ratings * previous_avg_number_of_bookings).astype(np.int64)
+        with_bookings = bookings_numbers != 0
+        unchanged[with_bookings] = bookings_numbers[with_bookings] / avg_number_of_bookings
+        return unchanged
+
+    def apply(self, calculator_classes: list, profile_ids: dict, values: dict) -> dict:
+        """
+        New values of RatingRecord fields of records like RatingPipeline sets them
+
+        profile_ids - 'dj_profile'/'booker_profile' -> array of profile ids of records (0 - no profile),
+        values - field -> array of stored values of records, returns new arrays of the same fields
+        """
+        values = {field: array.copy() for field, array in values.items()}
+        for calculator_class in calculator_classes:
+            ids, ratings = self.get_ratings(calculator_class)
+            record_profiles = profile_ids[calculator_class.PROFILE]
+            positions, found = RatingArrays(ids).find(record_profiles)
+            found &= record_profiles != 0
+
+            new_ratings = np.where(found, ratings[positions] if len(ratings) else 0.0,
+                                   values[calculator_class.RATING_FIELD])
+            update = found
+            if self.aggregates.previous_run is not None:
+                changed_profiles = np.fromiter(self.aggregates.profiles[calculator_class.PROFILE], dtype=np.int64)
+                unchanged = ~found & (record_profiles != 0) & ~np.isin(record_profiles, changed_profiles)
+                unchanged_ratings = self.get_unchanged_profiles_ratings(
+                    calculator_class, values[calculator_class.RATING_FIELD])
+                unchanged &= ~np.isnan(unchanged_ratings)
+                new_ratings = np.where(unchanged, unchanged_ratings, new_ratings)
+                update = found | unchanged
+
+            percentage_field = f'{calculator_class.RATING_FIELD}_percentage'
+            values[calculator_class.RATING_FIELD] = new_ratings
+            values[percentage_field] = np.where(update, self.get_percentages(calculator_class, new_ratings),
+                                                values[percentage_field])
+        return values
+
+    @staticmethod
+    def get_total_ratings(values: dict):
+        """RatingCalculator.get_total_rating() of every record"""
+        return RatingCalculator.STABILIZER + sum([values[field] for field in RatingCalculator.TOTAL_RATING_FIELDS])
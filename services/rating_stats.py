@@ -1,31 +1,294 @@
 from dateutil.relativedelta import relativedelta
 
 import logging
+import time
 logger = logging.getLogger('django')
 
 from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
 from django.utils import timezone
 from django.utils.timezone import make_aware
-from django.db import transaction
-from django.db.models.aggregates import Avg, Count, Sum
-from django.db.models import F
+from django.db import connection, transaction
+from django.db.models.aggregates import Count, Max, Min, Sum
+from django.db.models import Exists, OuterRef, Q
+from django.utils.functional import cached_property
 
-from booking.models import Booking, BookingReview
+from booking.models import Booking, BookingReview, RatingHistory, RatingProfileChange, RatingRun
 from dispute.models import Dispute
 from users.models import PastGig
 
-from utils.loggers import current_func_name
+
+def bulk_update_rows(model, fields: list, rows: list) -> int:
+    """
+    Saves rows (pk and values of fields) by a single UPDATE ... FROM (VALUES ...)
+    statement, returns number of updated rows
+
+    Unlike bulk_update() no CASE WHEN expression is built per object,
+    so thousands of rows are written in milliseconds
+    """
+    if not rows:
+        return 0
+    quote_name = connection.ops.quote_name
+    model_fields = [model._meta.pk] + [model._meta.get_field(field) for field in fields]
+    columns = [quote_name(field.column) for field in model_fields]
+    row_sql = '(' + ', '.join([
+        f'%s::{field.rel_db_type(connection) if field.primary_key else field.db_type(connection)}'
+        for field in model_fields
+    ]) + ')'
+    sql = (
+        f'UPDATE {quote_name(model._meta.db_table)} AS target '
+        f'SET {", ".join([f"{column} = source.{column}" for column in columns[1:]])} '
+        f'FROM (VALUES {", ".join([row_sql] * len(rows))}) AS source ({", ".join(columns)}) '
+        f'WHERE target.{columns[0]} = source.{columns[0]}'
+    )
+    params = [
+        field.get_db_prep_save(value, connection)
+        for row in rows for field, value in zip(model_fields, row)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.rowcount
+
+
+def bulk_insert_new(model, objects: list, returning: str = 'pk') -> list:
+    """
+    Inserts objects by a single INSERT ... ON CONFLICT DO NOTHING statement,
+    returns values of returning field of actually inserted rows - objects conflicting
+    with existing rows are skipped (bulk_create() with ignore_conflicts doesn't tell which)
+    """
+    if not objects:
+        return []
+    quote_name = connection.ops.quote_name
+    fields = [field for field in model._meta.concrete_fields if field is not model._meta.auto_field]
+    returning_field = model._meta.pk if returning == 'pk' else model._meta.get_field(returning)
+    row_sql = '(' + ', '.join(['%s'] * len(fields)) + ')'
+    sql = (
+        f'INSERT INTO {quote_name(model._meta.db_table)} '
+        f'({", ".join([quote_name(field.column) for field in fields])}) '
+        f'VALUES {", ".join([row_sql] * len(objects))} ON CONFLICT DO NOTHING '
+        f'RETURNING {quote_name(returning_field.column)}'
+    )
+    params = [
+        field.get_db_prep_save(field.pre_save(instance, True), connection)
+        for instance in objects for field in fields
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return [row[0] for row in cursor.fetchall()]
+
+
+def bulk_update_values(model, objects: list, fields: list) -> int:
+    """Saves fields of objects by bulk_update_rows()"""
+    attnames = [model._meta.pk.attname] + [model._meta.get_field(field).attname for field in fields]
+    return bulk_update_rows(model, fields, [
+        [getattr(instance, attname) for attname in attnames] for instance in objects
+    ])
+
+
+class RatingAggregates:
+    """
+    Base aggregates all rating calculators are calculated from,
+    of data created till 'till' datetime
+
+    Every aggregate is fetched by a single query on the first use,
+    so calculators sharing aggregates don't query the same data again
+
+    profiles - 'dj_profile'/'booker_profile' -> ids, limits per profile aggregates
+    to these profiles (None - all profiles), activation_profiles - the same for
+    activation dates, previous_run - RatingRun the ratings stored in records
+    were calculated by, bookings_totals and months_since_service_start - already
+    fetched values of these properties
+    """
+
+    def __init__(self, till, profiles: dict = None, activation_profiles: dict = None,
+                 previous_run: RatingRun = None, bookings_totals: dict = None,
+                 months_since_service_start: int = None):
+        self.till = till
+        self.profiles = profiles
+        self.activation_profiles = activation_profiles
+        self.previous_run = previous_run
+        if bookings_totals is not None:
+            self.bookings_totals = bookings_totals
+        if months_since_service_start is not None:
+            self.months_since_service_start = months_since_service_start
+
+    def _sum_by(self, rows, key: str, field: str) -> dict:
+        """Sums field of rows (dicts) by key, rows with key None or of not given profiles are skipped"""
+        result = {}
+        for row in rows:
+            if row[key] is None or (self.profiles is not None and row[key] not in self.profiles[key]):
+                continue
+            result[row[key]] = result.get(row[key], 0) + (row[field] or 0)
+        return result
+
+    def _filter_profiles(self, queryset, dj_profile: str, booker_profile: str = None):
+        if self.profiles is None:
+            return queryset
+        profiles_filter = Q(**{f'{dj_profile}__in': self.profiles['dj_profile']})
+        if booker_profile is not None:
+            profiles_filter |= Q(**{f'{booker_profile}__in': self.profiles['booker_profile']})
+        return queryset.filter(profiles_filter)
+
+    def _group_by_profiles(self, queryset, dj_profile: str, booker_profile: str, fields: tuple = (),
+                           **aggregates) -> list:
+        """
+        Aggregates of queryset per pair of performer and booker profiles (lookups)
+        and fields, profiles are in 'dj_profile' and 'booker_profile' of rows
+        """
+        rows = self._filter_profiles(queryset, dj_profile, booker_profile) \
+            .order_by().values(dj_profile, booker_profile, *fields).annotate(**aggregates)
+        return [
+            {'dj_profile': row.pop(dj_profile), 'booker_profile': row.pop(booker_profile), **row}
+            for row in rows
+        ]
+
+    @cached_property
+    def bookings(self) -> list:
+        """Number of bookings per pair of performer and booker profiles"""
+        return self._group_by_profiles(
+            Booking.objects.filter(created_at__lte=self.till),
+            'account_dj__dj_profile', 'account_booker__booker_profile',
+            bookings_count=Count('pk')
+        )
+
+    @cached_property
+    def disputes(self) -> list:
+        """Number of disputes per pair of performer and booker profiles"""
+        return self._group_by_profiles(
+            Dispute.objects.filter(created_at__lte=self.till),
+            'booking__account_dj__dj_profile', 'booking__account_booker__booker_profile',
+            disputes_count=Count('pk')
+        )
+
+    @cached_property
+    def reviews(self) -> list:
+        """Sum and number of review ratings per author side and pair of profiles"""
+        return self._group_by_profiles(
+            BookingReview.objects.filter(created_at__lte=self.till),
+            'booking__account_dj__dj_profile', 'booking__account_booker__booker_profile',
+            fields=('is_by_booker',),
+            rating_sum=Sum('rating'),
+            rating_count=Count('rating')
+        )
+
+    @cached_property
+    def past_gigs(self) -> list:
+        """Sum and number of confirmed past gig ratings per performer profile"""
+        return list(
+            self._filter_profiles(PastGig.objects.filter(
+                is_confirm=True,
+                created_at__lte=self.till
+            ), 'dj_profile').order_by().values(
+                'dj_profile'
+            ).annotate(
+                rating_sum=Sum('value'),
+                rating_count=Count('value')
+            )
+        )
+
+    @cached_property
+    def activation_dates(self) -> dict:
+        """'dj_profile' and 'booker_profile' -> {profile id: email activation date}"""
+        from users.models import BookerProfile, DJProfile
+
+        activation_dates = {}
+        for profile, profile_model in [('dj_profile', DJProfile), ('booker_profile', BookerProfile)]:
+            profiles = profile_model.objects.filter(
+                user__is_email_active=True,
+                user__email_activation_date__lte=self.till
+            )
+            if self.activation_profiles is not None:
+                profiles = profiles.filter(pk__in=self.activation_profiles[profile])
+            activation_dates[profile] = dict(profiles.values_list('pk', 'user__email_activation_date'))
+        return activation_dates
+
+    def get_bookings_numbers(self, profile: str) -> dict:
+        """profile id -> number of bookings, profile - 'dj_profile' or 'booker_profile'"""
+        return self._sum_by(self.bookings, profile, 'bookings_count')
+
+    @cached_property
+    def bookings_totals(self) -> dict:
+        """
+        Number of all bookings ('bookings_count') and number of profiles
+        having bookings ('dj_profile', 'booker_profile')
+        """
+        if self.profiles is None:
+            return {
+                'bookings_count': sum([row['bookings_count'] for row in self.bookings]),
+                'dj_profile': len(self.get_bookings_numbers('dj_profile')),
+                'booker_profile': len(self.get_bookings_numbers('booker_profile')),
+            }
+        return self.fetch_bookings_totals()
+
+    def fetch_bookings_totals(self) -> dict:
+        """bookings_totals of all profiles by a single query"""
+        return Booking.objects.filter(
+            created_at__lte=self.till
+        ).aggregate(
+            bookings_count=Count('pk'),
+            dj_profile=Count('account_dj__dj_profile', distinct=True),
+            booker_profile=Count('account_booker__booker_profile', distinct=True)
+        )
+
+    @cached_property
+    def months_since_service_start(self) -> int:
+        return RatingCalculator().months_since_service_start
+
+    def get_average_number_of_bookings(self, profile: str) -> float:
+        """Number of all bookings per profile having bookings (None - no profiles)"""
+        if self.bookings_totals[profile]:
+            return self.bookings_totals['bookings_count'] / self.bookings_totals[profile]
+
+    def get_previous_average_number_of_bookings(self, profile: str) -> float:
+        """Average number of bookings ratings of previous run are normalized by"""
+        if self.previous_run is not None and self.previous_run.get_profiles_with_bookings(profile):
+            return self.previous_run.bookings_count / self.previous_run.get_profiles_with_bookings(profile)
+
+    def get_disputes_numbers(self, profile: str) -> dict:
+        """profile id -> number of disputes, profile - 'dj_profile' or 'booker_profile'"""
+        return self._sum_by(self.disputes, profile, 'disputes_count')
+
+    def get_reviews_ratings(self, profile: str, is_by_booker: bool) -> tuple:
+        """(profile id -> sum of ratings, profile id -> number of ratings) of reviews about profile"""
+        reviews = [row for row in self.reviews if row['is_by_booker'] == is_by_booker]
+        return self._sum_by(reviews, profile, 'rating_sum'), self._sum_by(reviews, profile, 'rating_count')
+
+    def get_past_gigs_ratings(self) -> tuple:
+        """(dj profile id -> sum of ratings, dj profile id -> number of ratings) of past gigs"""
+        return (self._sum_by(self.past_gigs, 'dj_profile', 'rating_sum'),
+                self._sum_by(self.past_gigs, 'dj_profile', 'rating_count'))
 
 
 class RatingCalculator:
     """
     Class containing common methods for every Rating calculator
+
+    Calculator gets its ratings (profile id -> sub-rating) from RatingAggregates
+    in calculate_ratings() and stores them in RATING_FIELD and its percentage
+    of RatingRecord of PROFILE
     """
 
     STABILIZER = 35
     MAX_STARS_RATING = 5
     MONTHS_IN_YEAR = 12
 
+    # percentages of sub-ratings summed up with STABILIZER into total rating
+    TOTAL_RATING_FIELDS = [
+        'avg_booking_star_rating_percentage',
+        'signed_time_rating_percentage',
+        'number_of_booking_rating_percentage',
+        'number_of_disputes_rating_percentage',
+    ]
+
+    # records read and written at once
+    CHUNK_SIZE = 2000
+
+    # 'dj_profile' or 'booker_profile'
+    PROFILE = None
+    # sub-rating field of RatingRecord, its percentage is in '[RATING_FIELD]_percentage'
+    RATING_FIELD = None
+    PERCENTAGE = 0
+
     def calculate_percentage(self, rating: float, percentage: int) -> int:
         """
         Calculates share in Total Rating for user based on parameters:
@@ -52,451 +315,694 @@ class RatingCalculator:
         )
         return abs(delta.years) * self.MONTHS_IN_YEAR + abs(delta.months)
 
-    def get_rating_records_for_djs(self):
-        from users.models import RatingRecord
-        return RatingRecord.objects.filter(
-            dj_profile__in=self.ratings.keys()).only('pk', 'dj_profile_id')
-
-    def get_rating_records_for_bookers(self):
-        from users.models import RatingRecord
-        return RatingRecord.objects.filter(
-            booker_profile__in=self.ratings.keys()).only('pk', 'booker_profile_id')
-
-    def _bulk_update_records(self, objects, fields):
-        from users.models import RatingRecord
-        RatingRecord.objects.bulk_update(objects, fields, batch_size=100)
-
-    def calculate_and_update_total_rating(self):
+    @classmethod
+    def get_total_rating(cls, record) -> int:
+        return cls.STABILIZER + sum([getattr(record, field) for field in cls.TOTAL_RATING_FIELDS])
 
-        from users.models import RatingRecord, BookerProfile, DJProfile
+    def calculate_ratings(self, aggregates: RatingAggregates) -> dict:
+        """Sub-rating of every profile (profile id -> rating), no ratings for the base calculator used as helper"""
+        return {}
 
-        with transaction.atomic():
-            records_for_djs = RatingRecord.objects.filter(
-                dj_profile__isnull=False
-            ).select_related('dj_profile').select_for_update()
-            to_update = []
-            for r in records_for_djs:
-                total_rating = self.STABILIZER + \
-                    r.avg_booking_star_rating_percentage + \
-                    r.signed_time_rating_percentage + \
-                    r.number_of_booking_rating_percentage + \
-                    r.number_of_disputes_rating_percentage
-                dj_profile = r.dj_profile
-                dj_profile.rating = total_rating
-                to_update.append(dj_profile)
-            DJProfile.objects.bulk_update(to_update, ['rating'], batch_size=100)
-
-            records_for_bookers = RatingRecord.objects.filter(
-                booker_profile__isnull=False
-            ).select_related('booker_profile').select_for_update()
-            to_update = []
-            for r in records_for_bookers:
-                total_rating = self.STABILIZER + \
-                    r.avg_booking_star_rating_percentage + \
-                    r.signed_time_rating_percentage + \
-                    r.number_of_booking_rating_percentage + \
-                    r.number_of_disputes_rating_percentage
-                booker_profile = r.booker_profile
-                booker_profile.rating = total_rating
-                to_update.append(booker_profile)
-            BookerProfile.objects.bulk_update(to_update, ['rating'], batch_size=100)
-
-class PerformersStarsRatingCalculator(RatingCalculator):
+    def calculate(self, aggregates: RatingAggregates = None):
+        """Calculates ratings, from aggregates shared with other calculators if given"""
+        if aggregates is None:
+            aggregates = RatingAggregates(self.get_today_start())
+        self.ratings = self.calculate_ratings(aggregates)
 
-    PERCENTAGE = 35
+        # arguments are formatted only when debug is logged, ratings can have millions of profiles
+        logger.debug('%s.calculate: %s ratings for %s', self.__class__.__name__, len(self.ratings), aggregates.till)
+        logger.debug('ratings: %s', self.ratings)
 
-    def get_rating_for_performers(self):
+    def get_rating_percentage(self, rating: float) -> int:
+        return self.calculate_percentage(rating, self.PERCENTAGE)
 
-        logger.debug(f"{__class__.__name__}.{current_func_name()}: for {self.get_today_start()}")
+    def get_unchanged_profile_rating(self, record, aggregates: RatingAggregates) -> float:
+        """
+        New rating of profile which data has not changed since the previous run
+        (incremental run), None - stored rating is still actual
+        """
+        return None
 
-        # collects list of (dj_profile, rating_sum, rating_count)
-        booking_ratings_values = BookingReview.objects.filter(
-            is_by_booker=True,
-            created_at__lte=self.get_today_start()
-        ).values(
-            'booking__account_dj__dj_profile'
-        ).annotate(
-            rating_sum=Sum('rating'),
-            rating_count=Count('rating'),
-            dj_profile=F('booking__account_dj__dj_profile')
-        )
+    def set_rating(self, record, rating: float):
+        setattr(record, self.RATING_FIELD, rating)
+        setattr(record, f'{self.RATING_FIELD}_percentage', self.get_rating_percentage(rating))
 
-        booking_ratings = {p['dj_profile']: (p['rating_sum'], p['rating_count'],) for p in booking_ratings_values}
-        logger.debug(f"booking_ratings: {booking_ratings}")
-
-        # collects list of (dj_profile, rating_sum, rating_count for past gig)
-        past_gig_ratings_values = PastGig.objects.filter(
-            is_confirm=True,
-            created_at__lte=self.get_today_start()
-        ).values(
-            'dj_profile'
-        ).annotate(
-            rating_sum=Sum('value'),
-            rating_count=Count('value')
-        )
+    def get_rating_records(self):
+        from users.models import RatingRecord
+        return RatingRecord.objects.filter(
+            **{f'{self.PROFILE}__isnull': False}).only('pk', f'{self.PROFILE}_id')
 
-        past_gig_ratings = {p['dj_profile']: (p['rating_sum'], p['rating_count'],) for p in past_gig_ratings_values}
-        logger.debug(f"past_gig_ratings: {past_gig_ratings}")
+    def _bulk_update_records(self, objects, fields):
+        from users.models import RatingRecord
+        bulk_update_values(RatingRecord, objects, fields)
 
-        unique_dj_profiles_ids = set(list(booking_ratings.keys()) + list(past_gig_ratings.keys()))
+    def _bulk_create_records(self, objects, batch_size: int, profile: str = None) -> list:
+        """Ids of profiles (profile, default - PROFILE) of actually created records"""
+        from users.models import RatingRecord
+        # record created meanwhile by another process is kept and isn't counted
+        profile_ids = []
+        for i in range(0, len(objects), batch_size):
+            profile_ids += bulk_insert_new(RatingRecord, objects[i:i + batch_size], returning=profile or self.PROFILE)
+        return profile_ids
 
-        self.ratings = {}
-        for dj_profile in unique_dj_profiles_ids:
-            total_rating = booking_ratings.get(dj_profile, (0, 0))[0] + past_gig_ratings.get(dj_profile, (0, 0))[0]
-            total_count = booking_ratings.get(dj_profile, (0, 0))[1] + past_gig_ratings.get(dj_profile, (0, 0))[1]
-            avg_star_rating = round(total_rating / total_count, 1)
-            self.ratings[dj_profile] = avg_star_rating
+    def create_records(self, profile_ids, chunk_size: int = None) -> int:
+        """
+        Creates records with ratings of given profiles by chunks of chunk_size,
+        returns number of created records (profiles having records are skipped)
+        """
+        from users.models import RatingRecord
 
-        logger.debug(f"ratings: {self.ratings}")
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        created = 0
+        to_create = []
+        for profile_id in profile_ids:
+            record = RatingRecord(**{f'{self.PROFILE}_id': profile_id})
+            self.set_rating(record, self.ratings[profile_id])
+            to_create.append(record)
+            if len(to_create) >= chunk_size:
+                created += len(self._bulk_create_records(to_create, chunk_size))
+                to_create = []
+        if to_create:
+            created += len(self._bulk_create_records(to_create, chunk_size))
+        return created
+
+    def update_records(self, chunk_size: int = None) -> dict:
+        """
+        Stores ratings in records, records are streamed and written by chunks of chunk_size,
+        records of profiles having ratings but no record are created
 
-    def update_records(self):
+        Returns numbers of updated ('updated') and created ('created') records
+        """
+        result = {'updated': 0, 'created': 0}
+        if not self.ratings:
+            return result
+        chunk_size = chunk_size or self.CHUNK_SIZE
+        fields = [self.RATING_FIELD, f'{self.RATING_FIELD}_percentage']
         to_update = []
-        for r in self.get_rating_records_for_djs():
-            r.avg_booking_star_rating = self.ratings[r.dj_profile_id]
-            r.avg_booking_star_rating_percentage = self.calculate_percentage(
-                self.ratings[r.dj_profile_id] / self.MAX_STARS_RATING,
-                self.PERCENTAGE
-            )
+        with_records = set()
+        for r in self.get_rating_records().iterator(chunk_size=chunk_size):
+            profile_id = getattr(r, f'{self.PROFILE}_id')
+            rating = self.ratings.get(profile_id)
+            if rating is None:
+                continue
+            with_records.add(profile_id)
+            self.set_rating(r, rating)
             to_update.append(r)
-        self._bulk_update_records(to_update, [
-            'avg_booking_star_rating',
-            'avg_booking_star_rating_percentage'
-        ])
-
-
-class BookersStarsRatingCalculator(RatingCalculator):
-
-    PERCENTAGE = 35
-
-    def get_rating_for_bookers(self):
+            if len(to_update) >= chunk_size:
+                self._bulk_update_records(to_update, fields)
+                to_update = []
+        if to_update:
+            self._bulk_update_records(to_update, fields)
+
+        result['updated'] = len(with_records)
+        result['created'] = self.create_records(
+            (profile_id for profile_id in self.ratings if profile_id not in with_records), chunk_size)
+        logger.info('%s.update_records: %s records updated, %s created', self.__class__.__name__,
+                    result['updated'], result['created'])
+        return result
+
+    def _get_total_rating_update_sql(self, profile_model, profile: str) -> str:
+        """UPDATE ... FROM statement setting total rating of profiles with ids in range"""
+        from users.models import RatingRecord
 
-        # collects list of (booker_profile, avg_rating)
-        ratings = BookingReview.objects.filter(
-            is_by_booker=False,
-            created_at__lte=self.get_today_start()
-        ).values_list(
-            'booking__account_booker__booker_profile'
-        ).annotate(
-            Avg('rating')
+        quote_name = connection.ops.quote_name
+        profile_pk = quote_name(profile_model._meta.pk.column)
+        rating = quote_name(profile_model._meta.get_field('rating').column)
+        total_rating = ' + '.join(['%s'] + [
+            f'record.{quote_name(RatingRecord._meta.get_field(field).column)}'
+            for field in self.TOTAL_RATING_FIELDS
+        ])
+        return (
+            f'UPDATE {quote_name(profile_model._meta.db_table)} AS profile '
+            f'SET {rating} = {total_rating} '
+            f'FROM {quote_name(RatingRecord._meta.db_table)} AS record '
+            f'WHERE record.{quote_name(RatingRecord._meta.get_field(profile).column)} = profile.{profile_pk} '
+            f'AND profile.{profile_pk} BETWEEN %s AND %s '
+            f'AND profile.{rating} IS DISTINCT FROM {total_rating}'
         )
-        self.ratings = {p[0]: p[1] for p in ratings}
-
-        logger.debug(f"{__class__.__name__}.{current_func_name()}: for {self.get_today_start()}")
-        logger.debug(f"ratings: {self.ratings}")
 
-    def update_records(self):
-        to_update = []
-        for r in self.get_rating_records_for_bookers():
-            r.avg_booking_star_rating = self.ratings[r.booker_profile_id]
-            r.avg_booking_star_rating_percentage = self.calculate_percentage(
-                self.ratings[r.booker_profile_id] / self.MAX_STARS_RATING,
-                self.PERCENTAGE
-            )
-            to_update.append(r)
-        self._bulk_update_records(to_update, [
-            'avg_booking_star_rating',
-            'avg_booking_star_rating_percentage'
-        ])
+    def calculate_and_update_total_rating(self, chunk_size: int = None) -> dict:
+        """
+        Sets total rating of performers and bookers from their RatingRecord
+        by a single UPDATE ... FROM statement per profile type
 
+        chunk_size - number of profile ids updated by one statement (None - all),
+        so row locks are held for a chunk only
 
-class PerformersBookingNumberRatingCalculator(RatingCalculator):
+        Returns 'dj_profile'/'booker_profile' -> number of updated profiles ('updated'),
+        of statements ('chunks') and time spent in seconds ('seconds')
+        """
+        from users.models import RatingRecord, BookerProfile, DJProfile
 
-    PERCENTAGE = 14
+        result = {}
+        for profile, profile_model in [('dj_profile', DJProfile), ('booker_profile', BookerProfile)]:
+            started_at = time.monotonic()
+            ids = RatingRecord.objects.aggregate(first=Min(f'{profile}_id'), last=Max(f'{profile}_id'))
+            sql = self._get_total_rating_update_sql(profile_model, profile)
+
+            updated = chunks = 0
+            if ids['first'] is not None:
+                step = chunk_size or ids['last'] - ids['first'] + 1
+                with connection.cursor() as cursor:
+                    for chunk_start in range(ids['first'], ids['last'] + 1, step):
+                        cursor.execute(sql, [self.STABILIZER, chunk_start, chunk_start + step - 1, self.STABILIZER])
+                        updated += cursor.rowcount
+                        chunks += 1
+
+            result[profile] = {
+                'updated': updated,
+                'chunks': chunks,
+                'seconds': round(time.monotonic() - started_at, 3),
+            }
+            logger.info(
+                '%s.calculate_and_update_total_rating: %s total rating of %s profiles updated by %s statements in %ss',
+                self.__class__.__name__, profile, updated, chunks, result[profile]['seconds']
+            )
+        return result
 
-    def get_rating_for_performers(self):
 
-        number_of_bookings_per_dj = Booking.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).values_list(
-            'account_dj__dj_profile'
-        ).annotate(
-            Count('pk')
-        )
+class PerformersRatingCalculator(RatingCalculator):
 
-        total_number_of_bookings = Booking.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).aggregate(bookings_count=Count('pk'))
+    PROFILE = 'dj_profile'
 
-        total_number_of_performers = Booking.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).values_list(
-            'account_dj__dj_profile'
-        ).aggregate(
-            dj_count=Count('account_dj__dj_profile', distinct=True)
-        )
+    def get_rating_for_performers(self, aggregates: RatingAggregates = None):
+        self.calculate(aggregates)
 
-        self.ratings = {}
-        if total_number_of_performers['dj_count'] > 0:
 
-            avg_number_of_bookings = total_number_of_bookings['bookings_count'] / \
-                total_number_of_performers['dj_count']
+class BookersRatingCalculator(RatingCalculator):
 
-            for p in number_of_bookings_per_dj:
-                self.ratings[p[0]] = p[1] / avg_number_of_bookings
+    PROFILE = 'booker_profile'
 
-        logger.debug(f"{__class__.__name__}.{current_func_name()}: for {self.get_today_start()}")
-        logger.debug(f"number_of_bookings_per_dj: {number_of_bookings_per_dj}")
-        logger.debug(f"total_number_of_bookings: {total_number_of_bookings}")
-        logger.debug(f"total_number_of_performers: {total_number_of_performers}")
-        logger.debug(f"ratings: {self.ratings}")
+    def get_rating_for_bookers(self, aggregates: RatingAggregates = None):
+        self.calculate(aggregates)
 
-    def update_records(self):
-        if not self.ratings:
-            return
-        to_update = []
-        for r in self.get_rating_records_for_djs():
-            r.number_of_booking_rating = self.ratings[r.dj_profile_id]
-            r.number_of_booking_rating_percentage = self.calculate_percentage(
-                self.ratings[r.dj_profile_id],
-                self.PERCENTAGE
-            )
-            to_update.append(r)
-        self._bulk_update_records(to_update, [
-            'number_of_booking_rating',
-            'number_of_booking_rating_percentage'
-        ])
 
+class PerformersStarsRatingCalculator(PerformersRatingCalculator):
 
-class BookersBookingNumberRatingCalculator(RatingCalculator):
+    PERCENTAGE = 35
+    RATING_FIELD = 'avg_booking_star_rating'
 
-    PERCENTAGE = 14
+    def calculate_ratings(self, aggregates: RatingAggregates) -> dict:
+        # sums and counts of ratings of bookings and past gigs
+        booking_sums, booking_counts = aggregates.get_reviews_ratings('dj_profile', is_by_booker=True)
+        past_gig_sums, past_gig_counts = aggregates.get_past_gigs_ratings()
 
-    def get_rating_for_bookers(self):
+        ratings = {}
+        for dj_profile in set(booking_counts) | set(past_gig_counts):
+            total_rating = booking_sums.get(dj_profile, 0) + past_gig_sums.get(dj_profile, 0)
+            total_count = booking_counts.get(dj_profile, 0) + past_gig_counts.get(dj_profile, 0)
+            if total_count:
+                ratings[dj_profile] = round(total_rating / total_count, 1)
+        return ratings
 
-        number_of_bookings_per_booker = Booking.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).values_list(
-            'account_booker__booker_profile'
-        ).annotate(
-            Count('pk')
-        )
+    def get_rating_percentage(self, rating: float) -> int:
+        return self.calculate_percentage(rating / self.MAX_STARS_RATING, self.PERCENTAGE)
 
-        total_number_of_bookings = Booking.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).aggregate(bookings_count=Count('pk'))
 
-        total_number_of_bookers = Booking.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).values_list(
-            'account_booker__booker_profile'
-        ).aggregate(
-            booker_count=Count('account_booker__booker_profile', distinct=True)
-        )
+class BookersStarsRatingCalculator(BookersRatingCalculator):
 
-        self.ratings = {}
-        if total_number_of_bookers['booker_count'] > 0:
+    PERCENTAGE = 35
+    RATING_FIELD = 'avg_booking_star_rating'
 
-            avg_number_of_bookings = total_number_of_bookings['bookings_count'] / \
-                total_number_of_bookers['booker_count']
+    def calculate_ratings(self, aggregates: RatingAggregates) -> dict:
+        rating_sums, rating_counts = aggregates.get_reviews_ratings('booker_profile', is_by_booker=False)
+        return {
+            booker_profile: rating_sums[booker_profile] / count
+            for booker_profile, count in rating_counts.items() if count
+        }
 
-            for p in number_of_bookings_per_booker:
-                self.ratings[p[0]] = p[1] / avg_number_of_bookings
+    def get_rating_percentage(self, rating: float) -> int:
+        return self.calculate_percentage(rating / self.MAX_STARS_RATING, self.PERCENTAGE)
 
-        logger.debug(f"{__class__.__name__}.{current_func_name()}: for {self.get_today_start()}")
-        logger.debug(
-            f"number_of_bookings_per_booker: {number_of_bookings_per_booker}")
-        logger.debug(f"total_number_of_bookings: {total_number_of_bookings}")
-        logger.debug(f"total_number_of_bookers: {total_number_of_bookers}")
-        logger.debug(f"ratings: {self.ratings}")
 
-    def update_records(self):
-        to_update = []
-        for r in self.get_rating_records_for_bookers():
-            r.number_of_booking_rating = self.ratings[r.booker_profile_id]
-            r.number_of_booking_rating_percentage = self.calculate_percentage(
-                self.ratings[r.booker_profile_id],
-                self.PERCENTAGE
-            )
-            to_update.append(r)
-        self._bulk_update_records(to_update, [
-            'number_of_booking_rating',
-            'number_of_booking_rating_percentage'
-        ])
+class BookingNumberRatingCalculatorMixin:
+    """Number of bookings of profile relative to average number of bookings per profile"""
 
+    PERCENTAGE = 14
+    RATING_FIELD = 'number_of_booking_rating'
 
-class PerformersSignedMonthsRatingCalculator(RatingCalculator):
+    def calculate_ratings(self, aggregates: RatingAggregates) -> dict:
+        avg_number_of_bookings = aggregates.get_average_number_of_bookings(self.PROFILE)
+        if not avg_number_of_bookings:
+            return {}
 
-    PERCENTAGE = 5
+        return {
+            profile_id: bookings_num / avg_number_of_bookings
+            for profile_id, bookings_num in aggregates.get_bookings_numbers(self.PROFILE).items()
+        }
 
-    def get_rating_for_performers(self):
+    def get_unchanged_profile_rating(self, record, aggregates: RatingAggregates) -> float:
+        # average changes with every new booking, number of bookings of profile
+        # is restored from the stored rating and the previous average
+        avg_number_of_bookings = aggregates.get_average_number_of_bookings(self.PROFILE)
+        previous_avg_number_of_bookings = aggregates.get_previous_average_number_of_bookings(self.PROFILE)
+        if not avg_number_of_bookings or not previous_avg_number_of_bookings:
+            return None
 
-        from users.models import DJProfile
+        bookings_num = round(getattr(record, self.RATING_FIELD) * previous_avg_number_of_bookings)
+        if bookings_num:
+            return bookings_num / avg_number_of_bookings
 
-        activation_dates = DJProfile.objects.filter(
-            user__is_email_active=True,
-            user__email_activation_date__lte=self.get_today_start()
-        ).values_list(
-            'pk', 'user__email_activation_date'
-        )
 
-        self.ratings = {}
-        for p in activation_dates:
-            self.ratings[p[0]] = self.get_months_since_date(
-                p[1]) / self.months_since_service_start
+class PerformersBookingNumberRatingCalculator(BookingNumberRatingCalculatorMixin, PerformersRatingCalculator):
+    pass
 
-        logger.debug(f"{__class__.__name__}.{current_func_name()}: for {self.get_today_start()}")
-        logger.debug(f"activation_dates: {activation_dates}")
-        logger.debug(f"ratings: {self.ratings}")
 
-    def update_records(self):
-        to_update = []
-        for r in self.get_rating_records_for_djs():
-            r.signed_time_rating = self.ratings[r.dj_profile_id]
-            r.signed_time_rating_percentage = self.calculate_percentage(
-                self.ratings[r.dj_profile_id],
-                self.PERCENTAGE
-            )
-            to_update.append(r)
-        self._bulk_update_records(to_update, [
-            'signed_time_rating',
-            'signed_time_rating_percentage'
-        ])
+class BookersBookingNumberRatingCalculator(BookingNumberRatingCalculatorMixin, BookersRatingCalculator):
+    pass
 
 
-class BookersSignedMonthsRatingCalculator(RatingCalculator):
+class SignedMonthsRatingCalculatorMixin:
+    """Months since email activation of profile relative to months since service start"""
 
     PERCENTAGE = 5
+    RATING_FIELD = 'signed_time_rating'
 
-    def get_rating_for_bookers(self):
-
-        from users.models import BookerProfile
+    def calculate_ratings(self, aggregates: RatingAggregates) -> dict:
+        months_since_service_start = aggregates.months_since_service_start
+        return {
+            profile_id: self.get_months_since_date(activation_date) / months_since_service_start
+            for profile_id, activation_date in aggregates.activation_dates[self.PROFILE].items()
+        }
 
-        activation_dates = BookerProfile.objects.filter(
-            user__is_email_active=True,
-            user__email_activation_date__lte=self.get_today_start()
-        ).values_list(
-            'pk', 'user__email_activation_date'
-        )
 
-        self.ratings = {}
-        for p in activation_dates:
-            self.ratings[p[0]] = self.get_months_since_date(
-                p[1]) / self.months_since_service_start
+class PerformersSignedMonthsRatingCalculator(SignedMonthsRatingCalculatorMixin, PerformersRatingCalculator):
+    pass
 
-        logger.debug(f"{__class__.__name__}.{current_func_name()}: for {self.get_today_start()}")
-        logger.debug(f"activation_dates: {activation_dates}")
-        logger.debug(f"ratings: {self.ratings}")
 
-    def update_records(self):
-        to_update = []
-        for r in self.get_rating_records_for_bookers():
-            r.signed_time_rating = self.ratings[r.booker_profile_id]
-            r.signed_time_rating_percentage = self.calculate_percentage(
-                self.ratings[r.booker_profile_id],
-                self.PERCENTAGE
-            )
-            to_update.append(r)
-        self._bulk_update_records(to_update, [
-            'signed_time_rating',
-            'signed_time_rating_percentage'
-        ])
+class BookersSignedMonthsRatingCalculator(SignedMonthsRatingCalculatorMixin, BookersRatingCalculator):
+    pass
 
 
-class PerformersDisputesRatingCalculator(RatingCalculator):
+class DisputesRatingCalculatorMixin:
+    """Share of disputed bookings of profile, the less disputes the bigger percentage"""
 
     PERCENTAGE = 11
+    RATING_FIELD = 'number_of_disputes_rating'
 
-    def get_rating_for_performers(self):
+    def calculate_ratings(self, aggregates: RatingAggregates) -> dict:
+        disputes_numbers = aggregates.get_disputes_numbers(self.PROFILE)
+        return {
+            profile_id: disputes_numbers.get(profile_id, 0) / bookings_num
+            for profile_id, bookings_num in aggregates.get_bookings_numbers(self.PROFILE).items()
+        }
 
-        number_of_bookings_per_dj = Booking.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).values_list(
-            'account_dj__dj_profile'
-        ).annotate(
-            bookings_count=Count('pk')
-        ).filter(
-            bookings_count__gt=0
-        )
-
-        number_of_disputes_per_dj = Dispute.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).select_related(
-            'booking__account_dj'
-        ).values_list(
-            'booking__account_dj__dj_profile'
-        ).annotate(
-            Count('pk')
-        )
-
-        bookings_numbers = {p[0]:p[1] for p in number_of_bookings_per_dj}
-        disputes_numbers = {p[0]:p[1] for p in number_of_disputes_per_dj}
+    def get_rating_percentage(self, rating: float) -> int:
+        return self.PERCENTAGE - self.calculate_percentage(rating, self.PERCENTAGE)
 
-        self.ratings = {}
-        for dj_profile_id, bookings_num in bookings_numbers.items():
-            self.ratings[dj_profile_id] = disputes_numbers.get(dj_profile_id, 0) / bookings_num
-
-        logger.debug(f"{__class__.__name__}.{current_func_name()}: for {self.get_today_start()}")
-        logger.debug(f"number_of_bookings_per_dj: {number_of_bookings_per_dj}")
-        logger.debug(f"number_of_disputes_per_dj: {number_of_disputes_per_dj}")
-        logger.debug(f"bookings_numbers: {bookings_numbers}")
-        logger.debug(f"disputes_numbers: {disputes_numbers}")
-        logger.debug(f"ratings: {self.ratings}")
-
-    def update_records(self):
-        to_update = []
-        for r in self.get_rating_records_for_djs():
-            r.number_of_disputes_rating = self.ratings[r.dj_profile_id]
-            r.number_of_disputes_rating_percentage = self.PERCENTAGE - self.calculate_percentage(
-                self.ratings[r.dj_profile_id],
-                self.PERCENTAGE
-            )
-            to_update.append(r)
-        self._bulk_update_records(to_update, [
-            'number_of_disputes_rating',
-            'number_of_disputes_rating_percentage'
-        ])
 
+class PerformersDisputesRatingCalculator(DisputesRatingCalculatorMixin, PerformersRatingCalculator):
+    pass
 
 
-class BookersDisputesRatingCalculator(RatingCalculator):
+class BookersDisputesRatingCalculator(DisputesRatingCalculatorMixin, BookersRatingCalculator):
+    pass
 
-    PERCENTAGE = 11
 
-    def get_rating_for_bookers(self):
+class RatingPipeline:
+    """
+    Calculates all sub-ratings and total ratings of performers and bookers
+
+    Records are processed by chunks of chunk_size (one transaction each):
+    base aggregates of profiles of the chunk are fetched once and shared
+    by all CALCULATORS, every RatingRecord and profile rating is written once,
+    so memory used doesn't grow with number of profiles
+
+    Incremental run (after a RatingRun) recalculates only profiles which bookings,
+    disputes or past gigs were created, reviews created or edited, or past gigs
+    confirmed, edited or deleted since the last run (see get_changed_profiles),
+    signed months ratings of all profiles (they shift monthly) and rescales
+    number of bookings ratings by new average; only changed records are written.
+    Deleted bookings, disputes and reviews are detected by RatingProfileChange saved by signals,
+    queryset updates and deletes are not, so full run should be done periodically -
+    it recalculates and writes everything
+
+    Run can be split into shards of records (get_shards()) processed in parallel
+    by process(), inputs shared by all shards (get_shared_inputs()) are computed once
+    and total ratings and RatingRun are saved after all shards (finish())
+    """
 
-        number_of_bookings_per_booker = Booking.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).values_list(
-            'account_booker__booker_profile'
-        ).annotate(
-            bookings_count=Count('pk')
-        ).filter(
-            bookings_count__gt=0
+    CALCULATORS = [
+        PerformersStarsRatingCalculator,
+        BookersStarsRatingCalculator,
+        PerformersBookingNumberRatingCalculator,
+        BookersBookingNumberRatingCalculator,
+        PerformersSignedMonthsRatingCalculator,
+        BookersSignedMonthsRatingCalculator,
+        PerformersDisputesRatingCalculator,
+        BookersDisputesRatingCalculator,
+    ]
+
+    def __init__(self, till=None, incremental: bool = False, chunk_size: int = None, vectorized: bool = False):
+        """vectorized - calculate by RatingEngine, requires NumPy"""
+        from services import rating_engine
+
+        self.till = till or RatingCalculator().get_today_start()
+        self.incremental = incremental
+        self.chunk_size = chunk_size or RatingCalculator.CHUNK_SIZE
+        self.vectorized = vectorized
+        if self.vectorized and not rating_engine.is_available():
+            raise ImproperlyConfigured('NumPy is required for vectorized ratings calculation')
+
+    @classmethod
+    def get_rating_fields(cls) -> list:
+        """RatingRecord fields set by CALCULATORS"""
+        fields = set()
+        for calculator_class in cls.CALCULATORS:
+            fields |= {calculator_class.RATING_FIELD, f'{calculator_class.RATING_FIELD}_percentage'}
+        return sorted(fields)
+
+    def get_changed_profiles(self, since) -> dict:
+        """
+        'dj_profile'/'booker_profile' -> ids of profiles with rating data created or changed
+        since given time (edited reviews; past gigs changes and deletes saved as RatingProfileChange)
+        """
+        changed = {'dj_profile': set(), 'booker_profile': set()}
+        for queryset, changed_at, dj_profile, booker_profile in [
+            (Booking.objects.all(), 'created_at', 'account_dj__dj_profile', 'account_booker__booker_profile'),
+            (Dispute.objects.all(), 'created_at',
+             'booking__account_dj__dj_profile', 'booking__account_booker__booker_profile'),
+            (BookingReview.objects.all(), 'updated_at',
+             'booking__account_dj__dj_profile', 'booking__account_booker__booker_profile'),
+            (PastGig.objects.filter(is_confirm=True), 'created_at', 'dj_profile', None),
+            (RatingProfileChange.objects.all(), 'created_at', 'dj_profile_id', 'booker_profile_id'),
+        ]:
+            lookups = [dj_profile] if booker_profile is None else [dj_profile, booker_profile]
+            rows = queryset.filter(**{
+                f'{changed_at}__gt': since,
+                f'{changed_at}__lte': self.till,
+            }).order_by().values_list(*lookups).distinct()
+            for row in rows:
+                for profile, profile_id in zip(['dj_profile', 'booker_profile'], row):
+                    if profile_id is not None:
+                        changed[profile].add(profile_id)
+        return changed
+
+    def get_previous_run(self) -> RatingRun:
+        """Run incremental run continues from, None - full run"""
+        previous_run = RatingRun.objects.get_last() if self.incremental else None
+        if previous_run is None or previous_run.till > self.till:
+            return None
+        return previous_run
+
+    def calculate(self, aggregates: RatingAggregates = None) -> list:
+        """Calculators with ratings calculated from shared aggregates"""
+        if aggregates is None:
+            aggregates = RatingAggregates(self.till)
+        calculators = [calculator_class() for calculator_class in self.CALCULATORS]
+        for calculator in calculators:
+            calculator.calculate(aggregates)
+        return calculators
+
+    def _set_ratings(self, record, calculators: list, aggregates: RatingAggregates):
+        for calculator in calculators:
+            profile_id = getattr(record, f'{calculator.PROFILE}_id')
+            if profile_id is None:
+                continue
+            if profile_id in calculator.ratings:
+                calculator.set_rating(record, calculator.ratings[profile_id])
+            elif aggregates.previous_run is not None and profile_id not in aggregates.profiles[calculator.PROFILE]:
+                rating = calculator.get_unchanged_profile_rating(record, aggregates)
+                if rating is not None:
+                    calculator.set_rating(record, rating)
+
+    def _save_ratings(self, records: list, aggregates: RatingAggregates, update_profiles: bool = True) -> int:
+        """
+        Calculates and saves ratings of records (and total ratings of their profiles),
+        returns number of changed records
+        """
+        from users.models import BookerProfile, DJProfile, RatingRecord
+
+        calculators = self.calculate(aggregates)
+        fields = self.get_rating_fields()
+
+        to_update, dj_profiles, booker_profiles = [], [], []
+        changed = 0
+        for record in records:
+            values = [getattr(record, field) for field in fields]
+            self._set_ratings(record, calculators, aggregates)
+            if values != [getattr(record, field) for field in fields]:
+                changed += 1
+            elif aggregates.previous_run is not None:
+                continue
+            to_update.append(record)
+
+            total_rating = RatingCalculator.get_total_rating(record)
+            if record.dj_profile_id is not None:
+                dj_profiles.append(DJProfile(pk=record.dj_profile_id, rating=total_rating))
+            if record.booker_profile_id is not None:
+                booker_profiles.append(BookerProfile(pk=record.booker_profile_id, rating=total_rating))
+
+        bulk_update_values(RatingRecord, to_update, fields)
+        if update_profiles:
+            bulk_update_values(DJProfile, dj_profiles, ['rating'])
+            bulk_update_values(BookerProfile, booker_profiles, ['rating'])
+        return changed
+
+    def _save_ratings_vectorized(self, rows: list, aggregates: RatingAggregates, update_profiles: bool = True) -> int:
+        """_save_ratings() by RatingEngine, rows - (pk, dj_profile_id, booker_profile_id, *rating fields)"""
+        import numpy as np
+        from services.rating_engine import RatingEngine
+        from users.models import BookerProfile, DJProfile, RatingRecord
+
+        fields = self.get_rating_fields()
+        columns = list(zip(*rows))
+        pks = np.array(columns[0], dtype=np.int64)
+        # records without profile have 0 instead of None
+        profile_ids = {
+            profile: np.array([profile_id or 0 for profile_id in column], dtype=np.int64)
+            for profile, column in [('dj_profile', columns[1]), ('booker_profile', columns[2])]
+        }
+        values = {
+            field: np.array(column, dtype=np.int64 if field.endswith('_percentage') else np.float64)
+            for field, column in zip(fields, columns[3:])
+        }
+
+        new_values = RatingEngine(aggregates).apply(self.CALCULATORS, profile_ids, values)
+        changed = np.zeros(len(pks), dtype=bool)
+        for field in fields:
+            changed |= new_values[field] != values[field]
+        to_update = changed if aggregates.previous_run is not None else np.ones(len(pks), dtype=bool)
+
+        bulk_update_rows(RatingRecord, fields, list(zip(
+            pks[to_update].tolist(), *[new_values[field][to_update].tolist() for field in fields]
+        )))
+        if not update_profiles:
+            return int(changed.sum())
+        total_ratings = RatingEngine.get_total_ratings(new_values)
+        for profile, profile_model in [('dj_profile', DJProfile), ('booker_profile', BookerProfile)]:
+            with_profile = to_update & (profile_ids[profile] != 0)
+            bulk_update_rows(profile_model, ['rating'], list(zip(
+                profile_ids[profile][with_profile].tolist(), total_ratings[with_profile].tolist()
+            )))
+        return int(changed.sum())
+
+    def get_shared_inputs(self, created_profiles: dict = None) -> dict:
+        """
+        Inputs of a run shared by all chunks and shards: previous run, profiles changed
+        since it (None - full run) including profiles which records were just created
+        (created_profiles, see create_missing_records), bookings totals and months since service start
+        """
+        previous_run = self.get_previous_run()
+        changed_profiles = None
+        if previous_run is not None:
+            changed_profiles = self.get_changed_profiles(since=previous_run.till)
+            for profile, profile_ids in (created_profiles or {}).items():
+                changed_profiles[profile] |= profile_ids
+        return {
+            'previous_run': previous_run,
+            'changed_profiles': changed_profiles,
+            'bookings_totals': RatingAggregates(self.till).fetch_bookings_totals(),
+            'months_since_service_start': RatingCalculator().months_since_service_start,
+        }
+
+    @staticmethod
+    def dump_inputs(inputs: dict) -> dict:
+        """get_shared_inputs() result serializable to JSON (task arguments)"""
+        changed_profiles = inputs['changed_profiles']
+        return dict(
+            inputs,
+            previous_run=inputs['previous_run'] and inputs['previous_run'].pk,
+            changed_profiles=changed_profiles and {profile: sorted(ids) for profile, ids in changed_profiles.items()}
         )
 
-        number_of_disputes_per_booker = Dispute.objects.filter(
-            created_at__lte=self.get_today_start()
-        ).values_list(
-            'booking__account_booker__booker_profile'
-        ).annotate(
-            Count('pk')
+    @staticmethod
+    def load_inputs(data: dict) -> dict:
+        """Inputs dumped by dump_inputs()"""
+        changed_profiles = data['changed_profiles']
+        return dict(
+            data,
+            previous_run=data['previous_run'] and RatingRun.objects.get(pk=data['previous_run']),
+            changed_profiles=changed_profiles and {profile: set(ids) for profile, ids in changed_profiles.items()}
         )
 
-        bookings_numbers = {p[0]: p[1] for p in number_of_bookings_per_booker}
-        disputes_numbers = {p[0]: p[1] for p in number_of_disputes_per_booker}
+    def create_missing_records(self) -> dict:
+        """
+        Creates empty records of profiles without record by chunks of chunk_size,
+        returns 'dj_profile'/'booker_profile' -> ids of profiles which records were created,
+        they are calculated by the run (see get_shared_inputs)
+        """
+        from users.models import BookerProfile, DJProfile, RatingRecord
+
+        calculator = RatingCalculator()
+        created = {}
+        for profile, profile_model in [('dj_profile', DJProfile), ('booker_profile', BookerProfile)]:
+            profile_ids = profile_model.objects.filter(
+                ~Exists(RatingRecord.objects.filter(**{profile: OuterRef('pk')}))
+            ).order_by('pk').values_list('pk', flat=True)
+            created[profile] = set()
+            to_create = []
+            for profile_id in profile_ids.iterator(chunk_size=self.chunk_size):
+                to_create.append(RatingRecord(**{f'{profile}_id': profile_id}))
+                if len(to_create) >= self.chunk_size:
+                    created[profile].update(calculator._bulk_create_records(to_create, self.chunk_size, profile))
+                    to_create = []
+            if to_create:
+                created[profile].update(calculator._bulk_create_records(to_create, self.chunk_size, profile))
+        return created
+
+    def _get_records(self):
+        from users.models import RatingRecord
+        return RatingRecord.objects.filter(Q(dj_profile__isnull=False) | Q(booker_profile__isnull=False))
+
+    def get_shards(self, count: int) -> list:
+        """Up to count ranges (first pk, last pk) of records of equal length"""
+        pks = self._get_records().aggregate(first=Min('pk'), last=Max('pk'))
+        if pks['first'] is None:
+            return []
+        step = -(-(pks['last'] - pks['first'] + 1) // count)
+        return [
+            (first_pk, min(first_pk + step - 1, pks['last']))
+            for first_pk in range(pks['first'], pks['last'] + 1, step)
+        ]
+
+    def process(self, inputs: dict, first_pk: int = None, last_pk: int = None, update_profiles: bool = True) -> int:
+        """
+        Calculates and saves ratings of records (with pk between first_pk and last_pk if given),
+        returns number of records which ratings changed
 
-        self.ratings = {}
-        for booker_profile_id, bookings_num in bookings_numbers.items():
-            self.ratings[booker_profile_id] = disputes_numbers.get(booker_profile_id, 0) / bookings_num
+        inputs - get_shared_inputs() result, update_profiles - save total ratings of profiles
+        (otherwise they are to be updated by calculate_and_update_total_rating())
+        """
+        records_queryset = self._get_records().order_by('pk').select_for_update()
+        if first_pk is not None:
+            records_queryset = records_queryset.filter(pk__range=(first_pk, last_pk))
+        if self.vectorized:
+            records_queryset = records_queryset.values_list('pk', 'dj_profile_id', 'booker_profile_id',
+                                                            *self.get_rating_fields())
+        changed_profiles = inputs['changed_profiles']
+
+        changed = chunks = 0
+        previous_pk = 0
+        while True:
+            with transaction.atomic():
+                records = list(records_queryset.filter(pk__gt=previous_pk)[:self.chunk_size])
+                if not records:
+                    break
+
+                if self.vectorized:
+                    record_profiles = [row[:3] for row in records]
+                else:
+                    record_profiles = [(r.pk, r.dj_profile_id, r.booker_profile_id) for r in records]
+                previous_pk = record_profiles[-1][0]
+                chunk_profiles = {
+                    'dj_profile': {dj_profile for _, dj_profile, _ in record_profiles if dj_profile is not None},
+                    'booker_profile': {
+                        booker_profile for _, _, booker_profile in record_profiles if booker_profile is not None
+                    },
+                }
+                aggregates = RatingAggregates(
+                    self.till,
+                    profiles=chunk_profiles if changed_profiles is None else {
+                        profile: ids & changed_profiles[profile] for profile, ids in chunk_profiles.items()
+                    },
+                    activation_profiles=chunk_profiles,
+                    previous_run=inputs['previous_run'],
+                    bookings_totals=inputs['bookings_totals'],
+                    months_since_service_start=inputs['months_since_service_start']
+                )
+                if self.vectorized:
+                    changed += self._save_ratings_vectorized(records, aggregates, update_profiles)
+                else:
+                    changed += self._save_ratings(records, aggregates, update_profiles)
+                chunks += 1
+
+        logger.debug('%s.process: %s records changed by %s chunks of records %s-%s', self.__class__.__name__,
+                     changed, chunks, first_pk, last_pk)
+        return changed
+
+    def save_history(self) -> int:
+        """
+        Appends ratings of all profiles to RatingHistory by a single INSERT ... SELECT
+        from RatingRecord (rows are not loaded), returns number of saved rows;
+        rows of the same run date are replaced, so a repeated run keeps one row per profile
+        """
+        from users.models import RatingRecord
 
-        logger.debug(f"{__class__.__name__}.{current_func_name()}: for {self.get_today_start()}")
-        logger.debug(f"number_of_bookings_per_booker: {number_of_bookings_per_booker}")
-        logger.debug(f"number_of_disputes_per_booker: {number_of_disputes_per_booker}")
-        logger.debug(f"bookings_numbers: {bookings_numbers}")
-        logger.debug(f"disputes_numbers: {disputes_numbers}")
-        logger.debug(f"ratings: {self.ratings}")
+        run_date = self.till.date()
+        RatingHistory.objects.create_partition(run_date.replace(day=1))
+
+        quote_name = connection.ops.quote_name
+        record_fields = list(RatingHistory.PROFILE_TYPES) + RatingHistory.PERCENTAGE_FIELDS
+        record = {field: f'record.{quote_name(RatingRecord._meta.get_field(field).column)}'
+                  for field in record_fields + RatingCalculator.TOTAL_RATING_FIELDS}
+        history = {field.name: quote_name(field.column) for field in RatingHistory._meta.concrete_fields}
+        total_rating = ' + '.join(
+            [str(RatingCalculator.STABILIZER)] + [record[field] for field in RatingCalculator.TOTAL_RATING_FIELDS])
+        values_fields = ['total_rating'] + RatingHistory.PERCENTAGE_FIELDS
+
+        selects = [
+            f'SELECT %s::date, {int(profile_type)}, {record[profile]}, {total_rating}, '
+            f'{", ".join([record[field] for field in RatingHistory.PERCENTAGE_FIELDS])} '
+            f'FROM {quote_name(RatingRecord._meta.db_table)} AS record WHERE {record[profile]} IS NOT NULL'
+            for profile, profile_type in RatingHistory.PROFILE_TYPES.items()
+        ]
+        columns = ['run_date', 'profile_type', 'profile_id'] + values_fields
+        sql = (
+            f'INSERT INTO {quote_name(RatingHistory._meta.db_table)} '
+            f'({", ".join([history[field] for field in columns])}) '
+            f'{" UNION ALL ".join(selects)} '
+            f'ON CONFLICT ({history["profile_type"]}, {history["profile_id"]}, {history["run_date"]}) '
+            f'DO UPDATE SET {", ".join([f"{history[field]} = EXCLUDED.{history[field]}" for field in values_fields])}'
+        )
+        with connection.cursor() as cursor:
+            cursor.execute(sql, [run_date] * len(selects))
+            return cursor.rowcount
 
-    def update_records(self):
-        to_update = []
-        for r in self.get_rating_records_for_bookers():
-            r.number_of_disputes_rating = self.ratings[r.booker_profile_id]
-            r.number_of_disputes_rating_percentage = self.PERCENTAGE - self.calculate_percentage(
-                self.ratings[r.booker_profile_id],
-                self.PERCENTAGE
-            )
-            to_update.append(r)
-        self._bulk_update_records(to_update, [
-            'number_of_disputes_rating',
-            'number_of_disputes_rating_percentage'
-        ])
+    def finish(self, inputs: dict, changed: int, created: int = 0) -> RatingRun:
+        """
+        Saves ratings history and run with given numbers of changed and created records,
+        the next incremental run continues from it (so profile changes till it are deleted)
+        """
+        saved = self.save_history()
+        logger.info('%s.finish: ratings of %s profiles saved to history', self.__class__.__name__, saved)
+        RatingProfileChange.objects.filter(created_at__lte=self.till).delete()
+
+        bookings_totals = inputs['bookings_totals']
+        return RatingRun.objects.create(
+            till=self.till,
+            is_full=inputs['previous_run'] is None,
+            records_changed=changed,
+            records_created=created,
+            bookings_count=bookings_totals['bookings_count'],
+            performers_with_bookings=bookings_totals['dj_profile'],
+            bookers_with_bookings=bookings_totals['booker_profile']
+        )
 
+    def run(self) -> int:
+        """
+        Creates missing records, calculates and saves ratings, returns number of records
+        which ratings changed (after an incremental run, changed records of a full run
+        show its inaccuracy), created records are counted by RatingRun.records_created
+        """
+        created_profiles = self.create_missing_records()
+        created = sum([len(profile_ids) for profile_ids in created_profiles.values()])
+        inputs = self.get_shared_inputs(created_profiles)
+        changed = self.process(inputs)
+        self.finish(inputs, changed, created)
+
+        logger.info(
+            '%s.run: %s records changed, %s created for %s (%s)', self.__class__.__name__,
+            changed, created, self.till, 'full' if inputs['previous_run'] is None else 'incremental'
+        )
+        return changed
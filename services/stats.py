@@ -1,18 +1,63 @@
 import datetime
-from collections import Counter
+import hashlib
+import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
 from datetime import date
+from functools import partial
 
-from booking.models import Booking, BookingReview, Transaction
+from booking.expressions import Percentile, WidthBucket
+from booking.models import (Booking, BookingDailyRollup, BookingReview, StatsMonthSnapshot,
+                            Transaction, UserBalance)
 from dateutil.relativedelta import relativedelta
 from dispute.models import Dispute
 from django.conf import settings
-from django.db.models import Count, F, Func, Q
-from django.db.models.aggregates import Avg, Count, Max, Min
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet
+from django.db import DatabaseError, connection
+from django.db.models import (Case, Count, DateField, F, Func, IntegerField, OuterRef, Q, Subquery,
+                              When)
+from django.db.models.aggregates import Avg, Count, Max, Min, Sum
+from django.db.models.functions import Coalesce, Trunc
 from django.utils import timezone
 from users.enums import Music
 from users.models import Account, BookerProfile, DJProfile
 from utils.aggregates import Median
 
+logger = logging.getLogger('django')
+
+MUSIC_LABELS = dict(Music.choices)
+
+# columns showing the latest change of data stats are calculated from,
+# dispute changes update their bookings (see booking.signals.dispute_changed);
+# deleted rows don't move the watermark, their stats are cached till STATS_CACHE_TTL
+STATS_WATERMARK_COLUMNS = [
+    (Booking, 'updated_at'),
+    (BookingReview, 'updated_at'),
+    (Transaction, 'created_at'),
+    (UserBalance, 'updated_at'),
+    (StatsMonthSnapshot, 'taken_at'),
+]
+
+
+def get_stats_watermark() -> tuple:
+    """
+    Latest change time of bookings (and their disputes), reviews, transactions, balances
+    and stats snapshots (single query), stats calculated with the same watermark
+    are still actual, except after deletes - they are seen after STATS_CACHE_TTL
+    """
+    quote_name = connection.ops.quote_name
+    columns = ', '.join([
+        f'(SELECT MAX({quote_name(field)}) FROM {quote_name(model._meta.db_table)})'
+        for model, field in STATS_WATERMARK_COLUMNS
+    ])
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT {columns}')
+        return cursor.fetchone()
+
 
 class StatsProvider:
     """
@@ -20,15 +65,316 @@ class StatsProvider:
     and one 'calculate_all' method to get all their results in a single dict
     """
 
-    def calculate_all(self):
-        calc_methods = [f for f in dir(self) if callable(getattr(self, f)) and f.startswith('get_')]
-        return {method_name[4:]: getattr(self, method_name)() for method_name in calc_methods}
+    TIME_SERIES_PERIODS = ('day', 'week', 'month')
+
+    # aggregated providers can calculate stats from BookingDailyRollup instead of bookings
+    from_rollup = False
+
+    # providers with additive figures (see _aggregate_figures) can take closed months
+    # from StatsMonthSnapshot saved under SNAPSHOT_NAME instead of calculating them
+    SNAPSHOT_NAME = None
+    from_snapshots = False
+
+    def calculate_all(self, use_cache: bool = True, profile: bool = False):
+        """
+        Results of all get_ methods
+
+        Cached for STATS_CACHE_TTL seconds (0 - no cache) while cache watermark stays the same
+
+        profile=True calculates without cache, stores profile of every metric
+        in 'metrics_profile' and logs it (see _calculate_all)
+        """
+        if profile:
+            return self._calculate_all(profile=True)
+
+        ttl = getattr(settings, 'STATS_CACHE_TTL', 10 * 60)
+        if not use_cache or not ttl:
+            return self._calculate_all()
+
+        cache_key = self._get_cache_key(self._get_cache_watermark())
+        result = cache.get(cache_key)
+        if result is None:
+            result = self._calculate_all()
+            cache.set(cache_key, result, ttl)
+        return result
+
+    def _get_cache_watermark(self) -> tuple:
+        """Cached results are valid while watermark stays the same"""
+        return get_stats_watermark()
+
+    def _get_cache_params(self) -> tuple:
+        """Parameters of provider which results depend on"""
+        return getattr(self, 'start_date', None), getattr(self, 'end_date', None)
+
+    def _get_cache_key(self, watermark: tuple) -> str:
+        key = repr((self.__class__.__module__, self.__class__.__qualname__,
+                    self._get_cache_params(), watermark))
+        return f'stats:{hashlib.md5(key.encode()).hexdigest()}'
+
+    def _calculate_all(self, profile: bool = False):
+        """
+        With profile, 'metrics_profile' is metric -> wall_time (seconds), queries, rows fetched
+        and cache_hits (results reused from memo), metric includes other metrics it calculates
+        """
+        calc_methods = [f for f in dir(self) if f.startswith('get_') and callable(getattr(self, f))]
+        self.metrics_profile = {} if profile else None
+        with self._memoize_calculations(calc_methods):
+            result = {}
+            for method_name in calc_methods:
+                if profile:
+                    with self._profile_metric(method_name[4:]):
+                        result[method_name[4:]] = getattr(self, method_name)()
+                else:
+                    result[method_name[4:]] = getattr(self, method_name)()
+        logger.debug('%s: %s repeated calculations avoided',
+                     self.__class__.__name__, self.repeated_calculations_avoided)
+        if profile:
+            record = {
+                'provider': self.__class__.__name__,
+                'params': [str(param) for param in self._get_cache_params()],
+                'metrics': self.metrics_profile,
+            }
+            logger.info('Stats profile: %s', json.dumps(record), extra={'stats_profile': record})
+        return result
+
+    @contextmanager
+    def _profile_metric(self, metric: str):
+        counters = {'queries': 0, 'rows': 0}
+
+        def count_queries(execute, sql, params, many, context):
+            try:
+                return execute(sql, params, many, context)
+            finally:
+                counters['queries'] += 1
+                counters['rows'] += max(context['cursor'].rowcount, 0)
+
+        cache_hits = self.repeated_calculations_avoided
+        start = time.monotonic()
+        with connection.execute_wrapper(count_queries):
+            yield
+        self.metrics_profile[metric] = {
+            'wall_time': round(time.monotonic() - start, 6),
+            'queries': counters['queries'],
+            'rows': counters['rows'],
+            'cache_hits': self.repeated_calculations_avoided - cache_hits,
+        }
+
+    @contextmanager
+    def _memoize_calculations(self, calc_methods: list):
+        """
+        Within the block every get_ method result and every count/value
+        of the same queryset is calculated once, repeated calls reuse it
+
+        Number of reused results is stored in 'repeated_calculations_avoided'
+        """
+        self._memo = {}
+        self.repeated_calculations_avoided = 0
+        for method_name in calc_methods:
+            method = getattr(self, method_name)
+            # instance attribute shadows the method, so calls between get_ methods are memoized too
+            setattr(self, method_name, partial(self._memoized, method_name, method))
+        try:
+            yield
+        finally:
+            for method_name in calc_methods:
+                delattr(self, method_name)
+            del self._memo
+
+    def _memoized(self, key, calculate):
+        memo = getattr(self, '_memo', None)
+        if memo is None:
+            return calculate()
+        if key in memo:
+            self.repeated_calculations_avoided += 1
+        else:
+            memo[key] = calculate()
+        return memo[key]
+
+    @staticmethod
+    def _get_queryset_key(queryset) -> tuple:
+        try:
+            sql, params = queryset.query.sql_with_params()
+        except EmptyResultSet:
+            # all querysets matching nothing have the same count and value
+            return None
+        return sql, tuple(params)
+
+    def _count(self, queryset) -> int:
+        return self._memoized(
+            ('count', self._get_queryset_key(queryset)),
+            queryset.count
+        )
 
     def _calculate_bookings_value(self, bookings):
-        return sum([b.get_price() * 100 for b in bookings])
+        return self._memoized(
+            ('bookings_value', self._get_queryset_key(bookings)),
+            lambda: bookings.aggregate(value=Sum('total_price_cents'))['value'] or 0
+        )
 
     def _calculate_performers_earnings_from_bookings(self, bookings):
-        return sum([(b.get_price() - b.dj_fee - b.booker_fee) * 100 for b in bookings])
+        return self._memoized(
+            ('performers_earnings', self._get_queryset_key(bookings)),
+            lambda: bookings.aggregate(value=Sum('dj_earnings_cents'))['value'] or 0
+        )
+
+    def _get_report_windows(self) -> dict:
+        """
+        Start dates of report windows (None - no start limit)
+
+        All windows end at end_date (including)
+        """
+        return {
+            'period': self.start_date,
+            'lifetime': None,
+            'ytd': date(self.end_date.year, 1, 1),
+            'last_6_months': self.end_date + relativedelta(months=-6),
+            'current_month': date(self.end_date.year, self.end_date.month, 1),
+        }
+
+    @staticmethod
+    def _as_date(value):
+        if isinstance(value, datetime.datetime):
+            return value.date()
+        return value
+
+    @staticmethod
+    def _get_month_end(month: date) -> date:
+        return month + relativedelta(months=1, days=-1)
+
+    @classmethod
+    def _split_by_months(cls, start_date, end_date, months) -> tuple:
+        """
+        Splits date range (start_date None - no start limit) into months
+        lying completely inside it and remaining ranges (gaps) between them
+
+        Result: (sorted list of months, list of (start, end) of gaps)
+        """
+        covered = [
+            month for month in sorted(months)
+            if (start_date is None or month >= start_date) and cls._get_month_end(month) <= end_date
+        ]
+        gaps = []
+        gap_start = start_date
+        for month in covered:
+            if gap_start is None or gap_start < month:
+                gaps.append((gap_start, month - relativedelta(days=1)))
+            gap_start = cls._get_month_end(month) + relativedelta(days=1)
+        if gap_start is None or gap_start <= end_date:
+            gaps.append((gap_start, end_date))
+        return covered, gaps
+
+    @staticmethod
+    def _get_range_filter(start_date, end_date) -> Q:
+        if start_date is None:
+            return Q(date__lte=end_date)
+        return Q(date__gte=start_date, date__lte=end_date)
+
+    def _aggregate_figures(self, ranges: dict) -> dict:
+        """
+        Additive figures (counts and values) of provider for every date range
+        by a single query, provider with SNAPSHOT_NAME should implement it,
+        other providers have no additive figures
+
+        ranges - range name -> (start date or None, end date)
+        Result: range name -> {figure: value}
+        """
+        return {}
+
+    def _calculate_windows_figures(self) -> dict:
+        """
+        Additive figures of every report window, {window: {figure: value}}
+
+        With from_snapshots, settled months lying completely inside a window
+        are summed from StatsMonthSnapshot, only the rest of the window
+        (open current month, months not settled yet, partial months) is aggregated live -
+        for all windows by a single query
+        """
+        end_date = self._as_date(self.end_date)
+
+        snapshots = {}
+        if self.from_snapshots and self.SNAPSHOT_NAME:
+            snapshots = StatsMonthSnapshot.objects.get_closed_months_data(self.SNAPSHOT_NAME, end_date)
+
+        live_ranges = {}  # (start, end) -> range name, same ranges of windows are aggregated once
+        windows_parts = {}
+        for window, start_date in self._get_report_windows().items():
+            months, gaps = self._split_by_months(self._as_date(start_date), end_date, snapshots)
+            range_names = [live_ranges.setdefault(gap, f'range_{len(live_ranges)}') for gap in gaps]
+            windows_parts[window] = months, range_names
+
+        live = self._aggregate_figures(
+            {name: date_range for date_range, name in live_ranges.items()}
+        ) if live_ranges else {}
+
+        windows = {}
+        for window, (months, range_names) in windows_parts.items():
+            figures = {}
+            for part in [snapshots[month] for month in months] + [live[name] for name in range_names]:
+                for figure, value in part.items():
+                    figures[figure] = figures.get(figure, 0) + value
+            windows[window] = figures
+        return windows
+
+    def _get_period_starts(self, period: str) -> list:
+        """Start dates of all periods (day, week or month) between start_date and end_date"""
+        start_date = self.start_date
+        if isinstance(start_date, datetime.datetime):
+            start_date = start_date.date()
+
+        if period == 'month':
+            current, step = date(start_date.year, start_date.month, 1), relativedelta(months=1)
+        elif period == 'week':
+            # weeks start on Monday as date_trunc('week') does
+            current, step = start_date - relativedelta(days=start_date.weekday()), relativedelta(weeks=1)
+        else:
+            current, step = start_date, relativedelta(days=1)
+
+        starts = []
+        while current <= self.end_date:
+            starts.append(current)
+            current += step
+        return starts
+
+    def _aggregate_time_series(self, categories: dict, period: str = 'month') -> list:
+        """
+        Counts bookings and calculates their value for every category (name -> Q filter)
+        per period between start_date and end_date, by a single GROUP BY query
+        (from BookingDailyRollup in rollup mode)
+
+        Result: list of dicts {'period': start date of period,
+        '[category]_count': ..., '[category]_value': ...} ordered by period,
+        periods without bookings are included with zeros
+        """
+        if period not in self.TIME_SERIES_PERIODS:
+            raise ValueError(f'Unknown period "{period}", expected one of {self.TIME_SERIES_PERIODS}')
+
+        if self.from_rollup:
+            queryset = BookingDailyRollup.objects.all()
+            count_aggregate, value_aggregate = partial(Sum, 'bookings_count'), partial(Sum, 'value_cents')
+        else:
+            queryset = Booking.objects.all()
+            count_aggregate, value_aggregate = partial(Count, 'pk'), partial(Sum, 'total_price_cents')
+
+        aggregates = {}
+        for category, category_filter in categories.items():
+            aggregates[f'{category}_count'] = count_aggregate(filter=category_filter or None)
+            aggregates[f'{category}_value'] = value_aggregate(filter=category_filter or None)
+
+        rows = queryset.filter(date__gte=self.start_date, date__lte=self.end_date) \
+            .annotate(period=Trunc('date', period, output_field=DateField())) \
+            .order_by() \
+            .values('period') \
+            .annotate(**aggregates)
+        rows_by_period = {row['period']: row for row in rows}
+
+        series = []
+        for period_start in self._get_period_starts(period):
+            row = rows_by_period.get(period_start, {})
+            series.append({
+                'period': period_start,
+                **{key: row.get(key) or 0 for key in aggregates}
+            })
+        return series
 
     @property
     def lifetime_months(self) -> int:
@@ -55,6 +401,76 @@ class StatsProvider:
         return abs(delta.years) * 12 + abs(delta.months)
 
 
+class StatsAggregatedProviderMixin:
+    """
+    Calculates all counts and values of provider for every report window
+    by a single query, from bookings or from daily rollup (from_rollup=True)
+
+    With from_snapshots closed months are taken from StatsMonthSnapshot,
+    see StatsProvider._calculate_windows_figures()
+
+    CATEGORIES (of provider) - category name -> Q filter, lookups should exist
+    in both bookings queryset and BookingDailyRollup
+    """
+
+    def __init__(self, start_date: datetime.date = None, end_date: datetime.date = None,
+                 from_rollup: bool = False, from_snapshots: bool = True):
+        super().__init__(start_date=start_date, end_date=end_date)
+        self.from_rollup = from_rollup
+        self.from_snapshots = from_snapshots
+
+    def _get_cache_params(self) -> tuple:
+        return super()._get_cache_params() + (self.from_rollup, self.from_snapshots)
+
+    def _aggregate_figures(self, ranges: dict) -> dict:
+        """'[category]_count' and '[category]_value' of every date range by a single query"""
+        if self.from_rollup:
+            queryset = BookingDailyRollup.objects.all()
+            count_aggregate, value_aggregate = partial(Sum, 'bookings_count'), partial(Sum, 'value_cents')
+        else:
+            queryset = Booking.objects.all()
+            count_aggregate, value_aggregate = partial(Count, 'pk'), partial(Sum, 'total_price_cents')
+
+        aggregates, figures = {}, {}
+        ranges_filter = Q()
+        for number, (name, date_range) in enumerate(ranges.items()):
+            range_filter = self._get_range_filter(*date_range)
+            ranges_filter |= range_filter
+            for category, category_filter in self.CATEGORIES.items():
+                condition = range_filter & category_filter
+                aggregates[f'r{number}_{category}_count'] = count_aggregate(filter=condition)
+                aggregates[f'r{number}_{category}_value'] = value_aggregate(filter=condition)
+                figures[f'r{number}_{category}_count'] = name, f'{category}_count'
+                figures[f'r{number}_{category}_value'] = name, f'{category}_value'
+
+        result = {name: {} for name in ranges}
+        for key, value in queryset.filter(ranges_filter).aggregate(**aggregates).items():
+            name, figure = figures[key]
+            result[name][figure] = value or 0
+        return result
+
+    @property
+    def windows(self) -> dict:
+        """'[window]_[category]_count' and '[window]_[category]_value' of every report window"""
+        if not hasattr(self, '_windows'):
+            self._windows = {
+                f'{window}_{figure}': value
+                for window, window_figures in self._calculate_windows_figures().items()
+                for figure, value in window_figures.items()
+            }
+        return self._windows
+
+    def _get_percentage(self, window: str, category: str, total_category: str = 'all') -> int:
+        total = self.windows[f'{window}_{total_category}_count']
+        if total:
+            return int(self.windows[f'{window}_{category}_count'] / total * 100)
+
+    def _get_average_value(self, window: str, category: str) -> float:
+        count = self.windows[f'{window}_{category}_count']
+        if count:
+            return round(self.windows[f'{window}_{category}_value'] / count, 2)
+
+
 class StatsGeneralProvider(StatsProvider):
 
     def get_average_star_rating_for_booker(self) -> float:
@@ -73,76 +489,73 @@ class StatsGeneralProvider(StatsProvider):
         )
         return res['rating__avg']
 
-    def get_total_credits_in_bookers_accounts(self) -> float:
-        accounts = Account.objects.all().get_valid_for_statistics()\
-            .filter(booker_profile__isnull=False) \
-            .select_related('user')
+    def _get_credits_in_accounts(self, profile_lookup: str) -> dict:
+        """
+        Total and average balance of valid accounts having profile of given type
 
-        total_sum: float = 0
-        # TODO: possibly optimize
-        for account in accounts:
-            total_sum += Transaction.objects.get_user_balance(account.user)
-        return total_sum
+        Calculated by a single query, result is reused by total and average getters
+        """
+        if not hasattr(self, '_credits_in_accounts'):
+            self._credits_in_accounts = {}
 
-    def get_total_credits_in_performers_accounts(self) -> float:
-        accounts = Account.objects.all().get_valid_for_statistics()\
-            .filter(dj_profile__isnull=False) \
-            .select_related('user')
+        if profile_lookup not in self._credits_in_accounts:
 
-        total_sum: float = 0
-        for account in accounts:
-            total_sum += Transaction.objects.get_user_balance(account.user)
-        return total_sum
+            res = Account.objects.all().get_valid_for_statistics() \
+                .filter(**{f'{profile_lookup}__isnull': False}) \
+                .aggregate(
+                    total=Sum(Coalesce('user__user_balance__amount', 0)),
+                    count=Count('pk')
+                )
 
-    def get_average_credits_in_bookers_accounts(self) -> float:
-        accounts = Account.objects.all().get_valid_for_statistics()\
-            .filter(booker_profile__isnull=False) \
-            .select_related('user')
+            total = res['total'] or 0
+            self._credits_in_accounts[profile_lookup] = {
+                'total': total,
+                'average': round(total / res['count'], 2) if res['count'] else None
+            }
 
-        total_sum: float = 0
-        for account in accounts:
-            total_sum += Transaction.objects.get_user_balance(
-                account.user)
+        return self._credits_in_accounts[profile_lookup]
 
-        return round(total_sum / len(accounts), 2)
+    def get_total_credits_in_bookers_accounts(self) -> float:
+        return self._get_credits_in_accounts('booker_profile')['total']
 
-    def get_average_credits_in_performers_accounts(self) -> float:
-        accounts = Account.objects.all().get_valid_for_statistics()\
-            .filter(dj_profile__isnull=False) \
-            .select_related('user')
+    def get_total_credits_in_performers_accounts(self) -> float:
+        return self._get_credits_in_accounts('dj_profile')['total']
 
-        total_sum: float = 0
-        for account in accounts:
-            total_sum += Transaction.objects.get_user_balance(
-                account.user)
+    def get_average_credits_in_bookers_accounts(self) -> float:
+        return self._get_credits_in_accounts('booker_profile')['average']
 
-        return round(total_sum / len(accounts), 2)
+    def get_average_credits_in_performers_accounts(self) -> float:
+        return self._get_credits_in_accounts('dj_profile')['average']
 
     def get_number_of_bookers_verified(self) -> int:
-        return Account.objects.all().get_valid_for_statistics() \
-            .filter(booker_profile__isnull=False) \
-            .select_related('user') \
-            .count()
+        return self._count(
+            Account.objects.all().get_valid_for_statistics() \
+                .filter(booker_profile__isnull=False) \
+                .select_related('user')
+        )
 
     def get_number_of_performers_verified(self) -> int:
-        return Account.objects.all().get_valid_for_statistics() \
-            .filter(dj_profile__isnull=False) \
-            .select_related('user') \
-            .count()
+        return self._count(
+            Account.objects.all().get_valid_for_statistics() \
+                .filter(dj_profile__isnull=False) \
+                .select_related('user')
+        )
 
     def get_number_of_performers_able_to_play_clean_mix(self) -> int:
-        return Account.objects.all().get_valid_for_statistics() \
-            .filter(dj_profile__isnull=False) \
-            .filter(dj_profile__clean_mix=True) \
-            .select_related('user', 'dj_profile') \
-            .count()
+        return self._count(
+            Account.objects.all().get_valid_for_statistics() \
+                .filter(dj_profile__isnull=False) \
+                .filter(dj_profile__clean_mix=True) \
+                .select_related('user', 'dj_profile')
+        )
 
     def get_number_of_performers_able_to_play_virtual_mix(self) -> int:
-        return Account.objects.all().get_valid_for_statistics() \
-            .filter(dj_profile__isnull=False) \
-            .filter(dj_profile__virtual_mix=True) \
-            .select_related('user', 'dj_profile') \
-            .count()
+        return self._count(
+            Account.objects.all().get_valid_for_statistics() \
+                .filter(dj_profile__isnull=False) \
+                .filter(dj_profile__virtual_mix=True) \
+                .select_related('user', 'dj_profile')
+        )
 
     def get_percentage_of_performers_able_to_play_clean_mix(self) -> int:
         num = self.get_number_of_performers_able_to_play_clean_mix()
@@ -171,53 +584,134 @@ class StatsKPIProvider(StatsProvider):
         return results
 
     def get_booker_music_preferences(self):
-        values = BookerProfile.objects.annotate(
-            arr_elements=Func(F('favorite_music'), function='unnest')
-        ).values_list('arr_elements', flat=True)
-        results = []
-        for (value, count) in Counter(values).most_common(5):
-            name = [m for m in Music.choices if m[0] == value][0][1]
-            results.append({'music': name, 'count': count})
-        return results
+        return self._get_music_preferences(BookerProfile.objects.all(), 'favorite_music')
 
     def get_performer_music_preferences(self):
-        values = DJProfile.objects.annotate(
-             arr_elements=Func(F('music_can_play'), function='unnest')
-        ).values_list('arr_elements', flat=True)
-        results = []
-        for (value, count) in Counter(values).most_common(5):
-            name = [m for m in Music.choices if m[0] == value][0][1]
-            results.append({'music': name, 'count': count})
-        return results
+        return self._get_music_preferences(DJProfile.objects.all(), 'music_can_play')
+
+    def get_booking_music_preferences(self):
+        return self._get_music_preferences(Booking.objects.all(), 'music_list')
+
+    def _get_music_preferences(self, queryset, field: str, limit: int = 5) -> list:
+        """Most common values of music array field, counted by database"""
+        rows = queryset.annotate(
+            music=Func(F(field), function='unnest')
+        ).order_by().values('music').annotate(count=Count('*')).order_by('-count', 'music')[0:limit]
+        return [{'music': MUSIC_LABELS.get(row['music']), 'count': row['count']} for row in rows]
 
 
 class StatsServiceTimeProvider(StatsProvider):
+    """
+    Distribution of gigs duration: average, median, minimum, maximum, PERCENTILES
+    and histogram of one hour buckets (the last one is for HISTOGRAM_HOURS and longer),
+    all calculated by a single query
+
+    Bookings can be limited by dates and gig type, all bookings by default
+    """
+
+    PERCENTILES = (90, 95, 99)
+    HISTOGRAM_HOURS = 12
+
+    def __init__(self, start_date: datetime.date = None, end_date: datetime.date = None,
+                 gig_type: int = None):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.gig_type = gig_type
+
+    def _get_cache_params(self) -> tuple:
+        return super()._get_cache_params() + (self.gig_type,)
+
+    def _get_bookings(self):
+        bookings = Booking.objects.all()
+        if self.start_date is not None:
+            bookings = bookings.filter(date__gte=self.start_date)
+        if self.end_date is not None:
+            bookings = bookings.filter_before_and_including_date(date=self.end_date)
+        if self.gig_type is not None:
+            bookings = bookings.filter(gig_type=self.gig_type)
+        return bookings.annotate(duration_bucket=WidthBucket(
+            'duration', 0, self.HISTOGRAM_HOURS * 60, self.HISTOGRAM_HOURS
+        ))
+
+    def _get_distribution_aggregates(self) -> dict:
+        aggregates = {
+            'average': Avg('duration'),
+            'median': Median('duration'),
+            'minimum': Min('duration'),
+            'maximum': Max('duration'),
+        }
+        for percentile in self.PERCENTILES:
+            aggregates[f'p{percentile}'] = Percentile('duration', percentile / 100)
+        # durations are not negative, so there is no bucket 0
+        for bucket in range(1, self.HISTOGRAM_HOURS + 2):
+            aggregates[f'bucket_{bucket}'] = Count('pk', filter=Q(duration_bucket=bucket))
+        return aggregates
+
+    def _get_distribution(self, row: dict) -> dict:
+        """Durations of aggregated row in hours"""
+
+        def to_hours(minutes):
+            if minutes is not None:
+                return round(minutes / 60, 1)
+
+        return {
+            'average': to_hours(row['average']),
+            'median': to_hours(row['median']),
+            'minimum': to_hours(row['minimum']),
+            'maximum': to_hours(row['maximum']),
+            'percentiles': {
+                f'p{percentile}': to_hours(row[f'p{percentile}']) for percentile in self.PERCENTILES
+            },
+            'histogram': [
+                {
+                    'hours_from': bucket - 1,
+                    'hours_to': bucket if bucket <= self.HISTOGRAM_HOURS else None,
+                    'count': row[f'bucket_{bucket}']
+                }
+                for bucket in range(1, self.HISTOGRAM_HOURS + 2)
+            ],
+        }
+
+    @property
+    def distribution(self) -> dict:
+        if not hasattr(self, '_distribution'):
+            self._distribution = self._get_distribution(
+                self._get_bookings().aggregate(**self._get_distribution_aggregates())
+            )
+        return self._distribution
+
+    def calculate_distribution_by_gig_type(self) -> dict:
+        """Duration distribution of every gig type by a single query, {gig type: distribution}"""
+        rows = self._get_bookings() \
+            .order_by() \
+            .values('gig_type') \
+            .annotate(**self._get_distribution_aggregates())
+        gig_types = dict(Booking.TYPES)
+        return {gig_types.get(row['gig_type']): self._get_distribution(row) for row in rows}
 
     def get_average_number_of_hours_per_reservation(self) -> float:
-        value = Booking.objects.aggregate(Avg('duration'))
-        if value['duration__avg'] is not None:
-            return round(value['duration__avg'] / 60, 1)
+        return self.distribution['average']
 
     def get_median_number_of_hours_for_reservation(self) -> float:
-        value = Booking.objects.aggregate(Median('duration'))
-        if value['duration__median'] is not None:
-            return round(value['duration__median'] / 60, 1)
+        return self.distribution['median']
 
     def get_minimum_number_of_hours_for_reservation(self) -> float:
-        value = Booking.objects.aggregate(Min('duration'))
-        if value['duration__min'] is not None:
-            return round(value['duration__min'] / 60, 1)
+        return self.distribution['minimum']
 
     def get_maximum_number_of_hours_for_reservation(self) -> float:
-        value = Booking.objects.aggregate(Max('duration'))
-        if value['duration__max'] is not None:
-            return round(value['duration__max'] / 60, 1)
+        return self.distribution['maximum']
+
+    def get_percentiles_of_number_of_hours_for_reservation(self) -> dict:
+        return self.distribution['percentiles']
+
+    def get_histogram_of_number_of_hours_for_reservation(self) -> list:
+        return self.distribution['histogram']
 
 
 class StatsServiceEscrowProvider(StatsProvider):
 
     def get_number_of_gigs_in_escrow(self) -> int:
-        return Booking.objects.get_accepted_by_dj().count()
+        return self._count(Booking.objects.get_accepted_by_dj())
 
     def get_value_of_gigs_in_escrow(self) -> float:
         return self._calculate_bookings_value(
@@ -225,7 +719,7 @@ class StatsServiceEscrowProvider(StatsProvider):
         )
 
     def get_number_of_gigs_pending_acceptance(self) -> int:
-        return Booking.objects.get_paid().count()
+        return self._count(Booking.objects.get_paid())
 
     def get_value_of_gigs_pending_acceptance(self) -> float:
         return self._calculate_bookings_value(
@@ -235,6 +729,13 @@ class StatsServiceEscrowProvider(StatsProvider):
 
 class StatsServiceGigsProvider(StatsProvider):
 
+    CATEGORIES = {
+        'all': Q(),
+        'clean_mix': Q(clean_mix=True),
+        'virtual_mix': Q(virtual_mix=True),
+        'completed': Q(status=Booking.Status.COMPLETED),
+    }
+
     def __init__(self, start_date: datetime.date = None, end_date: datetime.date = None):
 
         if start_date is None:
@@ -247,6 +748,10 @@ class StatsServiceGigsProvider(StatsProvider):
         else:
             self.end_date = end_date
 
+    def calculate_time_series(self, period: str = 'month') -> list:
+        """Count and value of bookings of every category per period, see _aggregate_time_series()"""
+        return self._aggregate_time_series(self.CATEGORIES, period)
+
     def _get_completed_bookings_from_date(self, start_date):
         return Booking.objects.get_completed() \
         .filter_before_and_including_date(date=self.end_date) \
@@ -255,26 +760,30 @@ class StatsServiceGigsProvider(StatsProvider):
     # depend on 2 dates
 
     def get_period_percentage_of_gigs_using_a_clean_mix(self) -> int:
-        num = Booking.objects.filter(clean_mix=True) \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .count()
-        total = Booking.objects.all() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .count()
+        num = self._count(
+            Booking.objects.filter(clean_mix=True) \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date)
+        )
+        total = self._count(
+            Booking.objects.all() \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date)
+        )
         if total:
             return int(num / total * 100)
 
     def get_period_percentage_of_gigs_played_virtually(self) -> int:
-        num = Booking.objects.filter(virtual_mix=True) \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .count()
-        total = Booking.objects.all() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .count()
+        num = self._count(
+            Booking.objects.filter(virtual_mix=True) \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date)
+        )
+        total = self._count(
+            Booking.objects.all() \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date)
+        )
         if total:
             return int(num / total * 100)
 
@@ -282,7 +791,7 @@ class StatsServiceGigsProvider(StatsProvider):
         bookings = Booking.objects.get_completed() \
             .filter_before_and_including_date(date=self.end_date) \
             .filter(date__gte=self.start_date)
-        return bookings.count()
+        return self._count(bookings)
 
     def get_period_reservations_value(self) -> int:
         bookings = Booking.objects.get_completed() \
@@ -309,7 +818,7 @@ class StatsServiceGigsProvider(StatsProvider):
     def get_lifetime_reservations_completed(self) -> int:
         bookings = Booking.objects.get_completed() \
         .filter_before_and_including_date(date=self.end_date)
-        return bookings.count()
+        return self._count(bookings)
 
     def get_lifetime_reservations_value(self) -> int:
         bookings = Booking.objects.get_completed() \
@@ -331,9 +840,11 @@ class StatsServiceGigsProvider(StatsProvider):
             )
 
     def get_ytd_reservations_completed(self) -> int:
-        return self._get_completed_bookings_from_date(
-            start_date=date(self.end_date.year, 1, 1)
-        ).count()
+        return self._count(
+            self._get_completed_bookings_from_date(
+                start_date=date(self.end_date.year, 1, 1)
+            )
+        )
 
     def get_ytd_reservations_value(self) -> int:
         return self._calculate_bookings_value(
@@ -343,9 +854,11 @@ class StatsServiceGigsProvider(StatsProvider):
         )
 
     def get_last_6_months_reservations_completed(self) -> int:
-        return self._get_completed_bookings_from_date(
-            start_date=self.end_date + relativedelta(months=-6)
-        ).count()
+        return self._count(
+            self._get_completed_bookings_from_date(
+                start_date=self.end_date + relativedelta(months=-6)
+            )
+        )
 
     def get_last_6_months_reservations_value(self) -> int:
         return self._calculate_bookings_value(
@@ -355,9 +868,11 @@ class StatsServiceGigsProvider(StatsProvider):
         )
 
     def get_current_month_reservations_completed(self) -> int:
-        return self._get_completed_bookings_from_date(
-            start_date=date(self.end_date.year, self.end_date.month, 1)
-        ).count()
+        return self._count(
+            self._get_completed_bookings_from_date(
+                start_date=date(self.end_date.year, self.end_date.month, 1)
+            )
+        )
 
     def get_current_month_reservations_value(self) -> int:
         return self._calculate_bookings_value(
@@ -367,8 +882,60 @@ class StatsServiceGigsProvider(StatsProvider):
         )
 
 
+class StatsServiceGigsAggregatedProvider(StatsAggregatedProviderMixin, StatsServiceGigsProvider):
+    """
+    Same results as StatsServiceGigsProvider, but all counts and values
+    for every report window are calculated by a single query
+    """
+
+    SNAPSHOT_NAME = 'gigs'
+
+    def get_period_percentage_of_gigs_using_a_clean_mix(self) -> int:
+        return self._get_percentage('period', 'clean_mix')
+
+    def get_period_percentage_of_gigs_played_virtually(self) -> int:
+        return self._get_percentage('period', 'virtual_mix')
+
+    def get_period_reservations_completed(self) -> int:
+        return self.windows['period_completed_count']
+
+    def get_period_reservations_value(self) -> int:
+        return self.windows['period_completed_value']
+
+    def get_lifetime_reservations_completed(self) -> int:
+        return self.windows['lifetime_completed_count']
+
+    def get_lifetime_reservations_value(self) -> int:
+        return self.windows['lifetime_completed_value']
+
+    def get_ytd_reservations_completed(self) -> int:
+        return self.windows['ytd_completed_count']
+
+    def get_ytd_reservations_value(self) -> int:
+        return self.windows['ytd_completed_value']
+
+    def get_last_6_months_reservations_completed(self) -> int:
+        return self.windows['last_6_months_completed_count']
+
+    def get_last_6_months_reservations_value(self) -> int:
+        return self.windows['last_6_months_completed_value']
+
+    def get_current_month_reservations_completed(self) -> int:
+        return self.windows['current_month_completed_count']
+
+    def get_current_month_reservations_value(self) -> int:
+        return self.windows['current_month_completed_value']
+
+
 class StatsServiceCancelationsProvider(StatsProvider):
 
+    CATEGORIES = {
+        'all': Q(),
+        'canceled': Q(status__in=[Booking.Status.CANCELED_BY_BOOKER, Booking.Status.CANCELED_BY_DJ]),
+        'canceled_by_booker': Q(status=Booking.Status.CANCELED_BY_BOOKER),
+        'canceled_by_performer': Q(status=Booking.Status.CANCELED_BY_DJ),
+    }
+
     def __init__(self, start_date: datetime.date = None, end_date: datetime.date = None):
 
         if start_date is None:
@@ -381,6 +948,10 @@ class StatsServiceCancelationsProvider(StatsProvider):
         else:
             self.end_date = end_date
 
+    def calculate_time_series(self, period: str = 'month') -> list:
+        """Count and value of bookings of every category per period, see _aggregate_time_series()"""
+        return self._aggregate_time_series(self.CATEGORIES, period)
+
     def _get_canceled_bookings_from_date(self, start_date):
         return Booking.objects.get_canceled() \
             .filter_before_and_including_date(date=self.end_date) \
@@ -389,44 +960,53 @@ class StatsServiceCancelationsProvider(StatsProvider):
     # depend on 2 dates
 
     def get_period_percentage_of_reservations_canceled(self) -> int:
-        num = Booking.objects.all() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(
-                status__in=[Booking.Status.CANCELED_BY_BOOKER, Booking.Status.CANCELED_BY_DJ]
-            ).count()
-        total = Booking.objects.all() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .count()
+        num = self._count(
+            Booking.objects.all() \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date) \
+                .filter(
+                    status__in=[Booking.Status.CANCELED_BY_BOOKER, Booking.Status.CANCELED_BY_DJ]
+                )
+        )
+        total = self._count(
+            Booking.objects.all() \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date)
+        )
         if total:
             return int(num / total * 100)
 
     def get_period_percentage_of_reservations_canceled_by_booker(self) -> int:
-        num = Booking.objects.all() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(
-                status__in=[Booking.Status.CANCELED_BY_BOOKER]
-            ).count()
-        total = Booking.objects.all() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .count()
+        num = self._count(
+            Booking.objects.all() \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date) \
+                .filter(
+                    status__in=[Booking.Status.CANCELED_BY_BOOKER]
+                )
+        )
+        total = self._count(
+            Booking.objects.all() \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date)
+        )
         if total:
             return int(num / total * 100)
 
     def get_period_percentage_of_reservations_canceled_by_performer(self) -> int:
-        num = Booking.objects.all() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(
-                status__in=[Booking.Status.CANCELED_BY_DJ]
-            ).count()
-        total = Booking.objects.all() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .count()
+        num = self._count(
+            Booking.objects.all() \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date) \
+                .filter(
+                    status__in=[Booking.Status.CANCELED_BY_DJ]
+                )
+        )
+        total = self._count(
+            Booking.objects.all() \
+                .filter_before_and_including_date(date=self.end_date) \
+                .filter(date__gte=self.start_date)
+        )
         if total:
             return int(num / total * 100)
 
@@ -434,7 +1014,7 @@ class StatsServiceCancelationsProvider(StatsProvider):
         bookings = Booking.objects.get_canceled() \
             .filter_before_and_including_date(date=self.end_date) \
             .filter(date__gte=self.start_date)
-        return bookings.count()
+        return self._count(bookings)
 
     def get_period_canceled_reservations_value(self) -> int:
         bookings = Booking.objects.get_canceled() \
@@ -461,7 +1041,7 @@ class StatsServiceCancelationsProvider(StatsProvider):
     def get_lifetime_reservations_canceled(self) -> int:
         bookings = Booking.objects.get_canceled() \
             .filter_before_and_including_date(date=self.end_date)
-        return bookings.count()
+        return self._count(bookings)
 
     def get_lifetime_canceled_reservations_value(self) -> int:
         bookings = Booking.objects.get_canceled() \
@@ -483,9 +1063,11 @@ class StatsServiceCancelationsProvider(StatsProvider):
             )
 
     def get_ytd_reservations_canceled(self) -> int:
-        return self._get_canceled_bookings_from_date(
-            start_date=date(self.end_date.year, 1, 1)
-        ).count()
+        return self._count(
+            self._get_canceled_bookings_from_date(
+                start_date=date(self.end_date.year, 1, 1)
+            )
+        )
 
     def get_ytd_canceled_reservations_value(self) -> int:
         return self._calculate_bookings_value(
@@ -495,9 +1077,11 @@ class StatsServiceCancelationsProvider(StatsProvider):
         )
 
     def get_last_6_months_reservations_canceled(self) -> int:
-        return self._get_canceled_bookings_from_date(
-            start_date=self.end_date + relativedelta(months=-6)
-        ).count()
+        return self._count(
+            self._get_canceled_bookings_from_date(
+                start_date=self.end_date + relativedelta(months=-6)
+            )
+        )
 
     def get_last_6_months_canceled_reservations_value(self) -> int:
         return self._calculate_bookings_value(
@@ -507,9 +1091,11 @@ class StatsServiceCancelationsProvider(StatsProvider):
         )
 
     def get_current_month_reservations_canceled(self) -> int:
-        return self._get_canceled_bookings_from_date(
-            start_date=date(self.end_date.year, self.end_date.month, 1)
-        ).count()
+        return self._count(
+            self._get_canceled_bookings_from_date(
+                start_date=date(self.end_date.year, self.end_date.month, 1)
+            )
+        )
 
     def get_current_month_canceled_reservations_value(self) -> int:
         return self._calculate_bookings_value(
@@ -519,9 +1105,72 @@ class StatsServiceCancelationsProvider(StatsProvider):
         )
 
 
+class StatsServiceCancelationsAggregatedProvider(StatsAggregatedProviderMixin,
+                                                  StatsServiceCancelationsProvider):
+    """
+    Same results as StatsServiceCancelationsProvider, but all counts and values
+    for every report window are calculated by a single query
+    """
+
+    SNAPSHOT_NAME = 'cancelations'
+
+    def get_period_percentage_of_reservations_canceled(self) -> int:
+        return self._get_percentage('period', 'canceled')
+
+    def get_period_percentage_of_reservations_canceled_by_booker(self) -> int:
+        return self._get_percentage('period', 'canceled_by_booker')
+
+    def get_period_percentage_of_reservations_canceled_by_performer(self) -> int:
+        return self._get_percentage('period', 'canceled_by_performer')
+
+    def get_period_reservations_canceled(self) -> int:
+        return self.windows['period_canceled_count']
+
+    def get_period_canceled_reservations_value(self) -> int:
+        return self.windows['period_canceled_value']
+
+    def get_lifetime_reservations_canceled(self) -> int:
+        return self.windows['lifetime_canceled_count']
+
+    def get_lifetime_canceled_reservations_value(self) -> int:
+        return self.windows['lifetime_canceled_value']
+
+    def get_ytd_reservations_canceled(self) -> int:
+        return self.windows['ytd_canceled_count']
+
+    def get_ytd_canceled_reservations_value(self) -> int:
+        return self.windows['ytd_canceled_value']
+
+    def get_last_6_months_reservations_canceled(self) -> int:
+        return self.windows['last_6_months_canceled_count']
+
+    def get_last_6_months_canceled_reservations_value(self) -> int:
+        return self.windows['last_6_months_canceled_value']
+
+    def get_current_month_reservations_canceled(self) -> int:
+        return self.windows['current_month_canceled_count']
+
+    def get_current_month_canceled_reservations_value(self) -> int:
+        return self.windows['current_month_canceled_value']
+
+
 class StatsServiceDisputesProvider(StatsProvider):
+    """
+    All counts and values of disputes providers are derived from
+    a single query grouping bookings by dispute outcome (see outcomes),
+    closed months are taken from snapshots (from_snapshots=True)
+    """
 
-    def __init__(self, start_date: datetime.date = None, end_date: datetime.date = None):
+    DISPUTED_BOOKING_STATUSES = [Booking.Status.IN_DISPUTE, Booking.Status.DISPUTED]
+
+    # dispute statuses of reservations counted as disputed by provider (None - all)
+    DISPUTE_STATUSES = None
+
+    # all disputes providers share figures of snapshot
+    SNAPSHOT_NAME = 'disputes'
+
+    def __init__(self, start_date: datetime.date = None, end_date: datetime.date = None,
+                 from_rollup: bool = False, from_snapshots: bool = True):
 
         if start_date is None:
             self.start_date = settings.SERVICE_LIFETIME_START_DATETIME
@@ -533,84 +1182,134 @@ class StatsServiceDisputesProvider(StatsProvider):
         else:
             self.end_date = end_date
 
+        self.from_rollup = from_rollup
+        self.from_snapshots = from_snapshots
+
+    def _get_cache_params(self) -> tuple:
+        return super()._get_cache_params() + (self.from_rollup, self.from_snapshots)
+
+    def _aggregate_figures(self, ranges: dict) -> dict:
+        """
+        '[outcome]_count' and '[outcome]_value' of every date range by a single query
+        grouping bookings (BookingDailyRollup in rollup mode) by dispute outcome:
+        'none' - booking is not disputed, '0' - disputed without dispute, otherwise Dispute.Status
+        """
+        if self.from_rollup:
+            queryset = BookingDailyRollup.objects.all()
+            dispute_status = 'dispute_status'
+            count_aggregate, value_aggregate = partial(Sum, 'bookings_count'), partial(Sum, 'value_cents')
+        else:
+            queryset = Booking.objects.all()
+            dispute_status = 'dispute__status'
+            count_aggregate, value_aggregate = partial(Count, 'pk'), partial(Sum, 'total_price_cents')
+
+        aggregates, figures = {}, {}
+        ranges_filter = Q()
+        for number, (name, date_range) in enumerate(ranges.items()):
+            range_filter = self._get_range_filter(*date_range)
+            ranges_filter |= range_filter
+            aggregates[f'r{number}_count'] = count_aggregate(filter=range_filter)
+            aggregates[f'r{number}_value'] = value_aggregate(filter=range_filter)
+            figures[f'r{number}_count'] = name, 'count'
+            figures[f'r{number}_value'] = name, 'value'
+
+        rows = queryset.filter(ranges_filter) \
+            .annotate(outcome=Case(
+                When(status__in=self.DISPUTED_BOOKING_STATUSES, then=Coalesce(dispute_status, 0)),
+                output_field=IntegerField()
+            )) \
+            .order_by() \
+            .values('outcome') \
+            .annotate(**aggregates)
+
+        result = {name: {} for name in ranges}
+        for row in rows:
+            outcome = 'none' if row['outcome'] is None else str(row['outcome'])
+            for key, (name, figure) in figures.items():
+                result[name][f'{outcome}_{figure}'] = row[key] or 0
+        return result
+
+    @property
+    def outcomes(self) -> dict:
+        """
+        Count and value of bookings for every report window grouped by dispute outcome:
+        None - booking is not disputed, 0 - disputed without dispute, otherwise Dispute.Status
+
+        {outcome: {'[window]_count': ..., '[window]_value': ...}}
+        """
+        if not hasattr(self, '_outcomes'):
+            self._outcomes = {}
+            for window, window_figures in self._calculate_windows_figures().items():
+                for key, value in window_figures.items():
+                    outcome, figure = key.rsplit('_', 1)
+                    outcome = None if outcome == 'none' else int(outcome)
+                    self._outcomes.setdefault(outcome, {})[f'{window}_{figure}'] = value
+
+        return self._outcomes
+
+    def _sum_outcomes(self, key: str, outcomes_filter) -> int:
+        return sum([values.get(key, 0) for outcome, values in self.outcomes.items() if outcomes_filter(outcome)])
+
+    def _get_disputed_count(self, window: str, dispute_statuses: list = None) -> int:
+        """Number of disputed bookings in window having given dispute statuses (None - all)"""
+        return self._sum_outcomes(
+            f'{window}_count',
+            lambda outcome: outcome is not None and (dispute_statuses is None or outcome in dispute_statuses)
+        )
+
+    def _get_disputed_value(self, window: str, dispute_statuses: list = None) -> int:
+        """Value of disputed bookings in window having given dispute statuses (None - all)"""
+        return self._sum_outcomes(
+            f'{window}_value',
+            lambda outcome: outcome is not None and (dispute_statuses is None or outcome in dispute_statuses)
+        )
+
     # depend on 2 dates
 
     def get_period_percentage_of_reservations_disputed(self) -> int:
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .count()
-        total = Booking.objects.all() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .count()
+        num = self._get_disputed_count('period')
+        total = self._sum_outcomes('period_count', lambda outcome: True)
         if total:
             return int(num / total * 100)
 
     def get_period_average_gig_value_of_reservation_disputed(self) -> float:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date)
-        if bookings:
+        count = self._get_disputed_count('period')
+        if count:
             return round(
-                self._calculate_bookings_value(bookings) / bookings.count(),
+                self._get_disputed_value('period') / count,
                 2
             )
 
-    # common
-
-    def _get_bookings_disputed_from_date(self, start_date):
-        return Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=start_date)
-
 
 class StatsServiceAllDisputesProvider(StatsServiceDisputesProvider):
 
+    AWARDED_TO_BOOKER_STATUSES = [
+        Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
+        Dispute.Status.DJ_CONCEDED
+    ]
+    AWARDED_TO_PERFORMER_STATUSES = [
+        Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
+    ]
+
     def get_period_reservations_disputed(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date)
-        return bookings.count()
+        return self._get_disputed_count('period', self.DISPUTE_STATUSES)
 
     def get_period_disputed_reservations_value(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date)
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('period', self.DISPUTE_STATUSES)
 
     # awarded to booker and performer
 
     def get_period_percentage_of_disputes_awarded_to_booker(self) -> int:
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR, \
-                Dispute.Status.DJ_CONCEDED
-            ]).count()
+        num = self._get_disputed_count('period', self.AWARDED_TO_BOOKER_STATUSES)
         total = self.get_period_reservations_disputed()
         if total:
             return int(num / total * 100)
 
     def get_period_value_of_disputes_awarded_to_booker(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR, \
-                Dispute.Status.DJ_CONCEDED
-            ])
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('period', self.AWARDED_TO_BOOKER_STATUSES)
 
     def get_period_average_value_of_disputes_awarded_to_booker(self) -> float:
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
-                Dispute.Status.DJ_CONCEDED
-            ]).count()
+        num = self._get_disputed_count('period', self.AWARDED_TO_BOOKER_STATUSES)
         if num:
             return round(
                 self.get_period_value_of_disputes_awarded_to_booker() / num,
@@ -618,34 +1317,16 @@ class StatsServiceAllDisputesProvider(StatsServiceDisputesProvider):
             )
 
     def get_period_percentage_of_disputes_awarded_to_performer(self) -> int:
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ]).count()
+        num = self._get_disputed_count('period', self.AWARDED_TO_PERFORMER_STATUSES)
         total = self.get_period_reservations_disputed()
         if total:
             return int(num / total * 100)
 
     def get_period_value_of_disputes_awarded_to_performer(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ])
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('period', self.AWARDED_TO_PERFORMER_STATUSES)
 
     def get_period_average_value_of_disputes_awarded_to_performer(self) -> float:
-
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ]).count()
-
+        num = self._get_disputed_count('period', self.AWARDED_TO_PERFORMER_STATUSES)
         if num:
             return round(
                 self.get_period_value_of_disputes_awarded_to_performer() / num,
@@ -655,14 +1336,10 @@ class StatsServiceAllDisputesProvider(StatsServiceDisputesProvider):
     # have FIXED start_date - till the end date (NOW by default)
 
     def get_lifetime_reservations_disputed(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date)
-        return bookings.count()
+        return self._get_disputed_count('lifetime', self.DISPUTE_STATUSES)
 
     def get_lifetime_disputed_reservations_value(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date)
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('lifetime', self.DISPUTE_STATUSES)
 
     def get_lifetime_monthly_dispute_average(self) -> float:
         if self.lifetime_months:
@@ -679,91 +1356,57 @@ class StatsServiceAllDisputesProvider(StatsServiceDisputesProvider):
             )
 
     def get_ytd_reservations_disputed(self) -> int:
-        return self._get_bookings_disputed_from_date(
-            start_date=date(self.end_date.year, 1, 1)
-        ).count()
+        return self._get_disputed_count('ytd', self.DISPUTE_STATUSES)
 
     def get_ytd_disputed_reservations_value(self) -> int:
-        return self._calculate_bookings_value(
-            self._get_bookings_disputed_from_date(
-                start_date=date(self.end_date.year, 1, 1)
-            )
-        )
+        return self._get_disputed_value('ytd', self.DISPUTE_STATUSES)
 
     def get_last_6_months_reservations_disputed(self) -> int:
-        return self._get_bookings_disputed_from_date(
-            start_date=self.end_date + relativedelta(months=-6)
-        ).count()
+        return self._get_disputed_count('last_6_months', self.DISPUTE_STATUSES)
 
     def get_last_6_months_disputed_reservations_value(self) -> int:
-        return self._calculate_bookings_value(
-            self._get_bookings_disputed_from_date(
-                start_date=self.end_date + relativedelta(months=-6)
-            )
-        )
+        return self._get_disputed_value('last_6_months', self.DISPUTE_STATUSES)
 
     def get_current_month_reservations_disputed(self) -> int:
-        return self._get_bookings_disputed_from_date(
-            start_date=date(self.end_date.year, self.end_date.month, 1)
-        ).count()
+        return self._get_disputed_count('current_month', self.DISPUTE_STATUSES)
 
     def get_current_month_disputed_reservations_value(self) -> int:
-        return self._calculate_bookings_value(
-            self._get_bookings_disputed_from_date(
-                start_date=date(self.end_date.year, self.end_date.month, 1)
-            )
-        )
+        return self._get_disputed_value('current_month', self.DISPUTE_STATUSES)
 
 
 class StatsServiceDisputesWithoutMDDProvider(StatsServiceDisputesProvider):
 
-    def _get_bookings_disputed_from_date_without_mdd(self, start_date):
-        return Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.DJ_CONCEDED
-            ])
+    DISPUTE_STATUSES = [
+        Dispute.Status.DJ_CONCEDED
+    ]
+    AWARDED_TO_BOOKER_STATUSES = [
+        Dispute.Status.DJ_CONCEDED
+    ]
 
     # depend on 2 dates
 
     def get_period_reservations_disputed(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.DJ_CONCEDED
-            ])
-        return bookings.count()
+        return self._get_disputed_count('period', self.DISPUTE_STATUSES)
 
     def get_period_disputed_reservations_value(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.DJ_CONCEDED
-            ])
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('period', self.DISPUTE_STATUSES)
 
     def get_period_percentage_of_disputes_awarded_to_booker(self) -> int:
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.DJ_CONCEDED
-            ]).count()
+        num = self._get_disputed_count('period', self.AWARDED_TO_BOOKER_STATUSES)
         total = self.get_period_reservations_disputed()
         if total:
             return int(num / total * 100)
 
     def get_period_value_of_disputes_awarded_to_booker(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.DJ_CONCEDED
-            ])
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('period', self.AWARDED_TO_BOOKER_STATUSES)
+
+    def get_period_average_value_of_disputes_awarded_to_booker(self) -> float:
+        num = self._get_disputed_count('period', self.AWARDED_TO_BOOKER_STATUSES)
+        if num:
+            return round(
+                self.get_period_value_of_disputes_awarded_to_booker() / num,
+                2
+            )
 
     def get_period_monthly_dispute_average_without_mdd(self) -> float:
         if self.months_in_period:
@@ -779,38 +1422,15 @@ class StatsServiceDisputesWithoutMDDProvider(StatsServiceDisputesProvider):
                 2
             )
 
-    def get_period_average_value_of_disputes_awarded_to_booker(self) -> float:
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.DJ_CONCEDED
-            ]).count()
-        if num:
-            return round(
-                self.get_period_value_of_disputes_awarded_to_booker() / num,
-                2
-            )
-
     # important:  by design there are no disputes conceded to performer
 
     # have FIXED start_date - till the end date (NOW by default)
 
     def get_lifetime_reservations_disputed(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.DJ_CONCEDED
-            ])
-        return bookings.count()
+        return self._get_disputed_count('lifetime', self.DISPUTE_STATUSES)
 
     def get_lifetime_disputed_reservations_value(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.DJ_CONCEDED
-            ])
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('lifetime', self.DISPUTE_STATUSES)
 
     # all for without mdd
 
@@ -829,83 +1449,50 @@ class StatsServiceDisputesWithoutMDDProvider(StatsServiceDisputesProvider):
             )
 
     def get_ytd_reservations_disputed(self) -> int:
-        return self._get_bookings_disputed_from_date_without_mdd(
-            start_date=date(self.end_date.year, 1, 1)
-        ) \
-            .count()
+        return self._get_disputed_count('ytd', self.DISPUTE_STATUSES)
 
     def get_ytd_disputed_reservations_value(self) -> int:
-        return self._calculate_bookings_value(
-            self._get_bookings_disputed_from_date_without_mdd(
-                start_date=date(self.end_date.year, 1, 1)
-            )
-        )
+        return self._get_disputed_value('ytd', self.DISPUTE_STATUSES)
 
     def get_last_6_months_reservations_disputed(self) -> int:
-        return self._get_bookings_disputed_from_date_without_mdd(
-            start_date=self.end_date + relativedelta(months=-6)
-        ).count()
+        return self._get_disputed_count('last_6_months', self.DISPUTE_STATUSES)
 
     def get_last_6_months_disputed_reservations_value(self) -> int:
-        return self._calculate_bookings_value(
-            self._get_bookings_disputed_from_date_without_mdd(
-                start_date=self.end_date + relativedelta(months=-6)
-            )
-        )
+        return self._get_disputed_value('last_6_months', self.DISPUTE_STATUSES)
 
     def get_current_month_reservations_disputed(self) -> int:
-        return self._get_bookings_disputed_from_date_without_mdd(
-            start_date=date(self.end_date.year, self.end_date.month, 1)
-        ).count()
+        return self._get_disputed_count('current_month', self.DISPUTE_STATUSES)
 
     def get_current_month_disputed_reservations_value(self) -> int:
-        return self._calculate_bookings_value(
-            self._get_bookings_disputed_from_date_without_mdd(
-                start_date=date(self.end_date.year, self.end_date.month, 1)
-            )
-        )
+        return self._get_disputed_value('current_month', self.DISPUTE_STATUSES)
 
 
 class StatsServiceDisputesByMDDProvider(StatsServiceDisputesProvider):
 
-    def _get_bookings_disputed_from_date_by_mdd(self, start_date):
-        return Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ])
+    DISPUTE_STATUSES = [
+        Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
+        Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
+    ]
+    AWARDED_TO_BOOKER_STATUSES = [
+        Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR
+    ]
+    AWARDED_TO_PERFORMER_STATUSES = [
+        Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
+    ]
 
     # depend on 2 dates
 
     def get_period_percentage_of_disputes_awarded_to_booker(self) -> int:
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR
-            ]).count()
+        num = self._get_disputed_count('period', self.AWARDED_TO_BOOKER_STATUSES)
         total = self.get_period_reservations_disputed()
         if total:
             return int(num / total * 100)
 
     def get_period_value_of_disputes_awarded_to_booker(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR
-            ])
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('period', self.AWARDED_TO_BOOKER_STATUSES)
 
     def get_period_average_value_of_disputes_awarded_to_booker(self) -> float:
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR
-            ]).count()
+        num = self._get_disputed_count('period', self.AWARDED_TO_BOOKER_STATUSES)
         if num:
             return round(
                 self.get_period_value_of_disputes_awarded_to_booker() / num,
@@ -913,34 +1500,16 @@ class StatsServiceDisputesByMDDProvider(StatsServiceDisputesProvider):
             )
 
     def get_period_percentage_of_disputes_awarded_to_performer(self) -> int:
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ]).count()
+        num = self._get_disputed_count('period', self.AWARDED_TO_PERFORMER_STATUSES)
         total = self.get_lifetime_reservations_disputed()
         if total:
             return int(num / total * 100)
 
     def get_period_value_of_disputes_awarded_to_performer(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ])
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('period', self.AWARDED_TO_PERFORMER_STATUSES)
 
     def get_period_average_value_of_disputes_awarded_to_performer(self) -> float:
-
-        num = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ]).count()
-
+        num = self._get_disputed_count('period', self.AWARDED_TO_PERFORMER_STATUSES)
         if num:
             return round(
                 self.get_period_value_of_disputes_awarded_to_performer() / num,
@@ -948,24 +1517,10 @@ class StatsServiceDisputesByMDDProvider(StatsServiceDisputesProvider):
             )
 
     def get_period_reservations_disputed(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ])
-        return bookings.count()
+        return self._get_disputed_count('period', self.DISPUTE_STATUSES)
 
     def get_period_disputed_reservations_value(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(date__gte=self.start_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ])
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('period', self.DISPUTE_STATUSES)
 
     def get_period_monthly_dispute_average_by_mdd(self) -> float:
         if self.months_in_period:
@@ -976,30 +1531,11 @@ class StatsServiceDisputesByMDDProvider(StatsServiceDisputesProvider):
 
     # have FIXED start_date - till the end date (NOW by default)
 
-    def get_lifetime_monthly_dispute_average_value_by_mdd(self) -> float:
-        if self.months_in_period:
-            return round(
-                self.get_lifetime_disputed_reservations_value() / self.months_in_period,
-                2
-            )
-
     def get_lifetime_reservations_disputed(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ])
-        return bookings.count()
+        return self._get_disputed_count('lifetime', self.DISPUTE_STATUSES)
 
     def get_lifetime_disputed_reservations_value(self) -> int:
-        bookings = Booking.objects.get_disputed() \
-            .filter_before_and_including_date(date=self.end_date) \
-            .filter(dispute__status__in=[
-                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
-                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-            ])
-        return self._calculate_bookings_value(bookings)
+        return self._get_disputed_value('lifetime', self.DISPUTE_STATUSES)
 
     def get_lifetime_monthly_dispute_average_by_mdd(self) -> float:
         if self.lifetime_months:
@@ -1016,139 +1552,319 @@ class StatsServiceDisputesByMDDProvider(StatsServiceDisputesProvider):
             )
 
     def get_ytd_reservations_disputed(self) -> int:
-        return self._get_bookings_disputed_from_date_by_mdd(
-            start_date=date(self.end_date.year, 1, 1)
-        ) \
-            .count()
+        return self._get_disputed_count('ytd', self.DISPUTE_STATUSES)
 
     def get_ytd_disputed_reservations_value(self) -> int:
-        return self._calculate_bookings_value(
-            self._get_bookings_disputed_from_date_by_mdd(
-                start_date=date(self.end_date.year, 1, 1)
-            )
-        )
+        return self._get_disputed_value('ytd', self.DISPUTE_STATUSES)
 
     def get_last_6_months_reservations_disputed(self) -> int:
-        return self._get_bookings_disputed_from_date_by_mdd(
-            start_date=self.end_date + relativedelta(months=-6)
-        ).count()
+        return self._get_disputed_count('last_6_months', self.DISPUTE_STATUSES)
 
     def get_last_6_months_disputed_reservations_value(self) -> int:
-        return self._calculate_bookings_value(
-            self._get_bookings_disputed_from_date_by_mdd(
-                start_date=self.end_date + relativedelta(months=-6)
-            )
-        )
+        return self._get_disputed_value('last_6_months', self.DISPUTE_STATUSES)
 
     def get_current_month_reservations_disputed(self) -> int:
-        return self._get_bookings_disputed_from_date_by_mdd(
-            start_date=date(self.end_date.year, self.end_date.month, 1)
-        ).count()
+        return self._get_disputed_count('current_month', self.DISPUTE_STATUSES)
 
     def get_current_month_disputed_reservations_value(self) -> int:
-        return self._calculate_bookings_value(
-            self._get_bookings_disputed_from_date_by_mdd(
-                start_date=date(self.end_date.year, self.end_date.month, 1)
-            )
-        )
+        return self._get_disputed_value('current_month', self.DISPUTE_STATUSES)
 
 
 class StatsBookerCreditsProvider(StatsProvider):
+    """
+    Wallet figures of account, all calculated by a single query (see credits)
+
+    Cached per account till the next transaction or balance change of its user
+    (released holds and deleted transactions) or change of its bookings
+    """
 
     def __init__(self, account):
         self.account = account
         self.date = timezone.now().date()
 
-    def _get_bookings_paid_by_booker(self):
-
-        completed_bookings = Booking.objects.filter(
-            status=Booking.Status.COMPLETED
-        ).by_booker(account=self.account)
+    def _get_cache_params(self) -> tuple:
+        return self.account.pk, self.date
+
+    def _get_cache_watermark(self) -> tuple:
+        return Account.objects.filter(pk=self.account.pk).annotate(
+            last_transaction_at=Subquery(
+                Transaction.objects.filter(user=OuterRef('user')).order_by('-created_at').values('created_at')[:1]
+            ),
+            balance_changed_at=Subquery(
+                UserBalance.objects.filter(user=OuterRef('user')).values('updated_at')
+            ),
+            last_booking_change_at=Subquery(
+                Booking.objects.filter_by_account(OuterRef('pk')).order_by('-updated_at').values('updated_at')[:1]
+            )
+        ).values_list('last_transaction_at', 'balance_changed_at', 'last_booking_change_at').first()
 
-        disputed_in_bookers_favor_bookings = Booking.objects.filter(
-            status=Booking.Status.DISPUTED
-        ) \
-        .filter(dispute__status__in=[
-            Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR, \
-            Dispute.Status.DJ_CONCEDED
-        ]) \
-        .by_booker(account=self.account)
+    def _get_credits_aggregates(self) -> dict:
+        """Sums over bookings of account by figure name"""
+        paid_by_booker = Q(account_booker=self.account) & (
+            Q(status=Booking.Status.COMPLETED) |
+            Q(status=Booking.Status.DISPUTED, dispute__status__in=[
+                Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
+                Dispute.Status.DJ_CONCEDED
+            ])
+        )
+        return {
+            'amount_in_escrow': Sum('total_price_cents', filter=Q(
+                account_booker=self.account, status=Booking.Status.ACCEPTED_BY_DJ
+            )),
+            'amount_in_pending_bookings': Sum('total_price_cents', filter=Q(
+                account_booker=self.account, status=Booking.Status.PAID
+            )),
+            'lifetime_paid_for_bookings': Sum('total_price_cents', filter=paid_by_booker),
+            'ytd_paid_for_bookings': Sum('total_price_cents', filter=paid_by_booker & Q(
+                date__gte=date(self.date.year, 1, 1)
+            )),
+        }
 
-        return completed_bookings | disputed_in_bookers_favor_bookings
+    @property
+    def credits(self) -> dict:
+        if not hasattr(self, '_credits'):
+            balance = Subquery(UserBalance.objects.filter(user=self.account.user_id).values('amount'))
+            result = Booking.objects.filter_by_account(self.account).aggregate(
+                # Max only allows to select balance together with bookings sums,
+                # the plain subquery is for account without bookings
+                credits_in_the_account=Coalesce(Max(balance), balance, 0),
+                **self._get_credits_aggregates()
+            )
+            self._credits = {key: value or 0 for key, value in result.items()}
+        return self._credits
 
     def get_credits_in_the_account(self):
-        return Transaction.objects.get_user_balance(
-            self.account.user)
+        return self.credits['credits_in_the_account']
 
     def get_amount_in_escrow(self):
-        return self._calculate_bookings_value(
-            Booking.objects.get_accepted_by_dj().by_booker(
-                account=self.account
-            )
-        )
+        return self.credits['amount_in_escrow']
 
     def get_lifetime_paid_for_bookings(self):
-        return self._calculate_bookings_value(
-            self._get_bookings_paid_by_booker()
-        )
+        return self.credits['lifetime_paid_for_bookings']
 
     def get_ytd_paid_for_bookings(self):
-        bookings = self._get_bookings_paid_by_booker().filter(
-            date__gte=date(self.date.year, 1, 1)
-        )
-        return self._calculate_bookings_value(bookings)
+        return self.credits['ytd_paid_for_bookings']
 
     def get_amount_in_pending_bookings(self):
-        return self._calculate_bookings_value(
-            Booking.objects.get_paid().by_booker(
-                account=self.account
-            )
-        )
+        return self.credits['amount_in_pending_bookings']
 
 
 class StatsPerformerCreditsProvider(StatsBookerCreditsProvider):
 
-    def __init__(self, account):
-        self.account = account
-        self.date = timezone.now().date()
-
-    def get_amount_in_escrow(self):
-        return self._calculate_bookings_value(
-            Booking.objects.get_accepted_by_dj().by_dj(
-                account=self.account
-            )
+    def _get_credits_aggregates(self) -> dict:
+        earned_by_performer = Q(account_dj=self.account) & (
+            Q(status=Booking.Status.COMPLETED) |
+            Q(status=Booking.Status.DISPUTED, dispute__status__in=[
+                Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
+            ])
         )
+        aggregates = super()._get_credits_aggregates()
+        aggregates.update({
+            'amount_in_escrow': Sum('total_price_cents', filter=Q(
+                account_dj=self.account, status=Booking.Status.ACCEPTED_BY_DJ
+            )),
+            'amount_in_pending_bookings': Sum('total_price_cents', filter=Q(
+                account_dj=self.account, status=Booking.Status.PAID
+            )),
+            'lifetime_earned_from_performances': Sum('dj_earnings_cents', filter=earned_by_performer),
+            'ytd_earned_from_performances': Sum('dj_earnings_cents', filter=earned_by_performer & Q(
+                date__gte=date(self.date.year, 1, 1)
+            )),
+        })
+        return aggregates
 
-    def get_amount_in_pending_bookings(self):
-        return self._calculate_bookings_value(
-            Booking.objects.get_paid().by_dj(
-                account=self.account
-            )
-        )
+    def get_lifetime_earned_from_performances(self):
+        return self.credits['lifetime_earned_from_performances']
 
-    def _get_bookings_earned_by_performer(self):
+    def get_ytd_earned_from_performances(self):
+        return self.credits['ytd_earned_from_performances']
 
-        completed_bookings = Booking.objects.filter(
-            status=Booking.Status.COMPLETED
-        ).by_dj(account=self.account)
 
-        disputed_in_dj_favor_bookings = Booking.objects.filter(
-            status=Booking.Status.DISPUTED
-        ) \
-        .filter(dispute__status__in=[
-            Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR
-        ]) \
-        .by_dj(account=self.account)
+# providers which figures of closed months are snapshotted
+SNAPSHOT_PROVIDERS = [
+    StatsServiceGigsAggregatedProvider,
+    StatsServiceCancelationsAggregatedProvider,
+    StatsServiceDisputesProvider,
+]
 
-        return completed_bookings | disputed_in_dj_favor_bookings
+# months aggregated by a single query while taking snapshots
+SNAPSHOT_MONTHS_PER_QUERY = 12
 
-    def get_lifetime_earned_from_performances(self):
-        return self._calculate_performers_earnings_from_bookings(
-            self._get_bookings_earned_by_performer()
-        )
 
-    def get_ytd_earned_from_performances(self):
-        bookings = self._get_bookings_earned_by_performer().filter(
-            date__gte=date(self.date.year, 1, 1)
-        )
-        return self._calculate_performers_earnings_from_bookings(bookings)
+def take_stats_snapshots(start_month: datetime.date = None, end_month: datetime.date = None,
+                         overwrite: bool = False) -> int:
+    """
+    Saves figures of SNAPSHOT_PROVIDERS for every settled month between start_month
+    and end_month (default - from month of the first booking till the last settled month,
+    see StatsMonthSnapshotManager.get_last_settled_month)
+
+    Already snapshotted months are skipped (unless snapshotted before they settled),
+    overwrite=True snapshots them again
+    (after later corrections of bookings)
+
+    Returns number of snapshots saved
+    """
+    last_settled_month = StatsMonthSnapshot.objects.get_last_settled_month()
+    if end_month is None or end_month > last_settled_month:
+        end_month = last_settled_month
+
+    if start_month is None:
+        start_month = Booking.objects.aggregate(first_date=Min('date'))['first_date']
+        if start_month is None:
+            return 0
+
+    months = []
+    month = date(start_month.year, start_month.month, 1)
+    while month <= end_month:
+        months.append(month)
+        month += relativedelta(months=1)
+
+    saved = 0
+    for provider_class in SNAPSHOT_PROVIDERS:
+        name = provider_class.SNAPSHOT_NAME
+        snapshotted = set() if overwrite else StatsMonthSnapshot.objects.get_months(name)
+        missing = [month for month in months if month not in snapshotted]
+        provider = provider_class(from_snapshots=False)
+
+        for i in range(0, len(missing), SNAPSHOT_MONTHS_PER_QUERY):
+            chunk = missing[i:i + SNAPSHOT_MONTHS_PER_QUERY]
+            figures = provider._aggregate_figures({
+                month: (month, StatsProvider._get_month_end(month)) for month in chunk
+            })
+            for month in chunk:
+                StatsMonthSnapshot.objects.save_data(name, month, figures[month])
+            saved += len(chunk)
+
+        logger.info('Stats snapshots "%s": %s months saved', name, len(missing))
+
+    return saved
+
+
+class StatsRunner:
+    """
+    Runs calculate_all of several providers concurrently,
+    each provider in a separate thread (so with its own DB connection)
+
+    Every provider should finish within its timeout since the run started,
+    otherwise its result is missing and error is reported instead;
+    queries of a provider are limited by the time remaining till its deadline,
+    so a timed out provider stops at its current query and releases its connection
+    """
+
+    def __init__(self, providers: dict, max_workers: int = 4, timeout: float = 30,
+                 timeouts: dict = None, profile: bool = False):
+        """
+        providers - name -> provider instance
+        timeouts - name -> timeout (seconds) for providers needing a specific one
+        max_workers=1 runs providers one after another in the current thread
+        profile - calculate providers with metrics profile (see StatsProvider.calculate_all)
+        """
+        self.providers = providers
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.timeouts = timeouts or {}
+        self.profile = profile
+
+    @classmethod
+    def for_dashboard(cls, start_date: datetime.date = None, end_date: datetime.date = None, **kwargs):
+        dates = dict(start_date=start_date, end_date=end_date)
+        return cls({
+            'general': StatsGeneralProvider(),
+            'kpi': StatsKPIProvider(),
+            'time': StatsServiceTimeProvider(),
+            'escrow': StatsServiceEscrowProvider(),
+            'gigs': StatsServiceGigsAggregatedProvider(**dates),
+            'cancelations': StatsServiceCancelationsAggregatedProvider(**dates),
+            'all_disputes': StatsServiceAllDisputesProvider(**dates),
+            'disputes_without_mdd': StatsServiceDisputesWithoutMDDProvider(**dates),
+            'disputes_by_mdd': StatsServiceDisputesByMDDProvider(**dates),
+        }, **kwargs)
+
+    def _get_timeout(self, name: str) -> float:
+        return self.timeouts.get(name, self.timeout)
+
+    @staticmethod
+    def _limit_query_time(deadline: float, execute, sql, params, many, context):
+        """Execute wrapper limiting query by statement_timeout to the time remaining till deadline"""
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError('deadline passed before query')
+        # set by the DB API cursor, so it isn't wrapped again
+        context['cursor'].cursor.execute('SET statement_timeout = %s', [max(int(remaining * 1000), 1)])
+        return execute(sql, params, many, context)
+
+    def _calculate(self, name: str, deadline: float = None):
+        """
+        calculate_all() of provider and its wall time; with deadline (time.monotonic() value) -
+        in a thread, its queries can't outlive the deadline even when the result is not awaited anymore
+        """
+        start = time.monotonic()
+        if deadline is None:
+            return self.providers[name].calculate_all(profile=self.profile), time.monotonic() - start
+        try:
+            with connection.execute_wrapper(partial(self._limit_query_time, deadline)):
+                return self.providers[name].calculate_all(profile=self.profile), time.monotonic() - start
+        except DatabaseError as e:
+            # query_canceled - by statement_timeout at the deadline
+            if getattr(e.__cause__, 'pgcode', None) == '57014':
+                raise TimeoutError('query canceled at deadline') from e
+            raise
+        finally:
+            connection.close()
+
+    def run(self) -> dict:
+        """
+        Returns:
+            results - name -> calculate_all() result, for providers calculated successfully
+            errors - name -> error text, for failed and timed out providers
+            timings - name -> wall time of provider (seconds)
+            profiles - name -> metrics profile, for providers calculated successfully with profile
+        """
+        report = {'results': {}, 'errors': {}, 'timings': {}}
+        if self.profile:
+            report['profiles'] = {}
+
+        if self.max_workers == 1:
+            for name in self.providers:
+                start = time.monotonic()
+                try:
+                    report['results'][name], report['timings'][name] = self._calculate(name)
+                except Exception as e:
+                    logger.exception('Stats provider %s failed', name)
+                    report['errors'][name] = f'{e.__class__.__name__}: {e}'
+                    report['timings'][name] = time.monotonic() - start
+            self._add_profiles(report)
+            return report
+
+        run_start = time.monotonic()
+        executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='stats')
+        futures = {
+            name: executor.submit(self._calculate, name, run_start + self._get_timeout(name))
+            for name in self.providers
+        }
+        try:
+            for name, future in futures.items():
+                remaining = run_start + self._get_timeout(name) - time.monotonic()
+                try:
+                    report['results'][name], report['timings'][name] = future.result(
+                        timeout=max(remaining, 0))
+                except (FuturesTimeoutError, TimeoutError):
+                    future.cancel()
+                    report['errors'][name] = f'Timeout: not calculated in {self._get_timeout(name)} s'
+                    report['timings'][name] = time.monotonic() - run_start
+                except Exception as e:
+                    logger.exception('Stats provider %s failed', name)
+                    report['errors'][name] = f'{e.__class__.__name__}: {e}'
+                    report['timings'][name] = time.monotonic() - run_start
+        finally:
+            # don't wait for timed out providers, they stop at their next query or by statement_timeout
+            executor.shutdown(wait=False)
+
+        logger.debug('Stats calculated in %.3f s: %s', time.monotonic() - run_start, report['timings'])
+        self._add_profiles(report)
+        return report
+
+    def _add_profiles(self, report: dict):
+        if self.profile:
+            for name in report['results']:
+                report['profiles'][name] = self.providers[name].metrics_profile
@@ -0,0 +1,480 @@
+import datetime
+import io
+import json
+import random
+import statistics
+import subprocess
+import time
+import tracemalloc
+from collections import defaultdict
+
+from booking.enums import TransactionPurposes
+from booking.models import Booking, BookingReview, Transaction, UserBalance
+from dispute.models import Dispute
+from django.conf import settings
+from django.core.management import call_command
+from django.db import connection, models, transaction
+from django.db.models import DateTimeField, ExpressionWrapper, F, OuterRef, Subquery
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from users.enums import Music
+from users.models import Account, BookerProfile, DJProfile, PastGig, RatingRecord
+
+from services import rating_engine, rating_stats
+from services.stats import (StatsBookerCreditsProvider, StatsPerformerCreditsProvider, StatsRunner,
+                            StatsServiceCancelationsAggregatedProvider,
+                            StatsServiceGigsAggregatedProvider, take_stats_snapshots)
+
+# number of bookings by scale name
+SCALES = {
+    '10k': 10_000,
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+# number of profiles (performers and bookers) by scale name of rating memory curve
+PROFILE_SCALES = {
+    '100k': 100_000,
+    '1m': 1_000_000,
+}
+
+# relative frequency of booking statuses in generated data
+STATUS_WEIGHTS = {
+    Booking.Status.NOT_PAID: 5,
+    Booking.Status.PAID: 6,
+    Booking.Status.DECLINED_BY_BOOKER: 3,
+    Booking.Status.DECLINED_BY_DJ: 3,
+    Booking.Status.SUCCESS: 4,
+    Booking.Status.COMPLETED: 50,
+    Booking.Status.ACCEPTED_BY_DJ: 8,
+    Booking.Status.CANCELED_BY_BOOKER: 5,
+    Booking.Status.CANCELED_BY_DJ: 4,
+    Booking.Status.REJECTED: 2,
+    Booking.Status.DECLINED_BY_STAFF: 1,
+    Booking.Status.IN_DISPUTE: 2,
+    Booking.Status.DISPUTED: 7,
+}
+
+# dispute statuses of disputed bookings (IN_DISPUTE bookings get the rest)
+RESOLVED_DISPUTE_STATUSES = [
+    Dispute.Status.DJ_CONCEDED,
+    Dispute.Status.RESOLVED_BY_STAFF_TO_BOOKER_FAVOR,
+    Dispute.Status.RESOLVED_BY_STAFF_TO_DJ_FAVOR,
+]
+
+# statuses of bookings paid by booker
+PAID_STATUSES = [
+    Booking.Status.PAID,
+    Booking.Status.SUCCESS,
+    Booking.Status.COMPLETED,
+    Booking.Status.ACCEPTED_BY_DJ,
+    Booking.Status.IN_DISPUTE,
+    Booking.Status.DISPUTED,
+]
+
+
+def _fill_required_fields(instance, related: dict):
+    """
+    Sets values of required fields left empty: first choice or zero value by field type,
+    required foreign keys - from related instances by related model
+    """
+    for field in instance._meta.concrete_fields:
+        if field.primary_key or field.null or field.has_default() or \
+                getattr(instance, field.attname) is not None:
+            continue
+        if field.is_relation:
+            setattr(instance, field.attname, related[field.related_model].pk)
+        elif field.choices:
+            setattr(instance, field.attname, field.choices[0][0])
+        elif isinstance(field, (models.CharField, models.TextField)):
+            setattr(instance, field.attname, '')
+        elif isinstance(field, models.BooleanField):
+            setattr(instance, field.attname, False)
+        elif isinstance(field, (models.IntegerField, models.FloatField, models.DecimalField)):
+            setattr(instance, field.attname, 0)
+        elif isinstance(field, (models.DateTimeField, models.DateField)):
+            setattr(instance, field.attname, timezone.now())
+    return instance
+
+
+def _clone(instance, prefix: str):
+    """Not saved copy of instance, unique string values are made unique by prefix"""
+    copy = instance.__class__()
+    for field in instance._meta.concrete_fields:
+        if field.primary_key:
+            continue
+        value = getattr(instance, field.attname)
+        if field.unique and field.has_default():
+            value = field.get_default()
+        elif field.unique and isinstance(value, str):
+            value = f'{prefix}{value}'[:field.max_length]
+        setattr(copy, field.attname, value)
+    return copy
+
+
+class BenchmarkDataGenerator:
+    """
+    Deterministic (by seed) synthetic data of given number of bookings:
+    performer and booker accounts, bookings in every status, reviews, disputes,
+    transactions and past gigs, dated back from anchor date
+
+    Accounts are copies of the first existing performer and booker accounts,
+    bulk created data is then processed like saved one (rollup, balances).
+    Number of profiles follows number of bookings unless profiles_count is given
+    (split between performers and bookers in the same proportion)
+    """
+
+    BATCH_SIZE = 5000
+    BOOKINGS_PER_PERFORMER = 50
+    BOOKINGS_PER_BOOKER = 20
+    DAYS = 3 * 365
+
+    def __init__(self, bookings_count: int, seed: int = 0, anchor_date: datetime.date = None, stdout=None,
+                 profiles_count: int = None):
+        self.bookings_count = bookings_count
+        self.profiles_count = profiles_count
+        self.seed = seed
+        self.anchor_date = anchor_date or timezone.now().date()
+        self.stdout = stdout
+        self.random = random.Random(seed)
+
+    def _log(self, message: str):
+        if self.stdout is not None:
+            self.stdout.write(message)
+
+    def get_profiles_counts(self) -> tuple:
+        """(performers, bookers) to create"""
+        if self.profiles_count is None:
+            return (max(2, self.bookings_count // self.BOOKINGS_PER_PERFORMER),
+                    max(2, self.bookings_count // self.BOOKINGS_PER_BOOKER))
+        performers = self.profiles_count * self.BOOKINGS_PER_BOOKER // \
+            (self.BOOKINGS_PER_PERFORMER + self.BOOKINGS_PER_BOOKER)
+        return max(2, performers), max(2, self.profiles_count - performers)
+
+    def generate(self):
+        performers_count, bookers_count = self.get_profiles_counts()
+        performers = self._create_accounts(DJProfile, 'dj_profile', performers_count)
+        bookers = self._create_accounts(BookerProfile, 'booker_profile', bookers_count)
+        self._log(f'{len(performers)} performers, {len(bookers)} bookers created')
+
+        first_pks = {
+            model: (model.objects.order_by('-pk').values_list('pk', flat=True).first() or 0) + 1
+            for model in [Booking, BookingReview, Dispute, Transaction]
+        }
+        balances = defaultdict(int)
+        for offset in range(0, self.bookings_count, self.BATCH_SIZE):
+            with transaction.atomic():
+                bookings = self._create_bookings(min(self.BATCH_SIZE, self.bookings_count - offset),
+                                                 performers, bookers)
+                self._create_reviews_and_disputes(bookings)
+                self._create_transactions(bookings, balances)
+            self._log(f'{offset + len(bookings)} bookings created')
+
+        self._create_past_gigs(performers)
+        self._backdate(first_pks)
+        self._create_balances(balances)
+        call_command('rebuild_booking_rollup', start_date=self.anchor_date - datetime.timedelta(days=self.DAYS),
+                     end_date=self.anchor_date + datetime.timedelta(days=self.DAYS // 10), stdout=io.StringIO())
+        take_stats_snapshots(overwrite=True)
+        self._log('Done')
+
+    def _create_accounts(self, profile_model, profile_lookup: str, count: int) -> list:
+        """[(account, profile)] copies of the first account having profile"""
+        template = Account.objects.filter(**{f'{profile_lookup}__isnull': False}) \
+            .select_related('user', profile_lookup).order_by('pk').first()
+        if template is None:
+            raise ValueError(f'Account with {profile_lookup} is needed as a template for generated accounts')
+        template_profile = getattr(template, profile_lookup)
+
+        prefix = f'bench{self.seed}_{profile_lookup}_'
+        users = template.user.__class__.objects.bulk_create(
+            [_clone(template.user, f'{prefix}{i}_') for i in range(count)], batch_size=self.BATCH_SIZE)
+
+        accounts = []
+        for user in users:
+            account = _clone(template, f'{prefix}{user.pk}_')
+            account.user_id = user.pk
+            accounts.append(account)
+        accounts = Account.objects.bulk_create(accounts, batch_size=self.BATCH_SIZE)
+
+        music_field = 'music_can_play' if profile_model is DJProfile else 'favorite_music'
+        profiles = []
+        for user, account in zip(users, accounts):
+            profile = _clone(template_profile, f'{prefix}{account.pk}_')
+            profile.account_id = account.pk
+            profile.user_id = user.pk
+            setattr(profile, music_field, self.random.sample(Music.values, self.random.randint(1, 4)))
+            profiles.append(profile)
+        profiles = profile_model.objects.bulk_create(profiles, batch_size=self.BATCH_SIZE)
+
+        RatingRecord.objects.bulk_create(
+            [_fill_required_fields(RatingRecord(**{profile_lookup: profile}), {}) for profile in profiles],
+            batch_size=self.BATCH_SIZE
+        )
+        return list(zip(accounts, profiles))
+
+    def _create_bookings(self, count: int, performers: list, bookers: list) -> list:
+        statuses, weights = list(STATUS_WEIGHTS), list(STATUS_WEIGHTS.values())
+        bookings = []
+        for _ in range(count):
+            status = self.random.choices(statuses, weights)[0]
+            # not finished bookings are mostly in the future
+            if status in [Booking.Status.PAID, Booking.Status.ACCEPTED_BY_DJ, Booking.Status.NOT_PAID]:
+                days = self.random.randint(-self.DAYS // 10, 30)
+            else:
+                days = self.random.randint(0, self.DAYS)
+            booking = Booking(
+                account_booker=self.random.choice(bookers)[0],
+                account_dj=self.random.choice(performers)[0],
+                comment='',
+                location_state=f'State {self.random.randint(1, 50)}',
+                location_city=f'City {self.random.randint(1, 500)}',
+                date=self.anchor_date - datetime.timedelta(days=days),
+                time=datetime.time(self.random.randint(8, 22), self.random.choice([0, 30])),
+                duration=self.random.choice([60, 90, 120, 180, 240, 300, 360, 480, 600, 780]),
+                price_per_hour=self.random.choice([50, 75, 100, 150, 200]),
+                payment_intent_id='',
+                payment_intent_client_secret='',
+                gig_type=self.random.choice(Booking.TYPES)[0],
+                music_list=self.random.sample(Music.values, self.random.randint(1, 3)),
+                clean_mix=self.random.random() < 0.3,
+                virtual_mix=self.random.random() < 0.2,
+                out_door_play=self.random.choice(Booking.OUT_DOOR_PLAYS)[0],
+                in_door_play=self.random.choice(Booking.IN_DOOR_PLAYS)[0],
+                status=status,
+            )
+            booking.set_calculated_fields()
+            bookings.append(booking)
+        return Booking.objects.bulk_create(bookings, batch_size=self.BATCH_SIZE)
+
+    def _create_reviews_and_disputes(self, bookings: list):
+        reviews, disputes = [], []
+        for booking in bookings:
+            if booking.status == Booking.Status.COMPLETED:
+                for is_by_booker in [True, False]:
+                    if self.random.random() < 0.7:
+                        reviews.append(BookingReview(
+                            booking=booking,
+                            rating=self.random.choices([1, 2, 3, 4, 5], [1, 1, 3, 8, 12])[0],
+                            is_by_booker=is_by_booker
+                        ))
+            elif booking.status in [Booking.Status.IN_DISPUTE, Booking.Status.DISPUTED]:
+                if booking.status == Booking.Status.DISPUTED:
+                    dispute_status = self.random.choice(RESOLVED_DISPUTE_STATUSES)
+                else:
+                    dispute_status = self.random.choice(
+                        [s for s in Dispute.Status.values if s not in RESOLVED_DISPUTE_STATUSES])
+                disputes.append(_fill_required_fields(
+                    Dispute(booking=booking, status=dispute_status),
+                    {Booking: booking, Account: booking.account_booker}
+                ))
+        BookingReview.objects.bulk_create(reviews, batch_size=self.BATCH_SIZE)
+        Dispute.objects.bulk_create(disputes, batch_size=self.BATCH_SIZE)
+
+    def _create_transactions(self, bookings: list, balances: dict):
+        transactions = []
+
+        def add(user_id: int, purpose: int, amount: int, booking: Booking):
+            transactions.append(Transaction(
+                user_id=user_id, purpose=purpose, amount=amount, entity='booking', entity_pk=booking.pk
+            ))
+            balances[user_id] += amount
+
+        for booking in bookings:
+            if booking.status not in PAID_STATUSES:
+                continue
+            booker_user_id = booking.account_booker.user_id
+            price = booking.total_price_cents
+            add(booker_user_id, TransactionPurposes.PAYMENT, price, booking)
+            add(booker_user_id, TransactionPurposes.BOOKING_ESCROW, -price, booking)
+            if booking.status == Booking.Status.COMPLETED:
+                add(booking.account_dj.user_id, TransactionPurposes.PAYMENT_TO_USER,
+                    booking.dj_earnings_cents, booking)
+        Transaction.objects.bulk_create(transactions, batch_size=self.BATCH_SIZE)
+
+    def _create_past_gigs(self, performers: list):
+        past_gigs = []
+        for account, profile in performers:
+            for _ in range(self.random.randint(0, 3)):
+                past_gigs.append(_fill_required_fields(
+                    PastGig(dj_profile=profile, value=self.random.randint(1, 5),
+                            is_confirm=self.random.random() < 0.8),
+                    {DJProfile: profile, Account: account}
+                ))
+        past_gigs = PastGig.objects.bulk_create(past_gigs, batch_size=self.BATCH_SIZE)
+        if past_gigs:
+            PastGig.objects.filter(pk__gte=past_gigs[0].pk).update(
+                created_at=timezone.now() - datetime.timedelta(days=self.DAYS // 2))
+
+    def _backdate(self, first_pks: dict):
+        """
+        Generated objects are created two weeks before event (bookings, transactions),
+        reviews and disputes - the day after event
+        """
+        event_date = {
+            Booking: F('date'),
+            BookingReview: Subquery(Booking.objects.filter(pk=OuterRef('booking')).values('date')),
+            Dispute: Subquery(Booking.objects.filter(pk=OuterRef('booking')).values('date')),
+            Transaction: Subquery(Booking.objects.filter(pk=OuterRef('entity_pk')).values('date')),
+        }
+        for model, days in [(Booking, -14), (Transaction, -14), (BookingReview, 1), (Dispute, 1)]:
+            created_at = ExpressionWrapper(event_date[model] + datetime.timedelta(days=days),
+                                           output_field=DateTimeField())
+            # reviews are not edited after they are created
+            fields = ['created_at', 'updated_at'] if model is BookingReview else ['created_at']
+            model.objects.filter(pk__gte=first_pks[model]).update(**{field: created_at for field in fields})
+
+    def _create_balances(self, balances: dict):
+        UserBalance.objects.bulk_create(
+            [UserBalance(user_id=user_id, amount=amount) for user_id, amount in balances.items()],
+            batch_size=self.BATCH_SIZE
+        )
+
+
+class StatsBenchmark:
+    """
+    Wall time (median of repeats, seconds), number of queries and peak Python memory (bytes)
+    of every stats provider calculate_all(), every rating calculator and the rating pipeline
+
+    Peak memory is measured by a separate run, as tracing slows code down
+    """
+
+    def __init__(self, repeat: int = 3):
+        self.repeat = repeat
+
+    def get_targets(self) -> dict:
+        """Benchmark name -> function"""
+        today = timezone.now().date()
+        start_date = datetime.date(today.year, 1, 1)
+        targets = {}
+
+        providers = dict(StatsRunner.for_dashboard(start_date, today).providers)
+        # dashboard providers take closed months from snapshots, these calculate all months
+        for name, provider_class in [('gigs', StatsServiceGigsAggregatedProvider),
+                                     ('cancelations', StatsServiceCancelationsAggregatedProvider)]:
+            providers[f'{name}_live'] = provider_class(start_date=start_date, end_date=today,
+                                                       from_snapshots=False)
+            providers[f'{name}_from_rollup'] = provider_class(start_date=start_date, end_date=today,
+                                                              from_rollup=True, from_snapshots=False)
+        for name, provider_class, profile_lookup in [
+            ('booker_credits', StatsBookerCreditsProvider, 'booker_profile'),
+            ('performer_credits', StatsPerformerCreditsProvider, 'dj_profile'),
+        ]:
+            account = Account.objects.filter(**{f'{profile_lookup}__isnull': False}).order_by('pk').last()
+            if account is not None:
+                providers[name] = provider_class(account)
+
+        for name, provider in providers.items():
+            targets[f'stats.{name}'] = lambda provider=provider: provider.calculate_all(use_cache=False)
+
+        for calculator_class in rating_stats.RatingPipeline.CALCULATORS:
+            def calculate(calculator_class=calculator_class):
+                calculator = calculator_class()
+                calculator.calculate()
+                calculator.update_records()
+            targets[f'rating.{calculator_class.__name__}'] = calculate
+        targets['rating.total_rating'] = lambda: rating_stats.RatingCalculator().calculate_and_update_total_rating()
+        targets['rating.pipeline'] = lambda: rating_stats.RatingPipeline(vectorized=False).run()
+        if rating_engine.is_available():
+            targets['rating.pipeline_vectorized'] = lambda: rating_stats.RatingPipeline(vectorized=True).run()
+        return targets
+
+    def measure(self, func) -> dict:
+        timings = []
+        for _ in range(self.repeat):
+            with CaptureQueriesContext(connection) as context:
+                started_at = time.perf_counter()
+                func()
+                timings.append(time.perf_counter() - started_at)
+
+        tracemalloc.start()
+        try:
+            func()
+            _, peak_memory = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'wall_time': round(statistics.median(timings), 4),
+            'queries': len(context.captured_queries),
+            'peak_memory': peak_memory,
+        }
+
+    def run(self, names: list = None, stdout=None) -> dict:
+        results = {}
+        for name, func in self.get_targets().items():
+            if names and not any(name.startswith(n) for n in names):
+                continue
+            results[name] = self.measure(func)
+            if stdout is not None:
+                stdout.write(f'{name}: {results[name]}')
+        return {
+            'meta': self.get_meta(),
+            'results': results,
+        }
+
+    def get_meta(self) -> dict:
+        try:
+            commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                                    cwd=getattr(settings, 'BASE_DIR', None)).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            commit = None
+        return {
+            'commit': commit,
+            'created_at': timezone.now().isoformat(),
+            'database': f"{connection.vendor} {getattr(connection, 'pg_version', '')}",
+            'bookings': Booking.objects.count(),
+            'repeat': self.repeat,
+        }
+
+    @staticmethod
+    def write(results: dict, path: str):
+        with open(path, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+class RatingMemoryBenchmark(StatsBenchmark):
+    """
+    Memory curve of rating updates: data is generated up to every profile scale in turn
+    (a booking per new profile), then the rating pipeline and the calculators one by one
+    are measured once. Flat peak memory between scales shows the runs are bounded by chunk size
+
+    Generated accounts of every step use own seed (seed + step), it should differ
+    from seeds of data generated before
+    """
+
+    def __init__(self, scales: list, seed: int = 0, chunk_size: int = None):
+        super().__init__(repeat=1)
+        self.scales = sorted(scales, key=PROFILE_SCALES.get)
+        self.seed = seed
+        self.chunk_size = chunk_size
+
+    def get_targets(self) -> dict:
+        def calculate_all():
+            for calculator_class in rating_stats.RatingPipeline.CALCULATORS:
+                calculator = calculator_class()
+                calculator.calculate()
+                calculator.update_records(self.chunk_size)
+
+        return {
+            'rating.pipeline': lambda: rating_stats.RatingPipeline(chunk_size=self.chunk_size).run(),
+            'rating.calculators': calculate_all,
+        }
+
+    def run(self, names: list = None, stdout=None) -> dict:
+        curve = []
+        for step, scale in enumerate(self.scales):
+            missing = PROFILE_SCALES[scale] - RatingRecord.objects.count()
+            if missing > 0:
+                BenchmarkDataGenerator(missing, seed=self.seed + step, stdout=stdout,
+                                       profiles_count=missing).generate()
+            point = {
+                'scale': scale,
+                'profiles': RatingRecord.objects.count(),
+                'results': super().run(names, stdout=stdout)['results'],
+            }
+            curve.append(point)
+        return {
+            'meta': dict(self.get_meta(), chunk_size=self.chunk_size or rating_stats.RatingCalculator.CHUNK_SIZE),
+            'curve': curve,
+        }